@@ -1,5 +1,7 @@
-from typing import Dict
+from typing import Dict, List
 from logger_config import get_logger
+from prompts import critique_messages
+from tracing import record_llm_usage, span
 
 class SelfReflectionCritic:
     """Simple critic for self-reflection with logging"""
@@ -9,34 +11,48 @@ class SelfReflectionCritic:
     
     def critique(self, question: str, context: str, answer: str) -> Dict:
         """Evaluate if answer needs improvement"""
-        self.logger.info(f"Evaluating answer for: '{question[:50]}...'")
+        self.logger.info("Evaluating answer for: '%.50s...'", question)
         
-        critique_prompt = f"""
-        Question: {question}
-        Context Retrieved: {context[:500]}...
-        Generated Answer: {answer}
-        
-        Evaluate this answer:
-        1. Is it accurate based on the context?
-        2. Is it complete?
-        3. Does it need improvement?
-        
-        Respond with:
-        - "GOOD" if answer is satisfactory
-        - "IMPROVE: <reason>" if it needs work
-        """
+        try:
+            prompt = self._build_prompt(question, context, answer)
+            with span("critique"):
+                response = self.llm.invoke(prompt)
+            record_llm_usage("critique", prompt, response.content, getattr(response, "usage_metadata", None))
+            return self._parse(response.content)
+        except Exception as e:
+            self.logger.error("Critique failed: %s", e, exc_info=True)
+            return self._unavailable(e)
+    
+    async def acritique(self, question: str, context: str, answer: str) -> Dict:
+        """Async version of critique built on ainvoke"""
+        self.logger.info("Evaluating answer for: '%.50s...'", question)
         
         try:
-            response = self.llm.invoke(critique_prompt)
-            content = response.content.strip()
-            
-            if content.startswith("GOOD"):
-                self.logger.info("Critique result: APPROVED")
-                return {"status": "approved", "feedback": "Answer is satisfactory"}
-            else:
-                self.logger.info(f"Critique result: NEEDS IMPROVEMENT - {content}")
-                return {"status": "needs_improvement", "feedback": content}
+            prompt = self._build_prompt(question, context, answer)
+            with span("critique"):
+                response = await self.llm.ainvoke(prompt)
+            record_llm_usage("critique", prompt, response.content, getattr(response, "usage_metadata", None))
+            return self._parse(response.content)
         except Exception as e:
-            self.logger.error(f"Critique failed: {str(e)}", exc_info=True)
-            # Return approval as fallback
-            return {"status": "approved", "feedback": "Error in critique, accepting answer"}
+            self.logger.error("Critique failed: %s", e, exc_info=True)
+            return self._unavailable(e)
+    
+    def _unavailable(self, error: Exception) -> Dict:
+        """Verdict when the critic could not be reached: the answer stands but is not approved,
+        so it is neither revised nor cached as reviewed"""
+        return {"status": "unavailable", "feedback": f"Critique failed: {error}"}
+    
+    def _build_prompt(self, question: str, context: str, answer: str) -> List:
+        """Build the critique prompt: the shared system message, then this answer"""
+        return critique_messages(question, context, answer)
+    
+    def _parse(self, content: str) -> Dict:
+        """Turn the critic's reply into a verdict"""
+        content = content.strip()
+        
+        if content.startswith("GOOD"):
+            self.logger.info("Critique result: APPROVED")
+            return {"status": "approved", "feedback": "Answer is satisfactory"}
+        else:
+            self.logger.info("Critique result: NEEDS IMPROVEMENT - %s", content)
+            return {"status": "needs_improvement", "feedback": content}
@@ -0,0 +1,193 @@
+"""
+Agent lifecycle for the API servers
+
+Building the agent (index, chunk store, Azure clients) is deferred until it
+is needed, so importing api.py or asgi.py is cheap and cannot fail. AGENT_STARTUP
+selects when it happens:
+- lazy (default): on the first request or readiness probe
+- eager: when the server starts, including the per-process warm-up
+- preload: at import, for gunicorn --preload. The master loads the index and
+  pages it in, and forked workers share those pages copy-on-write. Each worker
+  finishes warm-up (dummy search, connection priming) in the background after
+  the fork, because threads and sockets do not survive it.
+WARMUP=0 skips warm-up and WARMUP_LLM=1 also primes the chat model's connection
+(one single-token completion). Once a process is ready it starts polling for
+new index versions, if the agent has an IndexReloader.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from logger_config import get_logger
+
+STARTUP_MODES = ("lazy", "eager", "preload")
+WARMUP_QUERY = "warm-up"
+
+NOT_LOADED, LOADING, WARMING, READY, FAILED = "not_loaded", "loading", "warming", "ready", "failed"
+
+def _default_factory():
+    from main import setup_agent
+    return setup_agent()
+
+class AgentRuntime:
+    """Builds the agent once per process on demand and tracks its readiness"""
+    def __init__(self, factory: Optional[Callable] = None, mode: Optional[str] = None,
+                 warmup: Optional[bool] = None, warmup_llm: Optional[bool] = None):
+        self.factory = factory or _default_factory
+        self.mode = mode or os.getenv("AGENT_STARTUP", "lazy")
+        if self.mode not in STARTUP_MODES:
+            raise ValueError(f"Unknown AGENT_STARTUP: {self.mode}")
+        self.warmup = warmup if warmup is not None else os.getenv("WARMUP", "1") == "1"
+        self.warmup_llm = warmup_llm if warmup_llm is not None else os.getenv("WARMUP_LLM", "0") == "1"
+        self.logger = get_logger('api')
+        
+        self.agent = None
+        self.state = NOT_LOADED
+        self.error = None
+        self.timings = {}  # Seconds per startup phase
+        self._lock = threading.Lock()
+        self._warm_pid = None  # Process whose search path and connections are warm
+        self._startup_thread = None
+        os.register_at_fork(after_in_child=self._after_fork)
+    
+    @property
+    def ready(self) -> bool:
+        """Whether the agent is built and this process warmed up"""
+        return self.state == READY and self._warm_pid == os.getpid()
+    
+    def start(self, warm: Optional[bool] = None):
+        """Apply AGENT_STARTUP: build now unless lazy, warming up only if eager (or ``warm``)"""
+        if self.mode == "lazy":
+            return
+        try:
+            # Preloading runs before the fork: no search threads or sockets yet
+            self.get(warm=self.mode == "eager" if warm is None else warm)
+        except Exception:
+            pass  # Logged by get; requests and /ready report it and retry
+    
+    def set(self, agent):
+        """Serve an agent built elsewhere, e.g. on fake backends"""
+        with self._lock:
+            self.agent = agent
+            self.state = READY
+            self.error = None
+            self._warm_pid = os.getpid()
+    
+    def get(self, warm: bool = True):
+        """The agent, building it (and warming this process) first if needed"""
+        agent = self.agent
+        if agent is not None and (not warm or self.ready):
+            return agent
+        
+        with self._lock:
+            if self.agent is None:
+                self._load()
+            if warm and self._warm_pid != os.getpid():
+                self._warm_up()
+            return self.agent
+    
+    def start_background(self):
+        """Build and warm up on a background thread, unless already done or under way"""
+        if self._startup_thread is not None and self._startup_thread.is_alive():
+            return
+        if self.ready:
+            return
+        self._startup_thread = threading.Thread(target=self._get_quietly, name="agent-startup", daemon=True)
+        self._startup_thread.start()
+    
+    def readiness(self) -> Dict:
+        """Whether this process can serve requests, with startup details"""
+        status = {"ready": self.ready, "state": self.state, "mode": self.mode, "pid": os.getpid()}
+        if self.timings:
+            status["startup_seconds"] = {phase: round(seconds, 3) for phase, seconds in self.timings.items()}
+        if self.error:
+            status["error"] = self.error
+        return status
+    
+    def _get_quietly(self):
+        try:
+            self.get()
+        except Exception:
+            pass
+    
+    def _load(self):
+        self.state = LOADING
+        self.logger.info("Initializing agent (AGENT_STARTUP=%s)...", self.mode)
+        start = time.perf_counter()
+        try:
+            agent = self.factory()
+        except Exception as e:
+            self.state = FAILED
+            self.error = str(e)
+            self.logger.error("Failed to initialize agent: %s", e, exc_info=True)
+            raise
+        self.timings["load"] = time.perf_counter() - start
+        
+        self.agent = agent
+        self.error = None
+        if self.warmup:
+            self._timed("page_in", self._page_in)
+        self.state = WARMING if self.warmup else READY
+        self.logger.info("Agent initialized in %.2fs", self.timings["load"])
+    
+    def _warm_up(self):
+        """Per-process warm-up: a dummy search and connection priming"""
+        if self.warmup:
+            self.state = WARMING
+            self._timed("search", self._dummy_search)
+            self._timed("connections", self._prime_connections)
+            self.logger.info("Warm-up done: %s", ", ".join(
+                f"{phase} {seconds:.2f}s" for phase, seconds in self.timings.items()))
+        self._warm_pid = os.getpid()
+        self.state = READY
+        reloader = getattr(self.agent, "reloader", None)
+        if reloader is not None:
+            reloader.start()
+    
+    def _timed(self, phase: str, step: Callable):
+        """Run one warm-up step; a failed step is logged but does not block readiness"""
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            self.logger.warning("Warm-up step %s failed: %s", phase, e)
+        self.timings[phase] = time.perf_counter() - start
+    
+    def _vectorstore(self):
+        return self.agent.retriever.retriever.vectorstore
+    
+    def _page_in(self):
+        """Fault the index files into the OS page cache, shared by all workers"""
+        vectorstore = self._vectorstore()
+        if hasattr(vectorstore, "page_in"):
+            self.logger.info("Paged in %d MB of index files", vectorstore.page_in() // (1024 * 1024))
+    
+    def _dummy_search(self):
+        """Exercise the search path once so the first query does not pay for lazy setup"""
+        vectorstore = self._vectorstore()
+        if hasattr(vectorstore, "warm_up"):
+            vectorstore.warm_up()
+            return
+        index = getattr(vectorstore, "index", None)
+        if index is not None and index.ntotal:
+            vectorstore.similarity_search_with_score_by_vector([0.0] * index.d, k=1)
+    
+    def _prime_connections(self):
+        """Open the HTTP connection pools with one uncached embedding (and optionally one completion)"""
+        embeddings = self._vectorstore().embeddings
+        getattr(embeddings, "embedding", embeddings).embed_query(WARMUP_QUERY)
+        if self.warmup_llm:
+            self.agent.llm.invoke(WARMUP_QUERY, max_tokens=1)
+    
+    def _after_fork(self):
+        """In a forked worker: fresh lock, and finish warm-up here unless startup is lazy"""
+        self._lock = threading.Lock()
+        self._startup_thread = None
+        if self.agent is None:
+            return
+        if self.warmup:
+            self.state = WARMING
+        if self.mode != "lazy":
+            self.start_background()
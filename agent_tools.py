@@ -1,25 +1,400 @@
-from typing import List, Dict
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Sequence, Tuple
+import numpy as np
+from chunk_store import ChunkView
 from logger_config import get_logger
+from micro_batch import MICRO_BATCH_SIZE, MicroBatcher
+from tracing import span
 
-class RetrieverTool:
-    """Simple retriever tool wrapper with logging"""
-    def __init__(self, retriever):
+HYBRID_FETCH_K = 20  # Candidates taken from each retriever before fusion
+RRF_K = 60  # Reciprocal rank fusion damping constant
+
+def l2_to_similarity(distance: float) -> float:
+    """Cosine similarity from a squared L2 distance between unit vectors (ada-002 embeddings are normalized)"""
+    return 1.0 - distance / 2.0
+
+def reciprocal_rank_fusion(rankings: Sequence[List[Tuple[int, float]]], k: int = RRF_K) -> List[int]:
+    """Merge ranked (id, score) lists by summing 1 / (k + rank) per id, best first"""
+    fused = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused, key=fused.get, reverse=True)
+
+class SearchIndex:
+    """One loaded index: the LangChain retriever over its vector store and the optional BM25 index"""
+    def __init__(self, retriever, lexical=None, version: Optional[str] = None):
         self.retriever = retriever
+        self.lexical = lexical
+        self.version = version  # Published version name, None for an unversioned index directory
+
+class RetrieverTool:
+    """Simple retriever tool wrapper with logging
+    
+    Pass a ``lexical`` BM25 index over the same vector ids to switch to hybrid
+    retrieval: dense and BM25 search run in parallel and their rankings are
+    merged with reciprocal rank fusion. Hybrid mode needs a vector store
+    with ``search_ids`` and a chunk store, i.e. ``MmapVectorStore``.
+    
+    Each result carries the dense ``similarity`` of the chunk to the query
+    (also in its ``metadata``), or None for chunks only BM25 found.
+    
+    ``run_batch`` embeds many queries in one request and searches them with
+    one batched index search. Set ``micro_batch_wait`` (seconds) to have
+    concurrent ``aembed_query`` and ``arun`` calls coalesced the same way.
+    
+    With a chunk store, results are ChunkViews over vector ids rather than
+    copied dicts, and a ``cache`` (RetrievalCache) skips the search for
+    queries seen before up to case, whitespace and punctuation.
+    
+    ``swap`` replaces the index being searched. Each call works on the index
+    it started with, so in-flight requests finish on the old one.
+    
+    With a ``selector`` (ResultSelector) and a store that returns vectors,
+    the dense search over-fetches candidates with their vectors and the
+    selector picks the final k: relevance threshold, MMR and per-source cap.
+    In hybrid mode it picks from the fused candidates of both searches.
+    """
+    def __init__(self, retriever, lexical=None, fetch_k=HYBRID_FETCH_K, micro_batch_wait=0.0,
+                 micro_batch_size=MICRO_BATCH_SIZE, cache=None, index_version=None, selector=None):
+        self.index = SearchIndex(retriever, lexical, index_version)
+        self.fetch_k = fetch_k
+        self.cache = cache
+        self.selector = selector
         self.name = "medical_knowledge_retriever"
         self.description = "Retrieves relevant medical information from the knowledge base"
         self.logger = get_logger('retriever')
+        # Threads start on first use, so vector-only retrieval never spawns any
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retriever")
+        
+        self._embed_batcher = self._search_batcher = None
+        if micro_batch_wait > 0:
+            self._embed_batcher = MicroBatcher(self.aembed_queries, micro_batch_wait, micro_batch_size)
+            self._search_batcher = MicroBatcher(self._asearch_batch, micro_batch_wait, micro_batch_size)
+    
+    @property
+    def retriever(self):
+        return self.index.retriever
+    
+    @property
+    def lexical(self):
+        return self.index.lexical
     
-    def run(self, query: str) -> List[Dict]:
-        """Execute retriever and return documents"""
-        self.logger.info(f"Retrieval query: '{query}'")
+    def swap(self, index: SearchIndex) -> SearchIndex:
+        """Search ``index`` from now on; returns the previous one"""
+        previous, self.index = self.index, index
+        return previous
+    
+    def micro_batch_stats(self) -> Optional[Dict]:
+        """Coalescing statistics of the micro-batchers, if enabled"""
+        if self._embed_batcher is None:
+            return None
+        return {"embedding": self._embed_batcher.stats(), "search": self._search_batcher.stats()}
+    
+    def retrieval_cache_stats(self) -> Optional[Dict]:
+        """Hit-rate statistics of the retrieval cache, if enabled"""
+        return self.cache.stats() if self.cache is not None else None
+    
+    def shard_stats(self) -> Optional[Dict]:
+        """Scatter-gather statistics of a sharded vector store, if in use"""
+        vectorstore = self.retriever.vectorstore
+        return vectorstore.stats() if hasattr(vectorstore, "stats") else None
+    
+    def embedding_cache_stats(self) -> Optional[Dict]:
+        """Hit-rate statistics of the embedding cache, if the store uses one"""
+        embeddings = self.retriever.vectorstore.embeddings
+        return embeddings.stats() if hasattr(embeddings, "stats") else None
+    
+    def embedding_client_stats(self) -> Optional[Dict]:
+        """Retry, hedging and circuit breaker statistics of the client behind the embedding cache, if any"""
+        client = getattr(self.retriever.vectorstore.embeddings, "embedding", None)
+        return client.stats() if hasattr(client, "stats") else None
+    
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query with the vector store's embedding model"""
+        with span("embedding"):
+            return self.retriever.vectorstore.embeddings.embed_query(query)
+    
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embed many queries in one embedding request"""
+        with span("batch_embedding"):
+            return self.retriever.vectorstore.embeddings.embed_documents(queries)
+    
+    def run(self, query: str, embedding: Optional[List[float]] = None) -> List:
+        """Execute retriever and return documents
+        
+        Pass ``embedding`` to reuse a query embedding the caller already computed.
+        """
+        self.logger.info("Retrieval query: '%s'", query)
         
         try:
-            docs = self.retriever.invoke(query)
-            result = [{"content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+            index = self.index
+            result = self._cached(index, query)
+            if result is None:
+                if embedding is None:
+                    embedding = self.embed_query(query)
+                with span("retrieval"):
+                    if self._by_id(index):
+                        result = self._views(index, self._store(index, query, self._rank(index, query, embedding)))
+                    else:
+                        docs = index.retriever.vectorstore.similarity_search_with_score_by_vector(
+                            embedding, **index.retriever.search_kwargs
+                        )
+                        result = self._as_results([(doc, l2_to_similarity(distance)) for doc, distance in docs])
             
-            self.logger.info(f"Retrieved {len(result)} documents")
-            self.logger.debug(f"Document IDs: {[doc.metadata.get('source', 'unknown') for doc in docs]}")
+            self._log_results(result)
             return result
         except Exception as e:
-            self.logger.error(f"Retrieval failed: {str(e)}", exc_info=True)
-            raise
\ No newline at end of file
+            self.logger.error("Retrieval failed: %s", e, exc_info=True)
+            raise
+    
+    def run_batch(self, queries: List[str], embeddings: Optional[List[List[float]]] = None) -> List[List]:
+        """Documents for each of ``queries``, in order, from one batched index search
+        
+        Cached queries are not searched again. Vector stores without
+        ``search_ids_batch`` are searched query by query.
+        """
+        self.logger.info("Batch retrieval for %d queries", len(queries))
+        if not queries:
+            return []
+        
+        try:
+            index = self.index
+            if not self._by_id(index):
+                if embeddings is None:
+                    embeddings = self.embed_queries(queries)
+                return [self.run(query, embedding=embedding) for query, embedding in zip(queries, embeddings)]
+            
+            rankings = [self._cached_ranking(index, query) for query in queries]
+            misses = [i for i, ranking in enumerate(rankings) if ranking is None]
+            if misses:
+                miss_queries = [queries[i] for i in misses]
+                if embeddings is None:
+                    miss_embeddings = self.embed_queries(miss_queries)
+                else:
+                    miss_embeddings = [embeddings[i] for i in misses]
+                for i, ranking in zip(misses, self._search_batch(index, miss_queries, miss_embeddings)):
+                    rankings[i] = ranking
+            
+            self.logger.info("Retrieved %d documents for %d queries (%d cached)",
+                             sum(len(ranking) for ranking in rankings), len(queries), len(queries) - len(misses))
+            return [self._views(index, ranking) for ranking in rankings]
+        except Exception as e:
+            self.logger.error("Batch retrieval failed: %s", e, exc_info=True)
+            raise
+    
+    async def aembed_query(self, query: str) -> List[float]:
+        """Async version of embed_query, coalesced with concurrent calls when micro-batching"""
+        with span("embedding"):
+            if self._embed_batcher is not None:
+                return await self._embed_batcher.submit(query)
+            return await self.retriever.vectorstore.embeddings.aembed_query(query)
+    
+    async def aembed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Async version of embed_queries"""
+        with span("batch_embedding"):
+            return await self.retriever.vectorstore.embeddings.aembed_documents(queries)
+    
+    async def arun_batch(self, queries: List[str],
+                         embeddings: Optional[List[List[float]]] = None) -> List[List]:
+        """Async version of run_batch; the search runs in the default executor"""
+        if embeddings is None:
+            embeddings = await self.aembed_queries(queries)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, contextvars.copy_context().run, self.run_batch, queries, embeddings
+        )
+    
+    async def arun(self, query: str, embedding: Optional[List[float]] = None) -> List:
+        """Async version of run; the FAISS search itself runs in the default executor"""
+        self.logger.info("Retrieval query: '%s'", query)
+        
+        try:
+            index = self.index
+            result = self._cached(index, query)
+            if result is None:
+                if embedding is None:
+                    embedding = await self.aembed_query(query)
+                with span("retrieval"):
+                    if self._search_batcher is not None:
+                        result = await self._search_batcher.submit((query, embedding))
+                    elif self._by_id(index):
+                        ranking = await self._arank(index, query, embedding)
+                        result = self._views(index, self._store(index, query, ranking))
+                    else:
+                        docs = await index.retriever.vectorstore.asimilarity_search_with_score_by_vector(
+                            embedding, **index.retriever.search_kwargs
+                        )
+                        result = self._as_results([(doc, l2_to_similarity(distance)) for doc, distance in docs])
+            
+            self._log_results(result)
+            return result
+        except Exception as e:
+            self.logger.error("Retrieval failed: %s", e, exc_info=True)
+            raise
+    
+    async def _asearch_batch(self, items: List[Tuple[str, List[float]]]) -> List[List]:
+        """Micro-batch target: (query, embedding) pairs to their documents
+        
+        arun has already missed the cache for these, so they are searched directly.
+        """
+        queries, embeddings = [query for query, _ in items], [embedding for _, embedding in items]
+        index = self.index
+        if not self._by_id(index):
+            return await self.arun_batch(queries, embeddings)
+        rankings = await asyncio.get_running_loop().run_in_executor(
+            None, contextvars.copy_context().run, self._search_batch, index, queries, embeddings
+        )
+        return [self._views(index, ranking) for ranking in rankings]
+    
+    @staticmethod
+    def _by_id(index: SearchIndex) -> bool:
+        """Whether the store is searched by vector id with a chunk store to resolve them (MmapVectorStore)"""
+        return hasattr(index.retriever.vectorstore, "search_ids_batch")
+    
+    @staticmethod
+    def _k(index: SearchIndex) -> int:
+        return index.retriever.search_kwargs.get("k", 4)
+    
+    def _cached_ranking(self, index: SearchIndex, query: str) -> Optional[List[Tuple[int, Optional[float]]]]:
+        if self.cache is None or not self._by_id(index):
+            return None
+        return self.cache.get(query, index.retriever.vectorstore.version)
+    
+    def _cached(self, index: SearchIndex, query: str) -> Optional[List[ChunkView]]:
+        """Documents from the retrieval cache, if this query was searched before"""
+        ranking = self._cached_ranking(index, query)
+        if ranking is None:
+            return None
+        self.logger.info("Retrieval cache hit")
+        return self._views(index, ranking)
+    
+    def _store(self, index: SearchIndex, query: str,
+               ranking: List[Tuple[int, Optional[float]]]) -> List[Tuple[int, Optional[float]]]:
+        if self.cache is not None:
+            self.cache.put(query, index.retriever.vectorstore.version, ranking)
+        return ranking
+    
+    def _rank(self, index: SearchIndex, query: str, embedding: List[float]) -> List[Tuple[int, Optional[float]]]:
+        """Top-k (vector id, dense similarity) pairs for a query"""
+        if self._selects(index):
+            return self._select_batch(index, [query], [embedding])[0]
+        vectorstore = index.retriever.vectorstore
+        if index.lexical is not None:
+            dense = self._pool.submit(vectorstore.search_ids, embedding, self.fetch_k)
+            lexical = index.lexical.search(query, self.fetch_k)
+            return self._fuse(index, dense.result(), lexical)
+        return [(i, l2_to_similarity(distance)) for i, distance in vectorstore.search_ids(embedding, self._k(index))]
+    
+    async def _arank(self, index: SearchIndex, query: str,
+                     embedding: List[float]) -> List[Tuple[int, Optional[float]]]:
+        """Async version of _rank"""
+        vectorstore = index.retriever.vectorstore
+        loop = asyncio.get_running_loop()
+        if self._selects(index):
+            rankings = await loop.run_in_executor(
+                None, contextvars.copy_context().run, self._select_batch, index, [query], [embedding]
+            )
+            return rankings[0]
+        if index.lexical is not None:
+            dense, lexical = await asyncio.gather(
+                loop.run_in_executor(self._pool, vectorstore.search_ids, embedding, self.fetch_k),
+                loop.run_in_executor(self._pool, index.lexical.search, query, self.fetch_k),
+            )
+            return self._fuse(index, dense, lexical)
+        ranking = await loop.run_in_executor(None, vectorstore.search_ids, embedding, self._k(index))
+        return [(i, l2_to_similarity(distance)) for i, distance in ranking]
+    
+    def _rank_batch(self, index: SearchIndex, queries: List[str],
+                    embeddings: List[List[float]]) -> List[List[Tuple[int, Optional[float]]]]:
+        """_rank for many queries with one batched index search"""
+        if self._selects(index):
+            return self._select_batch(index, queries, embeddings)
+        lexical_index = index.lexical
+        dense = index.retriever.vectorstore.search_ids_batch(
+            embeddings, self.fetch_k if lexical_index is not None else self._k(index)
+        )
+        if lexical_index is None:
+            return [[(i, l2_to_similarity(distance)) for i, distance in ranking] for ranking in dense]
+        lexical = list(self._pool.map(lambda query: lexical_index.search(query, self.fetch_k), queries))
+        return [self._fuse(index, ranking, lexical_ranking) for ranking, lexical_ranking in zip(dense, lexical)]
+    
+    def _selects(self, index: SearchIndex) -> bool:
+        """Whether rankings are picked by the selector from over-fetched candidates"""
+        return self.selector is not None and hasattr(index.retriever.vectorstore, "search_vectors_batch")
+    
+    def _select_batch(self, index: SearchIndex, queries: List[str],
+                      embeddings: List[List[float]]) -> List[List[Tuple[int, Optional[float]]]]:
+        """Over-fetch every query's candidates with their vectors in one search, then select from them"""
+        vectorstore = index.retriever.vectorstore
+        k = self._k(index)
+        dense = self._pool.submit(vectorstore.search_vectors_batch, embeddings, max(self.selector.fetch_k, k))
+        lexical = [None] * len(queries)
+        if index.lexical is not None:
+            lexical_index = index.lexical
+            lexical = list(self._pool.map(lambda query: lexical_index.search(query, self.fetch_k), queries))
+        ids, distances, vectors = dense.result()
+        return [self._select(index, k, *candidates) for candidates in zip(ids, distances, vectors, lexical)]
+    
+    def _select(self, index: SearchIndex, k: int, ids: np.ndarray, distances: np.ndarray, vectors: np.ndarray,
+                lexical: Optional[List[Tuple[int, float]]]) -> List[Tuple[int, Optional[float]]]:
+        """(vector id, dense similarity) pairs the selector picks from one query's candidates"""
+        found = ids != -1
+        if not found.all():
+            ids, distances, vectors = ids[found], distances[found], vectors[found]
+        similarities = 1.0 - distances.astype(np.float64) / 2.0  # l2_to_similarity
+        relevance = similarities
+        if lexical:
+            # Reciprocal rank fusion, vectorized over the dense ranks and scaled to 1 for the best.
+            # BM25-only candidates go after the dense ones, without a vector or similarity
+            relevance = 1.0 / (RRF_K + np.arange(1, len(ids) + 1))
+            rows = {i: row for row, i in enumerate(ids.tolist())}
+            extra_ids, extra_scores = [], []
+            for rank, (i, _) in enumerate(lexical, start=1):
+                row = rows.get(i)
+                if row is None:
+                    extra_ids.append(i)
+                    extra_scores.append(1.0 / (RRF_K + rank))
+                else:
+                    relevance[row] += 1.0 / (RRF_K + rank)
+            if extra_ids:
+                ids = np.concatenate([ids, np.asarray(extra_ids, dtype=np.int64)])
+                relevance = np.concatenate([relevance, extra_scores])
+                similarities = np.concatenate([similarities, np.full(len(extra_ids), np.nan)])
+            relevance /= relevance.max()
+        
+        source_ids = index.retriever.vectorstore.chunks.source_ids(ids) if self.selector.max_per_source else None
+        picked = self.selector.select(k, relevance, similarities, vectors, source_ids)
+        return [(int(ids[p]), None if np.isnan(similarities[p]) else float(similarities[p])) for p in picked]
+    
+    def _search_batch(self, index: SearchIndex, queries: List[str],
+                      embeddings: List[List[float]]) -> List[List[Tuple[int, Optional[float]]]]:
+        """_rank_batch, storing each ranking in the cache"""
+        with span("batch_retrieval"):
+            rankings = self._rank_batch(index, queries, embeddings)
+        return [self._store(index, query, ranking) for query, ranking in zip(queries, rankings)]
+    
+    @staticmethod
+    def _views(index: SearchIndex, ranking: List[Tuple[int, Optional[float]]]) -> List[ChunkView]:
+        chunks = index.retriever.vectorstore.chunks
+        return [ChunkView(chunks, i, similarity) for i, similarity in ranking]
+    
+    def _as_results(self, docs: List[Tuple]) -> List[Dict]:
+        """(document, similarity) pairs as result dicts, for stores without a chunk store"""
+        return [{"content": doc.page_content, "metadata": {**doc.metadata, "similarity": round(similarity, 4)},
+                 "similarity": similarity} for doc, similarity in docs]
+    
+    def _log_results(self, result: List):
+        self.logger.info("Retrieved %d documents", len(result))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Document IDs: %s", [doc['metadata'].get('source', 'unknown') for doc in result])
+    
+    def _fuse(self, index: SearchIndex, dense: List[Tuple[int, float]],
+              lexical: List[Tuple[int, float]]) -> List[Tuple[int, Optional[float]]]:
+        """Top-k (vector id, dense similarity) pairs of the fused dense and BM25 rankings"""
+        ids = reciprocal_rank_fusion([dense, lexical])[:self._k(index)]
+        self.logger.debug("Hybrid retrieval: %d dense, %d lexical candidates", len(dense), len(lexical))
+        similarities = {i: l2_to_similarity(distance) for i, distance in dense}
+        return [(i, similarities.get(i)) for i in ids]
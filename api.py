@@ -1,24 +1,42 @@
-from flask import Flask, request, jsonify, render_template
-from main import setup_agent
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
+from agent_runtime import AgentRuntime
+from api_common import batch_item, parse_batch, sse
 from logger_config import get_logger
+from session_store import SESSION_COOKIE, resolve_session_id
+from tracing import REQUEST_ID_HEADER, current_request_id, prompt_cache_stats, render_metrics, set_request_id
 
 app = Flask(__name__)
 
 # Get API logger
 api_logger = get_logger('api')
 
-# Initialize agent on startup
+# Agent built on first use, or now if AGENT_STARTUP is eager or preload
 api_logger.info("Starting Medical Agent API")
-agent = None
+runtime = AgentRuntime()
+runtime.start()
 
-try:
-    from main import setup_agent
-    api_logger.info("Initializing agent...")
-    agent = setup_agent()
-    api_logger.info("Agent initialized successfully")
-except Exception as e:
-    api_logger.error(f"Failed to initialize agent: {str(e)}", exc_info=True)
-    raise
+def _session_id():
+    """Session id for this request, issuing a new one if the client sent none"""
+    session_id, is_new = resolve_session_id(request.headers, request.cookies)
+    if is_new:
+        g.new_session_id = session_id
+    return session_id
+
+@app.before_request
+def start_request():
+    set_request_id(request.headers.get(REQUEST_ID_HEADER))
+
+@app.after_request
+def set_request_id_header(response):
+    response.headers[REQUEST_ID_HEADER] = current_request_id()
+    return response
+
+@app.after_request
+def set_session_cookie(response):
+    session_id = g.pop('new_session_id', None)
+    if session_id:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+    return response
 
 @app.route('/')
 def index():
@@ -31,40 +49,128 @@ def ask():
         data = request.json
         question = data.get('question', '')
         
-        api_logger.info(f"Received question: '{question}'")
+        api_logger.info("Received question: '%s'", question)
         
         if not question:
             api_logger.warning("Empty question received")
             return jsonify({"error": "No question provided"}), 400
         
-        result = agent.run(question)
+        result = runtime.get().run(question, session_id=_session_id())
         
-        api_logger.info(f"Successfully processed question, returned answer with {result['sources']} sources")
+        api_logger.info("Successfully processed question, returned answer with %s sources", result['sources'])
         
         return jsonify({
             "question": result["question"],
             "answer": result["answer"],
-            "sources": result["sources"]
+            "sources": result["sources"],
+            "cached": result.get("cached", False),
+            "tokens_saved": result.get("tokens_saved", 0)
         })
     
     except Exception as e:
-        api_logger.error(f"Error in /ask endpoint: {str(e)}", exc_info=True)
+        api_logger.error("Error in /ask endpoint: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/ask/batch', methods=['POST'])
+def ask_batch():
+    try:
+        questions, error = parse_batch(request.get_json(silent=True))
+        if error:
+            api_logger.warning("Rejected batch: %s", error)
+            return jsonify({"error": error}), 400
+        
+        api_logger.info("Received batch of %d questions", len(questions))
+        
+        results = runtime.get().run_batch(questions)
+        
+        api_logger.info("Successfully processed batch of %d questions", len(results))
+        
+        return jsonify({"results": [batch_item(result) for result in results]})
+    
+    except Exception as e:
+        api_logger.error("Error in /ask/batch endpoint: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/ask/stream', methods=['POST'])
+def ask_stream():
+    data = request.json or {}
+    question = data.get('question', '')
+    
+    api_logger.info("Received streaming question: '%s'", question)
+    
+    if not question:
+        api_logger.warning("Empty question received")
+        return jsonify({"error": "No question provided"}), 400
+    
+    session_id = _session_id()
+    
+    def generate():
+        try:
+            for event in runtime.get().stream(question, session_id=session_id):
+                yield sse(event["event"], event["data"])
+            api_logger.info("Successfully streamed answer")
+        except Exception as e:
+            api_logger.error("Error in /ask/stream endpoint: %s", e, exc_info=True)
+            yield sse("error", {"error": str(e)})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route('/clear', methods=['POST'])
 def clear_history():
     try:
         api_logger.info("Clear history requested")
-        agent.clear_history()
+        runtime.get().clear_history(_session_id())
         return jsonify({"status": "success", "message": "History cleared"})
     except Exception as e:
-        api_logger.error(f"Error clearing history: {str(e)}", exc_info=True)
+        api_logger.error("Error clearing history: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/health', methods=['GET'])
 def health():
     api_logger.debug("Health check requested")
-    return jsonify({"status": "healthy", "agent": "ready"})
+    agent = runtime.agent
+    if agent is None:
+        return jsonify({"status": "healthy", "agent": runtime.state})
+    response = {"status": "healthy", "agent": runtime.state, "sessions": agent.sessions.stats()}
+    if agent.cache is not None:
+        response["semantic_cache"] = agent.cache.stats()
+    if agent.faq is not None:
+        response["faq"] = agent.faq.stats()
+    response["reflection"] = agent.policy.stats()
+    if agent.reloader is not None:
+        response["index"] = agent.reloader.stats()
+    shards = agent.retriever.shard_stats()
+    if shards is not None:
+        response["shards"] = shards
+    retrieval_cache = agent.retriever.retrieval_cache_stats()
+    if retrieval_cache is not None:
+        response["retrieval_cache"] = retrieval_cache
+    embedding_cache = agent.retriever.embedding_cache_stats()
+    if embedding_cache is not None:
+        response["embedding_cache"] = embedding_cache
+    if hasattr(agent.llm, "stats"):
+        response["llm_client"] = agent.llm.stats()
+    response["prompt_cache"] = prompt_cache_stats()
+    embedding_client = agent.retriever.embedding_client_stats()
+    if embedding_client is not None:
+        response["embedding_client"] = embedding_client
+    return jsonify(response)
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness, unlike /health: 503 until the agent is built and this worker is warmed up"""
+    status = runtime.readiness()
+    if not status["ready"]:
+        runtime.start_background()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     api_logger.info("Starting Flask server on port 5000")
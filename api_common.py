@@ -0,0 +1,37 @@
+"""
+Request parsing and response formatting shared by the Flask (api.py) and
+Quart (asgi.py) apps
+"""
+import json
+import os
+
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "64"))  # Questions accepted per /ask/batch request
+
+def parse_batch(data):
+    """Questions of a /ask/batch body and an error message, which is None if the batch is fine"""
+    if not isinstance(data, dict):
+        return [], "Request body must be a JSON object"
+    questions = data.get("questions")
+    if not isinstance(questions, list) or not questions:
+        return [], "No questions provided"
+    if len(questions) > MAX_BATCH_SIZE:
+        return [], f"At most {MAX_BATCH_SIZE} questions per batch"
+    if not all(isinstance(question, str) and question.strip() for question in questions):
+        return [], "Every question must be a non-empty string"
+    return questions, None
+
+def batch_item(result):
+    """Response entry for one question of a batch"""
+    if "error" in result:
+        return {"question": result["question"], "error": result["error"]}
+    return {
+        "question": result["question"],
+        "answer": result["answer"],
+        "sources": result["sources"],
+        "cached": result.get("cached", False),
+        "tokens_saved": result.get("tokens_saved", 0)
+    }
+
+def sse(event, data):
+    """Format one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,276 @@
+"""
+ASGI entry point serving the agent through its async pipeline
+Usage: hypercorn asgi:app --bind 127.0.0.1:5000
+"""
+
+import asyncio
+import os
+
+from quart import Quart, Response, g, request, jsonify, render_template
+from agent_runtime import AgentRuntime
+from api_common import batch_item, parse_batch, sse
+from logger_config import get_logger
+from session_store import SESSION_COOKIE, resolve_session_id
+from tracing import REQUEST_ID_HEADER, current_request_id, prompt_cache_stats, render_metrics, set_request_id
+
+# Concurrency configuration
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "200"))  # Questions processed at once
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT_SECONDS", "5"))  # Max wait for a free slot
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "60"))  # Max time per question
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT_SECONDS", "300"))  # Max time per /ask/batch request
+
+app = Quart(__name__)
+
+# Get API logger
+api_logger = get_logger('api')
+
+runtime = AgentRuntime()
+if runtime.mode == "preload":
+    runtime.start()
+limiter = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+in_flight = 0
+_streams = set()  # Running /ask/stream producers, referenced until they finish
+
+@app.before_serving
+async def startup():
+    # Loading the FAISS index is blocking, keep it off the event loop
+    await asyncio.to_thread(runtime.start, True)
+
+async def _agent():
+    """The agent, built and warmed up off the event loop on first use"""
+    if runtime.ready:
+        return runtime.agent
+    return await asyncio.to_thread(runtime.get)
+
+def _session_id():
+    """Session id for this request, issuing a new one if the client sent none"""
+    session_id, is_new = resolve_session_id(request.headers, request.cookies)
+    if is_new:
+        g.new_session_id = session_id
+    return session_id
+
+@app.before_request
+async def start_request():
+    set_request_id(request.headers.get(REQUEST_ID_HEADER))
+
+@app.after_request
+async def set_request_id_header(response):
+    response.headers[REQUEST_ID_HEADER] = current_request_id()
+    return response
+
+@app.after_request
+async def set_session_cookie(response):
+    session_id = g.pop('new_session_id', None)
+    if session_id:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+    return response
+
+@app.route('/')
+async def index():
+    api_logger.info("Index page accessed")
+    return await render_template('chat.html')
+
+@app.route('/ask', methods=['POST'])
+async def ask():
+    data = await request.get_json() or {}
+    question = data.get('question', '')
+    
+    api_logger.info("Received question: '%s'", question)
+    
+    if not question:
+        api_logger.warning("Empty question received")
+        return jsonify({"error": "No question provided"}), 400
+    
+    try:
+        await asyncio.wait_for(limiter.acquire(), timeout=QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        api_logger.warning("Rejected question, %s requests already in flight", MAX_CONCURRENT_REQUESTS)
+        return jsonify({"error": "Server busy, please retry"}), 503
+    
+    global in_flight
+    in_flight += 1
+    try:
+        agent = await _agent()
+        result = await asyncio.wait_for(agent.arun(question, session_id=_session_id()), timeout=REQUEST_TIMEOUT)
+        
+        api_logger.info("Successfully processed question, returned answer with %s sources", result['sources'])
+        
+        return jsonify({
+            "question": result["question"],
+            "answer": result["answer"],
+            "sources": result["sources"],
+            "cached": result.get("cached", False),
+            "tokens_saved": result.get("tokens_saved", 0)
+        })
+    
+    except asyncio.TimeoutError:
+        api_logger.error("Question timed out after %ss: '%s'", REQUEST_TIMEOUT, question)
+        return jsonify({"error": "Request timed out"}), 504
+    except Exception as e:
+        api_logger.error("Error in /ask endpoint: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+    finally:
+        in_flight -= 1
+        limiter.release()
+
+@app.route('/ask/stream', methods=['POST'])
+async def ask_stream():
+    data = await request.get_json() or {}
+    question = data.get('question', '')
+    
+    api_logger.info("Received streaming question: '%s'", question)
+    
+    if not question:
+        api_logger.warning("Empty question received")
+        return jsonify({"error": "No question provided"}), 400
+    
+    try:
+        await asyncio.wait_for(limiter.acquire(), timeout=QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        api_logger.warning("Rejected streaming question, %s requests already in flight", MAX_CONCURRENT_REQUESTS)
+        return jsonify({"error": "Server busy, please retry"}), 503
+    
+    global in_flight
+    in_flight += 1
+    session_id = _session_id()
+    events = asyncio.Queue()
+    
+    async def produce():
+        """Run the agent in its own task, so the timeout applies and the slot is freed even if the client stops reading"""
+        async def pump():
+            agent = await _agent()
+            async for event in agent.astream(question, session_id=session_id):
+                events.put_nowait(sse(event["event"], event["data"]))
+        
+        global in_flight
+        try:
+            await asyncio.wait_for(pump(), timeout=REQUEST_TIMEOUT)
+            api_logger.info("Successfully streamed answer")
+        except asyncio.TimeoutError:
+            api_logger.error("Streaming question timed out after %ss: '%s'", REQUEST_TIMEOUT, question)
+            events.put_nowait(sse("error", {"error": "Request timed out"}))
+        except Exception as e:
+            api_logger.error("Error in /ask/stream endpoint: %s", e, exc_info=True)
+            events.put_nowait(sse("error", {"error": str(e)}))
+        finally:
+            events.put_nowait(None)
+            in_flight -= 1
+            limiter.release()
+    
+    producer = asyncio.create_task(produce())
+    _streams.add(producer)
+    producer.add_done_callback(_streams.discard)
+    
+    async def generate():
+        try:
+            while (frame := await events.get()) is not None:
+                yield frame
+        finally:
+            producer.cancel()  # Client went away; a finished producer ignores this
+    
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.timeout = None  # REQUEST_TIMEOUT above bounds the stream
+    return response
+
+@app.route('/ask/batch', methods=['POST'])
+async def ask_batch():
+    questions, error = parse_batch(await request.get_json(silent=True))
+    if error:
+        api_logger.warning("Rejected batch: %s", error)
+        return jsonify({"error": error}), 400
+    
+    api_logger.info("Received batch of %d questions", len(questions))
+    
+    try:
+        await asyncio.wait_for(limiter.acquire(), timeout=QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        api_logger.warning("Rejected batch, %s requests already in flight", MAX_CONCURRENT_REQUESTS)
+        return jsonify({"error": "Server busy, please retry"}), 503
+    
+    global in_flight
+    in_flight += 1
+    try:
+        agent = await _agent()
+        results = await asyncio.wait_for(agent.arun_batch(questions), timeout=BATCH_TIMEOUT)
+        
+        api_logger.info("Successfully processed batch of %d questions", len(results))
+        
+        return jsonify({"results": [batch_item(result) for result in results]})
+    
+    except asyncio.TimeoutError:
+        api_logger.error("Batch of %d questions timed out after %ss", len(questions), BATCH_TIMEOUT)
+        return jsonify({"error": "Request timed out"}), 504
+    except Exception as e:
+        api_logger.error("Error in /ask/batch endpoint: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+    finally:
+        in_flight -= 1
+        limiter.release()
+
+@app.route('/clear', methods=['POST'])
+async def clear_history():
+    try:
+        api_logger.info("Clear history requested")
+        # The session store may block (SQLite busy timeout), keep it off the event loop
+        await asyncio.to_thread((await _agent()).clear_history, _session_id())
+        return jsonify({"status": "success", "message": "History cleared"})
+    except Exception as e:
+        api_logger.error("Error clearing history: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/health', methods=['GET'])
+async def health():
+    api_logger.debug("Health check requested")
+    agent = runtime.agent
+    response = {
+        "status": "healthy",
+        "agent": runtime.state,
+        "in_flight": in_flight,
+        "max_concurrent_requests": MAX_CONCURRENT_REQUESTS
+    }
+    if agent is None:
+        return jsonify(response)
+    response["sessions"] = await asyncio.to_thread(agent.sessions.stats)
+    if agent.cache is not None:
+        response["semantic_cache"] = agent.cache.stats()
+    if agent.faq is not None:
+        response["faq"] = agent.faq.stats()
+    response["reflection"] = agent.policy.stats()
+    if agent.reloader is not None:
+        response["index"] = agent.reloader.stats()
+    shards = agent.retriever.shard_stats()
+    if shards is not None:
+        response["shards"] = shards
+    retrieval_cache = agent.retriever.retrieval_cache_stats()
+    if retrieval_cache is not None:
+        response["retrieval_cache"] = retrieval_cache
+    embedding_cache = agent.retriever.embedding_cache_stats()
+    if embedding_cache is not None:
+        response["embedding_cache"] = embedding_cache
+    if hasattr(agent.llm, "stats"):
+        response["llm_client"] = agent.llm.stats()
+    response["prompt_cache"] = prompt_cache_stats()
+    embedding_client = agent.retriever.embedding_client_stats()
+    if embedding_client is not None:
+        response["embedding_client"] = embedding_client
+    micro_batching = agent.retriever.micro_batch_stats()
+    if micro_batching is not None:
+        response["micro_batching"] = micro_batching
+    return jsonify(response)
+
+@app.route('/ready', methods=['GET'])
+async def ready():
+    """Readiness, unlike /health: 503 until the agent is built and this worker is warmed up"""
+    status = runtime.readiness()
+    if not status["ready"]:
+        runtime.start_background()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+if __name__ == '__main__':
+    api_logger.info("Starting ASGI server on port 5000")
+    app.run(port=5000)
@@ -0,0 +1,4 @@
+"""
+Offline benchmarks and load tests for the Medical RAG Agent
+Run from the repository root, e.g. python -m benchmarks.async_load_test
+"""
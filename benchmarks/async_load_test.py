@@ -0,0 +1,55 @@
+"""
+Concurrency load test for the ASGI app against fake backends
+Usage: python -m benchmarks.async_load_test --requests 1000 --llm-latency 0.2
+"""
+
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+import asgi
+from benchmarks.fake_backends import build_fake_agent
+
+async def run_load_test(num_requests, llm_latency, embed_latency):
+    """Fire all requests at once and let the app's limiter bound concurrency"""
+    asgi.runtime.set(build_fake_agent(llm_latency=llm_latency, embed_latency=embed_latency))
+    latencies = []
+    statuses = Counter()
+    
+    async with asgi.app.test_app() as test_app:
+        client = test_app.test_client()
+        
+        async def one(i):
+            start = time.perf_counter()
+            response = await client.post('/ask', json={"question": f"What is condition {i}?"})
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+        
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(num_requests)))
+        elapsed = time.perf_counter() - start
+    
+    latencies.sort()
+    print("=" * 60)
+    print("📈 Async load test results")
+    print("=" * 60)
+    print(f"   - Requests: {num_requests} (max concurrent: {asgi.MAX_CONCURRENT_REQUESTS})")
+    print(f"   - Status codes: {dict(statuses)}")
+    print(f"   - Wall time: {elapsed:.2f}s")
+    print(f"   - Throughput: {num_requests / elapsed:.1f} req/s")
+    print(f"   - p50 latency: {latencies[len(latencies) // 2] * 1000:.0f} ms")
+    print(f"   - p99 latency: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.0f} ms")
+    print(f"   - LLM calls: {asgi.runtime.agent.llm.calls}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="seconds per fake embedding call")
+    args = parser.parse_args()
+    
+    asyncio.run(run_load_test(args.requests, args.llm_latency, args.embed_latency))
+
+if __name__ == "__main__":
+    main()
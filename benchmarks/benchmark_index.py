@@ -0,0 +1,101 @@
+"""
+Recall-vs-latency benchmark for the FAISS index types in index_factory
+Usage: python -m benchmarks.benchmark_index --synthetic 200000
+       python -m benchmarks.benchmark_index --index faiss_index
+"""
+
+import argparse
+import math
+import time
+
+import faiss
+import numpy as np
+
+from index_factory import apply_search_params, build_index, index_memory_bytes, make_index_config
+from index_versions import resolve_index_path
+
+def synthetic_vectors(n, dim, rng, clusters=1000):
+    """Clustered unit vectors, closer to real embeddings than uniform noise"""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def load_vectors(path):
+    """All vectors of a flat index built by build_faiss_db.py"""
+    index = faiss.read_index(f"{resolve_index_path(path)}/index.faiss")
+    if not isinstance(index, faiss.IndexFlat):
+        raise ValueError("Benchmark a flat index so vectors can be reconstructed exactly")
+    return index.reconstruct_n(0, index.ntotal)
+
+def measure(index, queries, ground_truth, k):
+    """Recall@k against exact search plus per-query latency percentiles"""
+    latencies = np.empty(len(queries))
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies[i] = time.perf_counter() - start
+        found[i] = ids[0]
+    
+    recall = np.mean([len(set(f) & set(g)) / k for f, g in zip(found, ground_truth)])
+    return recall, np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--synthetic", type=int, default=100_000, help="number of synthetic vectors")
+    parser.add_argument("--index", help="benchmark vectors from a flat index directory instead")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--pq-m", type=int, default=96)
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(42)
+    vectors = load_vectors(args.index) if args.index else synthetic_vectors(args.synthetic, args.dim, rng)
+    
+    # Queries land near some chunk, as real questions do near their answer
+    picks = rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)
+    noise = 0.02 * rng.standard_normal((len(picks), vectors.shape[1])).astype(np.float32)
+    queries = np.ascontiguousarray(vectors[picks] + noise, dtype=np.float32)
+    n, dim = vectors.shape
+    nlist = max(1, int(4 * math.sqrt(n)))
+    
+    print("=" * 84)
+    print(f"📏 Index benchmark: {n} vectors x {dim} dims, {len(queries)} queries, recall@{args.k}")
+    print("=" * 84)
+    
+    configs = [
+        (make_index_config("flat"), [None]),
+        (make_index_config("ivf_flat", nlist=nlist), [1, 8, 32, 128]),
+        (make_index_config("ivf_pq", nlist=nlist, pq_m=args.pq_m), [1, 8, 32, 128]),
+        (make_index_config("hnsw"), [16, 64, 128, 256]),
+    ]
+    
+    ground_truth = None
+    print(f"{'index':<10} {'param':<14} {'build s':>8} {'MB':>9} {'B/vec':>7} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for config, sweep in configs:
+        start = time.perf_counter()
+        index = build_index(vectors, config)
+        index.add(vectors)
+        build_seconds = time.perf_counter() - start
+        memory = index_memory_bytes(index)
+        
+        if ground_truth is None:
+            _, ground_truth = index.search(queries, args.k)
+        
+        for value in sweep:
+            if config["type"].startswith("ivf"):
+                apply_search_params(index, config, nprobe=value)
+                label = f"nprobe={value}"
+            elif config["type"] == "hnsw":
+                apply_search_params(index, config, ef_search=value)
+                label = f"efSearch={value}"
+            else:
+                label = "exact"
+            
+            recall, p50, p99 = measure(index, queries, ground_truth, args.k)
+            print(f"{config['type']:<10} {label:<14} {build_seconds:>8.1f} {memory / 1e6:>9.1f} "
+                  f"{memory / n:>7.0f} {recall:>7.3f} {p50:>8.3f} {p99:>8.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Request-path logging overhead: synchronous file handlers vs the queue listener,
+and eager f-string vs lazy %-style formatting for disabled levels
+Usage: python -m benchmarks.benchmark_logging --messages 20000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ANSWER = "Acne is a common skin condition caused by clogged hair follicles. " * 20
+
+def run_worker(messages):
+    """Time logging calls as made on the request thread; runs in a fresh process per mode"""
+    from logger_config import AgentLogger, get_logger
+    
+    logger = get_logger('agent')
+    question = "What is the treatment for acne?"
+    
+    latencies = []
+    for i in range(messages):
+        start = time.perf_counter_ns()
+        logger.info("Processing new query: '%s'", question)
+        latencies.append(time.perf_counter_ns() - start)
+    
+    # Disabled level: with LOG_LEVEL_AGENT=INFO debug calls should cost almost nothing
+    start = time.perf_counter_ns()
+    for i in range(messages):
+        logger.debug(f"Initial answer: {ANSWER[:100]}... {i}")
+    eager = (time.perf_counter_ns() - start) / messages
+    start = time.perf_counter_ns()
+    for i in range(messages):
+        logger.debug("Initial answer: %.100s... %d", ANSWER, i)
+    lazy = (time.perf_counter_ns() - start) / messages
+    
+    start = time.perf_counter()
+    listener = AgentLogger().listener
+    if listener is not None:
+        listener.stop()
+    drain = time.perf_counter() - start
+    
+    latencies.sort()
+    print(json.dumps({
+        "mean_us": sum(latencies) / len(latencies) / 1000,
+        "p50_us": latencies[len(latencies) // 2] / 1000,
+        "p99_us": latencies[int(len(latencies) * 0.99) - 1] / 1000,
+        "disabled_eager_us": eager / 1000,
+        "disabled_lazy_us": lazy / 1000,
+        "drain_s": drain,
+    }))
+
+def measure(mode, messages):
+    with tempfile.TemporaryDirectory() as log_dir:
+        env = {**os.environ, "LOG_MODE": mode, "LOG_DIR": log_dir, "LOG_LEVEL": "DEBUG", "LOG_LEVEL_AGENT": "INFO"}
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.benchmark_logging", "--worker", "--messages", str(messages)],
+            env=env, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.worker:
+        run_worker(args.messages)
+        return
+    
+    print("=" * 60)
+    print(f"📈 Logging overhead per call on the request thread ({args.messages} messages)")
+    print("=" * 60)
+    for mode in ("sync", "queue"):
+        result = measure(mode, args.messages)
+        print(f"   - {mode:>5}: mean {result['mean_us']:.1f} µs, p50 {result['p50_us']:.1f} µs, "
+              f"p99 {result['p99_us']:.1f} µs (background drain {result['drain_s']:.2f}s)")
+    print(f"   - disabled debug, f-string: {result['disabled_eager_us']:.2f} µs/call")
+    print(f"   - disabled debug, %-style:  {result['disabled_lazy_us']:.2f} µs/call")
+
+if __name__ == "__main__":
+    main()
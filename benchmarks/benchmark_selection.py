@@ -0,0 +1,77 @@
+"""
+Cost of picking the final chunks from over-fetched candidates: threshold,
+MMR and per-source cap, alone and with hybrid fusion of BM25 candidates
+Usage: python -m benchmarks.benchmark_selection --candidates 50 100 200 500
+"""
+
+import argparse
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from agent_tools import RetrieverTool, SearchIndex
+from retrieval_selection import ResultSelector
+
+DIMENSION = 1536  # ada-002
+K = 3
+
+class SyntheticChunks:
+    """Source ids of a corpus with ten chunks per source document"""
+    def source_ids(self, ids: np.ndarray) -> np.ndarray:
+        return np.asarray(ids) // 10
+
+def candidates(n: int, rng: np.random.Generator):
+    """Search results for one query: ids, squared L2 distances and unit vectors, nearest first,
+    with near-duplicate pairs as chunking overlap produces"""
+    query = rng.standard_normal(DIMENSION).astype(np.float32)
+    vectors = rng.standard_normal((n, DIMENSION)).astype(np.float32)
+    vectors[1::2] = vectors[0::2][:n // 2] + 0.1 * vectors[1::2]
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query /= np.linalg.norm(query)
+    distances = 2.0 - 2.0 * vectors @ query
+    order = np.argsort(distances)
+    ids = rng.choice(100 * n, n, replace=False)[order]
+    return ids, distances[order], vectors[order]
+
+def timed(step, repeat: int):
+    """Mean, p50 and p99 microseconds of ``step``"""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        step()
+        latencies.append(time.perf_counter_ns() - start)
+    latencies.sort()
+    return (sum(latencies) / len(latencies) / 1000, latencies[len(latencies) // 2] / 1000,
+            latencies[int(len(latencies) * 0.99) - 1] / 1000)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[50, 100, 200, 500])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(0)
+    selector = ResultSelector(min_similarity=0.0, mmr_lambda=0.7, max_per_source=2)
+    index = SearchIndex(SimpleNamespace(vectorstore=SimpleNamespace(chunks=SyntheticChunks()), search_kwargs={"k": K}))
+    tool = RetrieverTool(index.retriever, selector=selector)
+    
+    print("=" * 60)
+    print(f"📈 Selecting {K} of N candidates ({DIMENSION}-d vectors, {args.repeat} runs)")
+    print("=" * 60)
+    for n in args.candidates:
+        ids, distances, vectors = candidates(n, rng)
+        similarities = 1.0 - distances.astype(np.float64) / 2.0
+        source_ids = SyntheticChunks().source_ids(ids)
+        # BM25 top 20: mostly chunks dense search found too, a few it did not
+        lexical = [(int(i), 1.0) for i in rng.choice(ids, min(15, n), replace=False)]
+        lexical += [(100 * n + i, 1.0) for i in range(5)]
+        
+        selection = timed(lambda: selector.select(K, similarities, similarities, vectors, source_ids), args.repeat)
+        dense = timed(lambda: tool._select(index, K, ids, distances, vectors, None), args.repeat)
+        hybrid = timed(lambda: tool._select(index, K, ids, distances, vectors, lexical), args.repeat)
+        print(f"   - N={n:>4}: selector {selection[0]:7.1f} µs (p99 {selection[2]:7.1f}), "
+              f"dense {dense[0]:7.1f} µs (p99 {dense[2]:7.1f}), hybrid {hybrid[0]:7.1f} µs (p99 {hybrid[2]:7.1f})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Local stand-in for the Azure OpenAI REST API that injects rate limits, server errors and slow responses
+Serves chat completions (streamed or not) and embeddings for any deployment name.
+Usage: python -m benchmarks.fake_azure_server --port 8089 --rate-limit 0.2 --slow 0.05 --slow-seconds 3
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import numpy as np
+
+ANSWER = "Acne is a common skin condition caused by clogged hair follicles."
+ROUTE = re.compile(r"^/openai/deployments/([^/]+)/(chat/completions|embeddings)")
+
+class FaultProfile:
+    """Faults injected into one deployment's responses, as probabilities per request"""
+    def __init__(self, rate_limit: float = 0.0, server_error: float = 0.0, slow: float = 0.0,
+                 slow_seconds: float = 3.0, latency: float = 0.05, retry_after_ms: Optional[int] = 200):
+        self.rate_limit = rate_limit
+        self.server_error = server_error
+        self.slow = slow
+        self.slow_seconds = slow_seconds
+        self.latency = latency
+        self.retry_after_ms = retry_after_ms
+
+class FakeAzureServer(ThreadingHTTPServer):
+    """Threaded HTTP server answering like Azure OpenAI, with per-deployment fault profiles"""
+    daemon_threads = True
+    
+    def __init__(self, port: int = 0, profiles: Optional[Dict[str, FaultProfile]] = None,
+                 default: Optional[FaultProfile] = None, dimensions: int = 1536, seed: int = 0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.profiles = profiles or {}
+        self.default = default or FaultProfile()
+        self.dimensions = dimensions
+        self.counts = Counter()  # (deployment, outcome) -> requests
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+    
+    def start(self) -> "FakeAzureServer":
+        threading.Thread(target=self.serve_forever, name="fake-azure", daemon=True).start()
+        return self
+    
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+    
+    def outcome(self, deployment: str) -> str:
+        """Draw the fate of one request: ok, slow, rate_limited or error"""
+        profile = self.profiles.get(deployment, self.default)
+        with self._lock:
+            roll = self._rng.random()
+        if roll < profile.rate_limit:
+            outcome = "rate_limited"
+        elif roll < profile.rate_limit + profile.server_error:
+            outcome = "error"
+        elif roll < profile.rate_limit + profile.server_error + profile.slow:
+            outcome = "slow"
+        else:
+            outcome = "ok"
+        with self._lock:
+            self.counts[deployment, outcome] += 1
+        return outcome
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, as Azure does
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        match = ROUTE.match(self.path)
+        if not match:
+            return self._json(404, {"error": {"code": "404", "message": "Resource not found"}})
+        
+        deployment, operation = match.groups()
+        profile = self.server.profiles.get(deployment, self.server.default)
+        outcome = self.server.outcome(deployment)
+        time.sleep(profile.slow_seconds if outcome == "slow" else profile.latency)
+        
+        if outcome == "rate_limited":
+            headers = {"retry-after-ms": str(profile.retry_after_ms)} if profile.retry_after_ms is not None else {}
+            return self._json(429, {"error": {"code": "429", "message": "Rate limit exceeded"}}, headers)
+        if outcome == "error":
+            return self._json(500, {"error": {"code": "InternalServerError", "message": "Injected failure"}})
+        if operation == "embeddings":
+            return self._json(200, self._embeddings(body))
+        if body.get("stream"):
+            return self._stream(deployment)
+        return self._json(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": self._reply(body)},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 15, "total_tokens": 115},
+        })
+    
+    def _reply(self, body: Dict) -> str:
+        prompt = str(body.get("messages", [{}])[-1].get("content", ""))
+        return "GOOD" if "Evaluate this answer" in prompt else ANSWER
+    
+    def _embeddings(self, body: Dict) -> Dict:
+        inputs = body.get("input", [])
+        inputs = inputs if isinstance(inputs, list) and inputs and not isinstance(inputs[0], int) else [inputs]
+        data = []
+        for i, item in enumerate(inputs):
+            seed = int.from_bytes(hashlib.sha256(json.dumps(item).encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.server.dimensions).astype(np.float32)
+            vector /= np.linalg.norm(vector)
+            # The openai SDK asks for base64 unless told otherwise
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        return {"object": "list", "data": data, "model": "text-embedding-ada-002",
+                "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}}
+    
+    def _stream(self, deployment: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for i, token in enumerate(ANSWER.split(" ")):
+            chunk = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": deployment,
+                "choices": [{"index": 0, "delta": {"content": token if i == 0 else f" {token}"},
+                             "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+    
+    def _json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--server-error", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--slow", type=float, default=0.0, help="share of requests delayed by --slow-seconds")
+    parser.add_argument("--slow-seconds", type=float, default=3.0)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before every other response")
+    args = parser.parse_args()
+    
+    server = FakeAzureServer(args.port, default=FaultProfile(
+        rate_limit=args.rate_limit, server_error=args.server_error, slow=args.slow,
+        slow_seconds=args.slow_seconds, latency=args.latency,
+    ))
+    print(f"🧪 Fake Azure OpenAI listening on {server.url} (AZURE_OPENAI_ENDPOINT)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
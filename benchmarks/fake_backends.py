@@ -0,0 +1,225 @@
+"""
+Deterministic stand-ins for AzureChatOpenAI and AzureOpenAIEmbeddings
+so the agent can be exercised without live Azure endpoints
+"""
+
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from agent_critic import SelfReflectionCritic
+from agent_tools import RetrieverTool
+from bm25_index import BM25Index
+from chunk_store import write_chunk_store
+from index_factory import INDEX_FILE, make_index_config, save_index_config
+from medical_agent import MedicalAgent
+
+class FakeBackendError(RuntimeError):
+    """Failure injected by a fake backend"""
+
+class LatencyDistribution:
+    """Seeded latency sampler parsed from a spec
+    
+    ``0.2`` or ``const:0.2`` (fixed), ``uniform:0.1,0.3`` (bounds) or
+    ``lognormal:0.2,0.5`` (median and sigma, for realistic long tails).
+    """
+    def __init__(self, spec="0.1", seed=0):
+        self.spec = str(spec)
+        kind, _, params = self.spec.partition(":") if ":" in self.spec else ("const", "", self.spec)
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",")]
+        if kind not in ("const", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {self.spec}")
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == "uniform":
+                return self._rng.uniform(*self.params)
+            if self.kind == "lognormal":
+                median, sigma = self.params
+                return median * self._rng.lognormvariate(0.0, sigma)
+            return self.params[0]
+    
+    def __repr__(self):
+        return f"LatencyDistribution({self.spec!r})"
+
+def _latency(value) -> float:
+    """Seconds to wait for a float or a LatencyDistribution"""
+    return value.sample() if isinstance(value, LatencyDistribution) else float(value)
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that sleeps for a sampled latency and returns canned replies
+    
+    Critique prompts are answered with "GOOD", everything else with ``answer``.
+    Reported usage counts a system message it has seen before as cached.
+    Streaming yields the reply word by word, ``token_latency`` seconds apart,
+    after the first-token latency. A share ``error_rate`` of calls raises
+    FakeBackendError.
+    """
+    latency: Any = 0.1
+    token_latency: float = 0.0
+    error_rate: float = 0.0
+    seed: int = 0
+    answer: str = "Acne is a common skin condition caused by clogged hair follicles."
+    calls: int = 0
+    errors: int = 0
+    _rng: random.Random = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default=None)
+    _prefixes: Any = PrivateAttr(default=None)
+    
+    def model_post_init(self, __context: Any) -> None:
+        self._rng = random.Random(self.seed)
+        self._lock = threading.Lock()
+        self._prefixes = set()
+    
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+    
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(_latency(self.latency))
+        return self._result(messages)
+    
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(_latency(self.latency))
+        return self._result(messages)
+    
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(_latency(self.latency))
+        for i, token in enumerate(self._reply(messages).split(" ")):
+            if i:
+                time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token if i == 0 else f" {token}"))
+    
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(_latency(self.latency))
+        for i, token in enumerate(self._reply(messages).split(" ")):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token if i == 0 else f" {token}"))
+    
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        """Count the call, inject failures, and pick the canned reply"""
+        with self._lock:
+            self.calls += 1
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if failed:
+            raise FakeBackendError("Injected LLM failure")
+        prompt = messages[-1].content
+        return "GOOD" if "Evaluate this answer" in prompt else self.answer
+    
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        content = self._reply(messages)
+        prompt_tokens = sum(len(message.content) for message in messages) // 4
+        usage = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4,
+            "input_token_details": {"cache_read": self._cache_read(messages)},
+        }
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content, usage_metadata=usage))])
+    
+    def _cache_read(self, messages: List[BaseMessage]) -> int:
+        """Tokens of a leading system message seen before, as a provider prefix cache would serve them"""
+        if len(messages) < 2 or messages[0].type != "system":
+            return 0
+        with self._lock:
+            seen = messages[0].content in self._prefixes
+            self._prefixes.add(messages[0].content)
+        return len(messages[0].content) // 4 if seen else 0
+
+class FakeEmbeddings(Embeddings):
+    """Embeddings derived from a hash of the text, with a sampled latency per call"""
+    def __init__(self, size: int = 1536, latency=0.02, error_rate: float = 0.0, seed: int = 0):
+        self.size = size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(_latency(self.latency))
+        self._count()
+        return [self._vector(text) for text in texts]
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+    
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(_latency(self.latency))
+        self._count()
+        return [self._vector(text) for text in texts]
+    
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+    
+    def _count(self):
+        with self._lock:
+            self.calls += 1
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if failed:
+            raise FakeBackendError("Injected embedding failure")
+    
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.size).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+def synthetic_passages(num_docs: int = 300):
+    """Texts and metadata of a small synthetic corpus"""
+    texts = [f"Synthetic medical passage {i} about condition {i % 37}." for i in range(num_docs)]
+    metadatas = [{"source": f"data/synthetic_{i % 10}.pdf", "page": i // 10} for i in range(num_docs)]
+    return texts, metadatas
+
+def build_fake_vectorstore(embedding: Embeddings, num_docs: int = 300) -> FAISS:
+    """Small synthetic FAISS store standing in for faiss_index"""
+    texts, metadatas = synthetic_passages(num_docs)
+    return FAISS.from_texts(texts, embedding, metadatas=metadatas)
+
+def build_fake_index(path: str, embedding: Embeddings, num_docs: int = 300):
+    """Write a synthetic flat index, chunk store and BM25 index to ``path``, as build_faiss_db.py would"""
+    texts, metadatas = synthetic_passages(num_docs)
+    vectors = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    
+    os.makedirs(path, exist_ok=True)
+    faiss.write_index(index, os.path.join(path, INDEX_FILE))
+    write_chunk_store(path, texts, metadatas)
+    BM25Index.build(texts).save(path)
+    save_index_config(make_index_config("flat"), path)
+
+def build_fake_agent(llm_latency: float = 0.1, embed_latency: float = 0.02, cache=None) -> MedicalAgent:
+    """MedicalAgent wired to fake LLM and embedding backends"""
+    embedding = FakeEmbeddings(latency=0)
+    docsearch = build_fake_vectorstore(embedding)
+    embedding.latency = embed_latency
+    
+    llm = FakeChatModel(latency=llm_latency)
+    retriever = docsearch.as_retriever(search_type="similarity", search_kwargs={"k": 3})
+    return MedicalAgent(RetrieverTool(retriever), llm, SelfReflectionCritic(llm), cache=cache)
@@ -0,0 +1,151 @@
+"""
+Replay a request log against the ASGI app, wired through main.setup_agent to fake backends
+Usage: python -m benchmarks.replay_load_test --log requests.jsonl --rate 50 --requests 500 \
+           --llm-latency lognormal:0.3,0.5 --llm-error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+
+# Before any project import: keep the console quiet and the embedding cache in memory only
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("EMBEDDING_CACHE_PATH", "")
+
+import asgi
+from benchmarks.fake_backends import FakeChatModel, FakeEmbeddings, LatencyDistribution, build_fake_index
+from main import setup_agent
+
+def load_questions(path):
+    """Questions of a JSONL request log, from its ``question`` field or else ``title``"""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                question = entry.get("question") or entry.get("title")
+                if question:
+                    questions.append(question)
+    if not questions:
+        raise ValueError(f"No questions found in {path}")
+    return questions
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is in KiB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+async def replay(questions, num_requests, rate, seed):
+    """Send questions with Poisson arrivals at ``rate`` per second (all at once if 0)"""
+    rng = random.Random(seed)
+    latencies = []
+    statuses = Counter()
+    
+    async with asgi.app.test_app() as test_app:
+        client = test_app.test_client()
+        
+        async def one(question):
+            start = time.perf_counter()
+            response = await client.post('/ask', json={"question": question})
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+        
+        tasks = []
+        start = time.perf_counter()
+        for i in range(num_requests):
+            tasks.append(asyncio.create_task(one(questions[i % len(questions)])))
+            if rate > 0:
+                await asyncio.sleep(rng.expovariate(rate))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    
+    return sorted(latencies), statuses, elapsed
+
+def run(args):
+    llm = FakeChatModel(
+        latency=LatencyDistribution(args.llm_latency, seed=args.seed),
+        token_latency=args.token_latency,
+        error_rate=args.llm_error_rate,
+        seed=args.seed,
+    )
+    embedding = FakeEmbeddings(latency=0, error_rate=0.0, seed=args.seed)
+    
+    with tempfile.TemporaryDirectory() as index_path:
+        build_fake_index(index_path, embedding, num_docs=args.docs)
+        embedding.latency = LatencyDistribution(args.embed_latency, seed=args.seed)
+        embedding.error_rate = args.embed_error_rate
+        embedding.calls = 0
+        asgi.runtime.set(setup_agent(llm=llm, embedding=embedding, index_path=index_path))
+        
+        questions = load_questions(args.log)
+        latencies, statuses, elapsed = asyncio.run(replay(questions, args.requests, args.rate, args.seed))
+    
+    return {
+        "requests": args.requests,
+        "distinct_questions": len(set(questions)),
+        "rate": args.rate,
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "wall_seconds": elapsed,
+        "throughput_rps": args.requests / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "llm_calls_per_request": llm.calls / args.requests,
+        "llm_errors": llm.errors,
+        "embedding_calls_per_request": embedding.calls / args.requests,
+        "embedding_errors": embedding.errors,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default="requests.jsonl", help="JSONL request log to replay")
+    parser.add_argument("--requests", type=int, default=200, help="requests to send, cycling through the log")
+    parser.add_argument("--rate", type=float, default=20.0, help="mean arrivals per second (0: all at once)")
+    parser.add_argument("--llm-latency", default="lognormal:0.2,0.4",
+                        help="const:s, uniform:a,b or lognormal:median,sigma")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument("--embed-latency", default="const:0.02")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--embed-error-rate", type=float, default=0.0)
+    parser.add_argument("--docs", type=int, default=300, help="passages in the synthetic index")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--max-p99-ms", type=float, help="exit with status 1 if p99 latency exceeds this")
+    args = parser.parse_args()
+    
+    report = run(args)
+    
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print("=" * 60)
+        print("📈 Replay load test results")
+        print("=" * 60)
+        print(f"   - Requests: {report['requests']} ({report['distinct_questions']} distinct questions, "
+              f"rate {report['rate']:g}/s)")
+        print(f"   - Status codes: {report['status_codes']}")
+        print(f"   - Throughput: {report['throughput_rps']:.1f} req/s over {report['wall_seconds']:.2f}s")
+        print(f"   - Latency: p50 {report['p50_ms']:.0f} ms, p95 {report['p95_ms']:.0f} ms, "
+              f"p99 {report['p99_ms']:.0f} ms")
+        print(f"   - LLM calls/request: {report['llm_calls_per_request']:.2f} ({report['llm_errors']} injected errors)")
+        print(f"   - Embedding calls/request: {report['embedding_calls_per_request']:.2f} "
+              f"({report['embedding_errors']} injected errors)")
+        print(f"   - Peak RSS: {report['peak_rss_mb']:.0f} MB")
+    
+    if args.max_p99_ms is not None and report["p99_ms"] > args.max_p99_ms:
+        print(f"❌ p99 {report['p99_ms']:.0f} ms exceeds {args.max_p99_ms:.0f} ms", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Chat calls against a local fake Azure OpenAI server that injects 429s, 500s and slow responses:
+the SDK's default client vs the llm_client layer (retries, hedging, breakers, fallback)
+Usage: python -m benchmarks.resilience_test --requests 300 --rate-limit 0.2 --slow 0.05 --hedge-after 1 --fallback
+"""
+
+import argparse
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_openai import AzureChatOpenAI
+
+from benchmarks.fake_azure_server import FakeAzureServer, FaultProfile
+from llm_client import (
+    CircuitBreaker, ConnectionPools, Deployment, ResilientCaller, ResilientChatModel, RetryPolicy
+)
+
+API_VERSION = "2025-01-01-preview"
+
+def chat_model(server, deployment, **kwargs):
+    return AzureChatOpenAI(azure_endpoint=server.url, api_key="fake", api_version=API_VERSION,
+                           azure_deployment=deployment, **kwargs)
+
+def run(llm, num_requests, concurrency):
+    """Invoke ``llm`` concurrently; returns sorted latencies of successes and outcome counts"""
+    latencies = []
+    outcomes = Counter()
+    
+    def one(i):
+        start = time.perf_counter()
+        try:
+            llm.invoke(f"What is condition {i}?")
+        except Exception as e:
+            outcomes[type(e).__name__] += 1
+            return
+        latencies.append(time.perf_counter() - start)
+        outcomes["ok"] += 1
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(num_requests)))
+    return sorted(latencies), outcomes, time.perf_counter() - start
+
+def report(name, latencies, outcomes, elapsed, num_requests):
+    print(f"   {name}:")
+    print(f"   - Succeeded: {outcomes['ok']}/{num_requests} {dict(outcomes)}")
+    if latencies:
+        print(f"   - Latency: p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.0f} ms")
+    print(f"   - Wall time: {elapsed:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate-limit", type=float, default=0.2, help="share of primary requests answered with 429")
+    parser.add_argument("--server-error", type=float, default=0.05, help="share answered with 500")
+    parser.add_argument("--slow", type=float, default=0.05, help="share delayed by --slow-seconds")
+    parser.add_argument("--slow-seconds", type=float, default=3.0)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per normal response")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--hedge-after", type=float, default=0.0, help="seconds before a hedged request (0 = off)")
+    parser.add_argument("--fallback", action="store_true", help="add a healthy fallback deployment")
+    args = parser.parse_args()
+    
+    primary = FaultProfile(rate_limit=args.rate_limit, server_error=args.server_error, slow=args.slow,
+                           slow_seconds=args.slow_seconds, latency=args.latency)
+    server = FakeAzureServer(profiles={"primary": primary}, default=FaultProfile(latency=args.latency)).start()
+    
+    print("=" * 60)
+    print(f"📈 Resilience test: {args.requests} chat calls, {args.concurrency} concurrent "
+          f"({args.rate_limit:.0%} 429s, {args.server_error:.0%} 500s, {args.slow:.0%} slow)")
+    print("=" * 60)
+    try:
+        baseline = chat_model(server, "primary", timeout=30)
+        report("SDK defaults", *run(baseline, args.requests, args.concurrency), args.requests)
+        
+        server.counts.clear()
+        pools = ConnectionPools(max_connections=args.concurrency * 2, max_keepalive=args.concurrency)
+        names = ["primary", "secondary"] if args.fallback else ["primary"]
+        caller = ResilientCaller(
+            [Deployment(name, chat_model(server, name, **pools.client_kwargs()),
+                        CircuitBreaker(failure_threshold=5, reset_timeout=5)) for name in names],
+            retry=RetryPolicy(max_retries=args.max_retries, base_delay=0.1, max_delay=2),
+            hedge_after=args.hedge_after,
+        )
+        report("llm_client", *run(ResilientChatModel(caller=caller), args.requests, args.concurrency), args.requests)
+        print(f"   - Client: {caller.stats()}")
+        print(f"   - Server: {dict(server.counts)}")
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+BM25 lexical index over the chunk store, for exact terms such as drug
+names, dosages and ICD codes that dense retrieval tends to miss
+
+Postings are stored term by term in flat arrays (CSR layout) and opened
+with mmap, like the chunk store; document ids are FAISS vector ids.
+Usage: python bm25_index.py faiss_index  (build for an existing chunk store)
+"""
+
+import json
+import math
+import os
+import re
+import sys
+from collections import Counter
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+BM25_META_FILE = "bm25_meta.json"  # Vocabulary and scoring parameters
+BM25_TERM_OFFSETS_FILE = "bm25_term_offsets.npy"  # int64 start of each term's postings, plus the end
+BM25_DOC_IDS_FILE = "bm25_doc_ids.npy"  # int32 vector ids, grouped by term
+BM25_TFS_FILE = "bm25_tfs.npy"  # uint16 term frequency per posting
+BM25_DOC_LENGTHS_FILE = "bm25_doc_lengths.npy"  # int32 tokens per chunk
+BM25_K1 = 1.5  # Term frequency saturation
+BM25_B = 0.75  # Document length normalization
+
+# Keeps dotted and hyphenated tokens whole: "e11.9", "2.5mg", "covid-19"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were which with".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms of ``text``, without stopwords"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+def has_bm25_index(path: str) -> bool:
+    """Whether ``path`` holds a BM25 index"""
+    return os.path.exists(os.path.join(path, BM25_META_FILE))
+
+class BM25Index:
+    """Okapi BM25 scoring over array-backed postings"""
+    def __init__(self, terms: List[str], term_offsets: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray,
+                 doc_lengths: np.ndarray, k1: float = BM25_K1, b: float = BM25_B):
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.avgdl = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+    
+    def __len__(self):
+        return len(self.doc_lengths)
+    
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        """Index ``texts``; the position of each text is its document id"""
+        vocabulary = {}
+        term_ids, doc_ids, tfs, doc_lengths = [], [], [], []
+        
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+        
+        # Group postings by term, keeping document order within each term
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        term_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=term_offsets[1:])
+        
+        return cls(
+            list(vocabulary),
+            term_offsets,
+            np.asarray(doc_ids, dtype=np.int32)[order],
+            np.minimum(np.asarray(tfs, dtype=np.int64), np.iinfo(np.uint16).max).astype(np.uint16)[order],
+            np.asarray(doc_lengths, dtype=np.int32),
+            k1=k1,
+            b=b,
+        )
+    
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Open a saved index, with postings memory-mapped"""
+        with open(os.path.join(path, BM25_META_FILE)) as f:
+            meta = json.load(f)
+        return cls(
+            meta["terms"],
+            np.load(os.path.join(path, BM25_TERM_OFFSETS_FILE), mmap_mode="r"),
+            np.load(os.path.join(path, BM25_DOC_IDS_FILE), mmap_mode="r"),
+            np.load(os.path.join(path, BM25_TFS_FILE), mmap_mode="r"),
+            np.load(os.path.join(path, BM25_DOC_LENGTHS_FILE), mmap_mode="r"),
+            k1=meta["k1"],
+            b=meta["b"],
+        )
+    
+    def save(self, path: str):
+        """Write the index next to index.faiss"""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, BM25_TERM_OFFSETS_FILE), self.term_offsets)
+        np.save(os.path.join(path, BM25_DOC_IDS_FILE), self.doc_ids)
+        np.save(os.path.join(path, BM25_TFS_FILE), self.tfs)
+        np.save(os.path.join(path, BM25_DOC_LENGTHS_FILE), self.doc_lengths)
+        with open(os.path.join(path, BM25_META_FILE), "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "terms": list(self.vocabulary)}, f)
+    
+    def search(self, query: str, k: int = 4) -> List[Tuple[int, float]]:
+        """Top ``k`` (document id, score) pairs for ``query``, best first"""
+        n = len(self.doc_lengths)
+        scores = np.zeros(n, dtype=np.float32)
+        
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            idf = math.log(1 + (n - (end - start) + 0.5) / ((end - start) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avgdl)
+            # Each document appears at most once per term, so fancy-index += is safe
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+        
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(scores[matched], -k)[-k:]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(i), float(scores[i])) for i in matched]
+
+if __name__ == "__main__":
+    from index_versions import resolve_index_path
+    from sharded_index import open_chunk_store
+    
+    path = resolve_index_path(sys.argv[1] if len(sys.argv) > 1 else "faiss_index")
+    chunks = open_chunk_store(path)
+    BM25Index.build(chunks.text(i) for i in range(len(chunks))).save(path)
+    print(f"✅ Wrote BM25 index over {len(chunks)} chunks to {path}")
@@ -4,49 +4,135 @@ Single script to build FAISS vector database from PDF files
 Usage: python build_faiss_db.py
 """
 
-from langchain.document_loaders import PyPDFLoader, DirectoryLoader
+from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
 from langchain_openai import AzureOpenAIEmbeddings
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import argparse
+import hashlib
+import itertools
+import json
 import os
+import queue
+import random
+import threading
+import time
+from pathlib import Path
+import faiss
+import numpy as np
+import openai
 from dotenv import load_dotenv
+from bm25_index import BM25Index
+from chunk_store import LEGACY_DOCSTORE_FILE, has_chunk_store, write_chunk_store
+from embedding_cache import CachedEmbeddings
+from index_factory import (
+    DEFAULT_EF_SEARCH, DEFAULT_HNSW_M, DEFAULT_NLIST, DEFAULT_NPROBE, DEFAULT_PQ_M, DEFAULT_TRAIN_SAMPLE,
+    INDEX_FILE, INDEX_TYPES, build_index, make_index_config, save_index_config
+)
+from index_versions import new_version_path, prune_versions, publish_version, resolve_index_path
+from llm_client import RETRYABLE_ERRORS, RateLimitGate, retry_after
+from sharded_index import ShardedIndex, build_sharded_index, is_sharded, open_chunk_store, save_sharded_index
+from token_counter import EMBEDDING_ENCODING, count_tokens_many
 
 # Configuration
 PDF_FOLDER = "data"  # Folder containing your PDF files
-FAISS_INDEX_PATH = "faiss_index"  # Where to save the FAISS index
+FAISS_INDEX_PATH = "faiss_index"  # Root of the versioned index directories
+KEEP_VERSIONS = 3  # Index versions kept on disk, including the published one
 CHUNK_SIZE = 500  # Characters per chunk
 CHUNK_OVERLAP = 20  # Overlap between chunks
+EMBEDDING_MODEL = "text-embedding-ada-002"
+CHECKPOINT_PATH = "embedding_checkpoint"  # Completed batch embeddings, for resuming builds
+MANIFEST_FILE = "manifest.json"  # Per-file and per-chunk content hashes, for incremental builds
+EMBED_WORKERS = 4  # Concurrent embedding requests
+PARSE_WORKERS = os.cpu_count() or 1  # Processes parsing and chunking PDFs
+CHUNK_QUEUE_SIZE = 1000  # Chunks parsed ahead of the embedding stage
+MAX_RETRIES = 6  # Attempts per batch on transient Azure errors
 
-def load_pdfs(folder_path):
-    """Load all PDF files from folder"""
-    print(f"📂 Loading PDFs from: {folder_path}")
-    
+def hash_pdfs(folder_path):
+    """Map each PDF in folder (named as the loaders name its source) to its sha256"""
     if not os.path.exists(folder_path):
         raise FileNotFoundError(f"Folder not found: {folder_path}")
     
-    loader = DirectoryLoader(
-        folder_path,
-        glob="*.pdf",
-        loader_cls=PyPDFLoader
-    )
-    
-    documents = loader.load()
-    print(f"✅ Loaded {len(documents)} pages from PDFs")
-    return documents
+    file_hashes = {}
+    for path in sorted(Path(folder_path).glob("*.pdf")):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        file_hashes[str(path)] = digest.hexdigest()
+    return file_hashes
 
 def split_documents(documents):
     """Split documents into chunks"""
-    print(f"✂️  Splitting documents into chunks...")
-    
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE[:300],
+        chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
         length_function=len,
     )
+    return text_splitter.split_documents(documents)
+
+def load_and_split_pdf(path):
+    """Parse one PDF and chunk it; runs in a worker process"""
+    pages = PyPDFLoader(path).load()
+    return len(pages), split_documents(pages)
+
+def iter_pdf_chunks(paths, workers=PARSE_WORKERS, stats=None):
+    """Parse and chunk PDFs across a process pool, yielding chunks in path order
+    
+    At most a few files per worker are parsed ahead of the consumer, so only
+    that window of documents is ever held in memory. Page and chunk counts
+    are accumulated into ``stats`` if given.
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault("pages", 0)
+    stats.setdefault("chunks", 0)
+    print(f"📂 Loading {len(paths)} PDFs with {workers} processes...")
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        window = deque()
+        paths = iter(paths)
+        
+        while True:
+            while len(window) < 2 * workers:
+                path = next(paths, None)
+                if path is None:
+                    break
+                window.append(pool.submit(load_and_split_pdf, path))
+            if not window:
+                break
+            
+            pages, chunks = window.popleft().result()
+            stats["pages"] += pages
+            stats["chunks"] += len(chunks)
+            yield from chunks
     
-    chunks = text_splitter.split_documents(documents)
-    print(f"✅ Created {len(chunks)} text chunks")
-    return chunks
+    print(f"✅ Loaded {stats['pages']} pages into {stats['chunks']} text chunks")
+
+def prefetch(iterable, maxsize=CHUNK_QUEUE_SIZE):
+    """Drain ``iterable`` on a background thread through a bounded queue
+    
+    Lets PDF parsing run ahead of the embedding stage, up to ``maxsize`` items.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    
+    def produce():
+        try:
+            for item in iterable:
+                items.put((True, item))
+            items.put((False, None))
+        except BaseException as e:
+            items.put((False, e))
+    
+    threading.Thread(target=produce, daemon=True).start()
+    
+    while True:
+        has_item, item = items.get()
+        if not has_item:
+            if item is not None:
+                raise item
+            return
+        yield item
 
 def create_embeddings():
     """Initialize Azure OpenAI embeddings"""
@@ -54,92 +140,496 @@ def create_embeddings():
     
     load_dotenv()
     
-    embedding = AzureOpenAIEmbeddings(
-        model="text-embedding-ada-002",
-        azure_deployment=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"),
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_version=os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+    # Shared with the agent, so chunks embedded by any earlier build are reused
+    embedding = CachedEmbeddings(
+        AzureOpenAIEmbeddings(
+            model=EMBEDDING_MODEL,
+            azure_deployment=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_version=os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION"),
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        ),
+        model=EMBEDDING_MODEL,
+        path=os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db"),
     )
     
     print("✅ Embeddings initialized")
     return embedding
 
-def build_faiss_index(chunks, embedding, batch_size=100):
-    """Build FAISS index from chunks"""
-    print(f"🔨 Building FAISS index...")
+class EmbeddingCheckpoint:
+    """Append-only on-disk store of chunk embeddings keyed by content hash
     
-    total_chunks = len(chunks)
+    Vectors are appended to a raw float32 file (read back memory-mapped) and
+    each row is recorded in a JSON-lines manifest, so an interrupted build
+    resumes with every completed batch already embedded.
+    """
+    def __init__(self, path, model=EMBEDDING_MODEL):
+        self.path = path
+        self.model = model
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.manifest_path = os.path.join(path, "manifest.jsonl")
+        self.meta_path = os.path.join(path, "meta.json")
+        self.dim = None
+        self._rows = {}  # chunk hash -> row in vectors.f32
+        self._lock = threading.Lock()
+        
+        os.makedirs(path, exist_ok=True)
+        self._load()
+    
+    def __contains__(self, chunk_hash):
+        return chunk_hash in self._rows
     
-    # Process in batches to avoid memory issues
-    if total_chunks > batch_size:
-        print(f"Processing in batches of {batch_size}...")
+    def __len__(self):
+        return len(self._rows)
+    
+    def add_batch(self, hashes, vectors):
+        """Persist one embedded batch; vectors are flushed before the manifest entries"""
+        vectors = np.asarray(vectors, dtype=np.float32)
         
-        # Create initial index with first batch
-        docsearch = FAISS.from_documents(
-            documents=chunks[:batch_size],
-            embedding=embedding
-        )
-        print(f"✅ Processed batch 1/{(total_chunks + batch_size - 1) // batch_size}")
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, "w") as f:
+                    json.dump({"model": self.model, "dim": self.dim}, f)
+            
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            
+            start = len(self._rows)
+            with open(self.manifest_path, "a") as f:
+                for offset, chunk_hash in enumerate(hashes):
+                    self._rows[chunk_hash] = start + offset
+                    f.write(json.dumps({"hash": chunk_hash, "row": start + offset}) + "\n")
+    
+    def matrix(self, hashes):
+        """Embeddings for ``hashes`` as an (n, dim) float32 array, in order"""
+        store = np.memmap(self.vectors_path, dtype=np.float32, mode="r").reshape(-1, self.dim)
+        return np.ascontiguousarray(store[[self._rows[h] for h in hashes]])
+    
+    def _load(self):
+        """Reload a previous run, discarding rows not fully written before a crash"""
+        if not os.path.exists(self.meta_path):
+            return
+        
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        if meta["model"] != self.model:
+            print(f"⚠️  Checkpoint was built with {meta['model']}, starting fresh")
+            for path in (self.vectors_path, self.manifest_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
         
-        # Add remaining batches
-        for i in range(batch_size, total_chunks, batch_size):
-            batch = chunks[i:i + batch_size]
-            batch_num = (i // batch_size) + 1
-            total_batches = (total_chunks + batch_size - 1) // batch_size
+        self.dim = meta["dim"]
+        complete_rows = os.path.getsize(self.vectors_path) // (4 * self.dim) if os.path.exists(self.vectors_path) else 0
+        
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # torn final line
+                    if entry["row"] >= complete_rows:
+                        break
+                    self._rows[entry["hash"]] = entry["row"]
+        
+        # Drop any partial tail so appended rows line up with the manifest again
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(len(self._rows) * 4 * self.dim)
+        with open(self.manifest_path, "w") as f:
+            for chunk_hash, row in self._rows.items():
+                f.write(json.dumps({"hash": chunk_hash, "row": row}) + "\n")
+        
+        print(f"♻️  Loaded embedding checkpoint with {len(self._rows)} embedded chunks")
+
+class FullRebuildRequired(Exception):
+    """An incremental update cannot be applied to the existing index"""
+
+def chunk_hash(text):
+    """Content address of a chunk's text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def embed_with_retry(embedding, texts, gate, max_retries=MAX_RETRIES):
+    """Embed one batch, backing off exponentially with jitter on transient errors"""
+    for attempt in range(max_retries + 1):
+        gate.wait()
+        try:
+            return embedding.embed_documents(texts)
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = retry_after(e)
+            if delay is None:
+                delay = min(60, 2 ** attempt) + random.uniform(0, 1)
+            if isinstance(e, openai.RateLimitError):
+                gate.pause(delay)
+            print(f"⏳ {type(e).__name__}, retrying batch in {delay:.1f}s (attempt {attempt + 1}/{max_retries})")
+            time.sleep(delay)
+
+def embed_chunks(chunks, embedding, checkpoint, batch_size=100, workers=EMBED_WORKERS):
+    """Embed a stream of chunks over a thread pool, skipping any already in the checkpoint
+    
+    Batches are dispatched as soon as they fill, so embedding overlaps with
+    whatever produces ``chunks``. Returns the chunks as a list and an
+    (n, dim) float32 array of their embeddings in the same order.
+    """
+    print(f"🧮 Embedding chunks in batches of {batch_size} with {workers} workers...")
+    
+    collected, hashes = [], []
+    queued = set()
+    batch = []
+    in_flight = {}
+    gate = RateLimitGate()
+    start = time.perf_counter()
+    progress = {"batches": 0, "chunks": 0, "tokens": 0}
+    
+    def finish(future):
+        items = in_flight.pop(future)
+        checkpoint.add_batch([h for h, _ in items], future.result())
+        
+        progress["batches"] += 1
+        progress["chunks"] += len(items)
+        progress["tokens"] += count_tokens_many((text for _, text in items), EMBEDDING_ENCODING)
+        elapsed = time.perf_counter() - start
+        print(f"✅ Processed batch {progress['batches']} "
+              f"({progress['chunks'] / elapsed:.1f} chunks/s, {progress['tokens'] / elapsed:.0f} tokens/s)")
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def submit(items):
+            # Backpressure: keep at most two batches per worker in flight
+            while len(in_flight) >= 2 * workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future)
+            future = pool.submit(embed_with_retry, embedding, [text for _, text in items], gate)
+            in_flight[future] = items
+        
+        for chunk in chunks:
+            h = chunk_hash(chunk.page_content)
+            collected.append(chunk)
+            hashes.append(h)
             
-            docsearch.add_documents(batch)
-            print(f"✅ Processed batch {batch_num}/{total_batches}")
+            # Unique texts still missing from the checkpoint
+            if h in checkpoint or h in queued:
+                continue
+            queued.add(h)
+            batch.append((h, chunk.page_content))
+            if len(batch) >= batch_size:
+                submit(batch)
+                batch = []
+        
+        if batch:
+            submit(batch)
+        while in_flight:
+            finish(next(iter(wait(in_flight, return_when=FIRST_COMPLETED)[0])))
+    
+    elapsed = time.perf_counter() - start
+    print(f"📈 Embedded {progress['chunks']} new chunks ({len(collected) - len(queued)} reused), "
+          f"{progress['tokens']} tokens in {elapsed:.1f}s "
+          f"({progress['chunks'] / elapsed:.1f} chunks/s, {progress['tokens'] / elapsed:.0f} tokens/s)")
+    
+    return collected, checkpoint.matrix(hashes)
+
+def build_faiss_index(chunks, embedding, file_hashes, batch_size=100, workers=EMBED_WORKERS,
+                      checkpoint_path=CHECKPOINT_PATH, index_config=None, shards=1):
+    """Build FAISS index from a stream of chunks
+    
+    Returns the index (a ShardedIndex if ``shards`` > 1), the chunks in
+    vector id order and the build manifest.
+    """
+    index_config = index_config or make_index_config("flat")
+    print(f"🔨 Building {index_config['type']} FAISS index...")
+    
+    checkpoint = EmbeddingCheckpoint(checkpoint_path)
+    chunks, vectors = embed_chunks(chunks, embedding, checkpoint, batch_size=batch_size, workers=workers)
+    ids = assign_chunk_ids(chunks, file_hashes)
+    manifest = build_manifest(chunks, ids, file_hashes, index_config=index_config)
+    
+    if shards > 1:
+        index, chunks, manifest = build_sharded_index(chunks, vectors, manifest, index_config, shards)
     else:
-        # Process all at once if small dataset
-        docsearch = FAISS.from_documents(
-            documents=chunks,
-            embedding=embedding
+        index = build_index(vectors, index_config)
+        index.add(vectors)
+    
+    print(f"✅ FAISS index created with {len(chunks)} documents")
+    return index, chunks, manifest
+
+def assign_chunk_ids(chunks, file_hashes):
+    """Stable chunk ids: source file hash plus the chunk's position in that file"""
+    positions = {}
+    ids = []
+    for chunk in chunks:
+        source = chunk.metadata["source"]
+        position = positions.get(source, 0)
+        positions[source] = position + 1
+        ids.append(f"{file_hashes[source][:16]}-{position}")
+    return ids
+
+def build_manifest(chunks, ids, file_hashes, index_config, files=None):
+    """Record content hashes per source file and per chunk for incremental updates
+    
+    Files and their chunks are listed in vector id order, matching the chunk store.
+    """
+    files = dict(files or {})
+    for source, sha in file_hashes.items():
+        files[source] = {"sha256": sha, "chunks": []}
+    for chunk, chunk_id in zip(chunks, ids):
+        files[chunk.metadata["source"]]["chunks"].append(
+            {"id": chunk_id, "hash": chunk_hash(chunk.page_content)}
         )
     
-    print(f"✅ FAISS index created with {total_chunks} documents")
-    return docsearch
+    return {
+        "embedding_model": EMBEDDING_MODEL,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "index": index_config,
+        "files": files
+    }
+
+def load_manifest(path, index_config):
+    """Manifest of a previous build, or None if it cannot be updated incrementally"""
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        print("⚠️  No manifest found, running a full build")
+        return None
+    
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    
+    settings = (manifest.get("embedding_model"), manifest.get("chunk_size"), manifest.get("chunk_overlap"))
+    if settings != (EMBEDDING_MODEL, CHUNK_SIZE, CHUNK_OVERLAP):
+        print("⚠️  Chunking or embedding settings changed, running a full build")
+        return None
+    if manifest.get("index", {}).get("type", "flat") != index_config["type"]:
+        print("⚠️  Index type changed, running a full build")
+        return None
+    return manifest
+
+def save_manifest(manifest, path):
+    """Write the build manifest next to the index"""
+    with open(os.path.join(path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+
+def update_faiss_index(manifest, file_hashes, embedding, batch_size=100, workers=EMBED_WORKERS,
+                       checkpoint_path=CHECKPOINT_PATH, index_path=FAISS_INDEX_PATH, parse_workers=PARSE_WORKERS,
+                       shards=1):
+    """Apply only the changes in ``data/`` since the manifest was written
+    
+    Chunks of unchanged files are read back from the chunk store and their
+    vectors from the embedding checkpoint, so only new and modified files are
+    parsed and embedded. The index is then refilled in vector id order,
+    reusing the trained quantizer of unsharded IVF indexes. Sharded indexes
+    are repartitioned into ``shards`` shards and each shard is rebuilt.
+    
+    Returns the updated index, chunks and manifest, or (None, None, manifest) if nothing changed.
+    """
+    print("🔁 Updating FAISS index incrementally...")
+    
+    old_files = manifest["files"]
+    removed = [source for source in old_files if source not in file_hashes]
+    changed = [source for source, sha in file_hashes.items()
+               if source in old_files and old_files[source]["sha256"] != sha]
+    added = [source for source in file_hashes if source not in old_files]
+    
+    print(f"   - Added: {len(added)}, modified: {len(changed)}, removed: {len(removed)}")
+    if not (removed or changed or added):
+        print("✅ Index is already up to date")
+        return None, None, manifest
+    
+    if not (has_chunk_store(index_path) or is_sharded(index_path)):
+        raise FullRebuildRequired("Index has no chunk store")
+    store = open_chunk_store(index_path)
+    if len(store) != sum(len(entry["chunks"]) for entry in old_files.values()):
+        raise FullRebuildRequired("Chunk store does not match the manifest")
+    
+    # Rows of the chunk store that belong to unchanged files, in their existing order
+    kept_rows, row = [], 0
+    for source, entry in old_files.items():
+        if source not in removed and source not in changed:
+            kept_rows.extend(range(row, row + len(entry["chunks"])))
+        row += len(entry["chunks"])
+    print(f"🗑️  Dropping {len(store) - len(kept_rows)} chunks from removed or modified files")
+    
+    # Unchanged chunks (and unchanged text in modified files) are served from the checkpoint
+    new_sources = sorted(changed + added)
+    checkpoint = EmbeddingCheckpoint(checkpoint_path)
+    chunks, vectors = embed_chunks(
+        itertools.chain(
+            (store.document(i) for i in kept_rows),
+            prefetch(iter_pdf_chunks(new_sources, workers=parse_workers)) if new_sources else ()
+        ),
+        embedding, checkpoint, batch_size=batch_size, workers=workers
+    )
+    new_chunks = chunks[len(kept_rows):]
+    print(f"➕ Added {len(new_chunks)} chunks from new or modified files")
+    
+    index_config = manifest.get("index") or make_index_config("flat")
+    unchanged = {source: entry for source, entry in old_files.items()
+                 if source not in removed and source not in changed}
+    new_hashes = {source: file_hashes[source] for source in new_sources}
+    ids = assign_chunk_ids(new_chunks, new_hashes)
+    manifest = build_manifest(new_chunks, ids, new_hashes, index_config, files=unchanged)
+    
+    if shards > 1:
+        return build_sharded_index(chunks, vectors, manifest, index_config, shards)
+    index_config.pop("shards", None)
+    if index_config["type"] in ("ivf_flat", "ivf_pq") and not is_sharded(index_path):
+        index = faiss.read_index(os.path.join(index_path, INDEX_FILE))
+        index.reset()
+    else:
+        index = build_index(vectors, index_config)
+    index.add(vectors)
+    return index, chunks, manifest
 
-def save_index(docsearch, path):
-    """Save FAISS index to disk"""
+def save_index(index, chunks, path, index_config):
+    """Save FAISS index, its chunk store and the BM25 index over the same chunks to disk"""
     print(f"💾 Saving index to: {path}")
-    docsearch.save_local(path)
+    os.makedirs(path, exist_ok=True)
+    if isinstance(index, ShardedIndex):
+        save_sharded_index(index, chunks, path)
+    else:
+        faiss.write_index(index, os.path.join(path, INDEX_FILE))
+        write_chunk_store(path, (chunk.page_content for chunk in chunks), (chunk.metadata for chunk in chunks))
+    
+    print("🔤 Building BM25 index...")
+    BM25Index.build(chunk.page_content for chunk in chunks).save(path)
+    save_index_config(index_config, path)
+    
+    # Superseded by the chunk store
+    legacy_docstore = os.path.join(path, LEGACY_DOCSTORE_FILE)
+    if os.path.exists(legacy_docstore):
+        os.remove(legacy_docstore)
     print("✅ Index saved successfully!")
 
+def resolve_shards(requested, manifest):
+    """Shard count for this build: as requested, else the current index's when updating it"""
+    current = (manifest or {}).get("index", {}).get("shards", 1)
+    if requested is None:
+        return current if manifest is not None else 1
+    if manifest is not None and requested != current:
+        print(f"⚠️  Resharding index from {current} to {requested} shards")
+    return requested
+
+def parse_args():
+    """Command-line options"""
+    parser = argparse.ArgumentParser(description="Build FAISS vector database from PDF files")
+    parser.add_argument("--workers", type=int, default=EMBED_WORKERS, help="concurrent embedding requests")
+    parser.add_argument("--batch-size", type=int, default=100, help="chunks per embedding request")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS, help="processes parsing PDFs")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="directory for resumable embedding checkpoints")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only re-embed new or modified PDFs and drop vectors of removed ones")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat", help="FAISS index structure")
+    parser.add_argument("--nlist", type=int, default=DEFAULT_NLIST, help="IVF clusters")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="IVF clusters searched per query")
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_PQ_M, help="PQ sub-quantizers (must divide 1536)")
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_HNSW_M, help="HNSW neighbours per node")
+    parser.add_argument("--ef-search", type=int, default=DEFAULT_EF_SEARCH, help="HNSW search beam width")
+    parser.add_argument("--train-sample", type=int, default=DEFAULT_TRAIN_SAMPLE, help="vectors used to train IVF/PQ")
+    parser.add_argument("--shards", type=int,
+                        help="partition chunks by source document into this many separately searched shards "
+                             "(default: 1, or the current index's count with --incremental)")
+    parser.add_argument("--keep-versions", type=int, default=KEEP_VERSIONS,
+                        help="index versions kept on disk, including the new one")
+    return parser.parse_args()
+
 def main():
     """Main execution"""
+    args = parse_args()
+    
     print("=" * 60)
     print("🏗️  Building FAISS Vector Database")
     print("=" * 60)
     
+    index_config = make_index_config(
+        args.index_type,
+        nlist=args.nlist,
+        nprobe=args.nprobe,
+        pq_m=args.pq_m,
+        hnsw_m=args.hnsw_m,
+        ef_search=args.ef_search,
+        train_sample=args.train_sample
+    )
+    
     try:
-        # Step 1: Load PDFs
-        documents = load_pdfs(PDF_FOLDER)
+        file_hashes = hash_pdfs(PDF_FOLDER)
+        # The published version is only read; every build goes into a new version directory
+        current_path = resolve_index_path(FAISS_INDEX_PATH)
+        manifest = load_manifest(current_path, index_config) if args.incremental else None
+        shards = resolve_shards(args.shards, manifest)
         
-        # Step 2: Split into chunks
-        chunks = split_documents(documents)
-        
-        # Step 3: Initialize embeddings
+        # Step 1: Initialize embeddings
         embedding = create_embeddings()
         
-        # Step 4: Build FAISS index
-        docsearch = build_faiss_index(chunks, embedding)
+        index = chunks = None
+        if manifest is not None:
+            # Step 2: Re-embed only new and modified files
+            try:
+                index, chunks, manifest = update_faiss_index(
+                    manifest, file_hashes, embedding,
+                    batch_size=args.batch_size,
+                    workers=args.workers,
+                    checkpoint_path=args.checkpoint,
+                    index_path=current_path,
+                    parse_workers=args.parse_workers,
+                    shards=shards
+                )
+                index_config = manifest["index"]
+                stats = [f"   - Source files: {len(file_hashes)}"]
+            except FullRebuildRequired as e:
+                print(f"⚠️  {e}, running a full build")
+                manifest = None
+        
+        if manifest is None:
+            # Step 2: Parse and chunk PDFs in worker processes, streaming into
+            # Step 3: embedding and building the FAISS index
+            load_stats = {}
+            chunks = prefetch(iter_pdf_chunks(list(file_hashes), workers=args.parse_workers, stats=load_stats))
+            index, chunks, manifest = build_faiss_index(
+                chunks, embedding, file_hashes,
+                batch_size=args.batch_size,
+                workers=args.workers,
+                checkpoint_path=args.checkpoint,
+                index_config=index_config,
+                shards=shards
+            )
+            stats = [f"   - Total pages: {load_stats['pages']}", f"   - Total chunks: {load_stats['chunks']}"]
         
-        # Step 5: Save to disk
-        save_index(docsearch, FAISS_INDEX_PATH)
+        # Step 5: Save to disk as a new version, then publish it to running servers
+        if index is not None:
+            version, current_path = new_version_path(FAISS_INDEX_PATH)
+            manifest["version"] = version
+            save_index(index, chunks, current_path, index_config)
+            save_manifest(manifest, current_path)
+            publish_version(FAISS_INDEX_PATH, version)
+            print(f"📌 Published index version {version}")
+            removed = prune_versions(FAISS_INDEX_PATH, args.keep_versions)
+            if removed:
+                print(f"🗑️  Removed {len(removed)} old index versions")
         
         print("\n" + "=" * 60)
         print("🎉 SUCCESS! FAISS database built successfully")
         print("=" * 60)
         print(f"📊 Statistics:")
-        print(f"   - Total pages: {len(documents)}")
-        print(f"   - Total chunks: {len(chunks)}")
-        print(f"   - Index location: {FAISS_INDEX_PATH}")
+        for line in stats:
+            print(line)
+        print(f"   - Indexed chunks: {sum(len(entry['chunks']) for entry in manifest['files'].values())}")
+        print(f"   - Index type: {index_config['type']}")
+        if index_config.get("shards"):
+            print(f"   - Shards: {index_config['shards']}")
+        print(f"   - Index location: {current_path}")
+        if isinstance(embedding, CachedEmbeddings):
+            cache_stats = embedding.stats()
+            print(f"   - Embedding cache: {cache_stats['disk_hits'] + cache_stats['memory_hits']} hits, "
+                  f"{cache_stats['misses']} misses")
         print(f"\n💡 You can now use this index in your agent!")
-        
+    
     except Exception as e:
         print(f"\n❌ ERROR: {e}")
         raise
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,221 @@
+"""
+Build the FAQ store of precomputed answers from request logs
+Usage: python build_faq_store.py --log requests.jsonl --log logs/agent.log --min-count 3
+
+Questions are read from JSONL request logs (``question`` or ``title`` field)
+and from agent logs ("Processing new query: '...'" lines, text or JSON
+format). Rephrasings that normalize to the same text are counted together,
+then near-duplicates are clustered on embedding similarity to find the topics
+asked at least --min-count times. Each normalized question of those clusters
+is answered on its own by the full agent, with the critic always running,
+several at a time: questions a token apart ("type 1" vs "type 2", a drug or
+a dose) can clear the similarity threshold, so a cluster never shares one
+answer. Answers are checkpointed as they come in, so an interrupted run
+resumes where it stopped. Only critic-approved answers are stored, each under
+the normalized question it answered. Servers load the store at startup
+(FAQ_STORE_PATH).
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List
+
+import numpy as np
+from dotenv import load_dotenv
+
+from faq_store import chunk_fingerprint, faq_key, write_faq_store
+from main import setup_agent
+
+FAQ_STORE_PATH = "faq_store"
+MIN_COUNT = 3  # Times a cluster must have been asked to be precomputed
+MAX_ENTRIES = 1000  # Questions answered, most asked clusters first
+SIMILARITY_THRESHOLD = 0.95  # Cosine similarity joining a question to a cluster, as for the semantic cache
+WORKERS = 8  # Questions answered at once
+EMBED_BATCH_SIZE = 256
+
+_LOGGED_QUESTION = re.compile(r"(?:Processing|Streaming) new (?:async )?query: '(.*)'$")
+
+def read_questions(paths: Iterable[str]) -> List[str]:
+    """Every question asked in the given logs, repeats included"""
+    questions = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith("{"):
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    # Request logs carry the question; JSON agent logs carry the log message
+                    question = entry.get("question") or entry.get("title")
+                    if question is None and "message" in entry:
+                        match = _LOGGED_QUESTION.search(entry["message"])
+                        question = match.group(1) if match else None
+                else:
+                    match = _LOGGED_QUESTION.search(line)
+                    question = match.group(1) if match else None
+                if question:
+                    questions.append(question)
+    return questions
+
+def cluster_questions(questions: List[str], embed, threshold: float = SIMILARITY_THRESHOLD) -> List[Dict]:
+    """Clusters of questions, most asked first: their total count and their members, each a
+    question key (see faq_store.faq_key) with its count, most frequent wording and embedding
+    
+    Greedy leader clustering in order of frequency: a question key joins
+    the first cluster whose leader it is at least ``threshold`` similar to.
+    """
+    counts = Counter(faq_key(question) for question in questions)
+    wordings = defaultdict(Counter)
+    for question in questions:
+        wordings[faq_key(question)][question] += 1
+    keys = [key for key, _ in counts.most_common() if key]
+    if not keys:
+        return []
+    
+    print(f"🧮 Embedding {len(keys)} distinct questions...")
+    texts = [wordings[key].most_common(1)[0][0] for key in keys]
+    vectors = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        vectors.extend(embed(texts[start:start + EMBED_BATCH_SIZE]))
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    
+    leaders = np.empty((len(keys), vectors.shape[1]), dtype=np.float32)
+    clusters = []
+    for key, text, vector in zip(keys, texts, vectors):
+        member = {"question": text, "key": key, "count": counts[key], "embedding": vector.tolist()}
+        if clusters:
+            scores = leaders[:len(clusters)] @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= threshold:
+                clusters[best]["members"].append(member)
+                clusters[best]["count"] += counts[key]
+                continue
+        leaders[len(clusters)] = vector
+        clusters.append({"members": [member], "count": counts[key]})
+    clusters.sort(key=lambda cluster: cluster["count"], reverse=True)
+    return clusters
+
+def load_checkpoint(path: str, index_version) -> Dict[str, Dict]:
+    """Answers of an interrupted run on the same index version, by question key"""
+    answered = {}
+    if not os.path.exists(path):
+        return answered
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                break  # torn final line
+            if entry["index_version"] == index_version:
+                answered[faq_key(entry["question"])] = entry
+    print(f"♻️  Loaded {len(answered)} answers from checkpoint")
+    return answered
+
+def answer_questions(agent, questions: List[Dict], checkpoint_path: str, workers: int) -> List[Dict]:
+    """Answer each question (a cluster member), appending every answer to the checkpoint"""
+    answered = load_checkpoint(checkpoint_path, agent.retriever.index.version)
+    todo = [question for question in questions if question["key"] not in answered]
+    print(f"🤖 Answering {len(todo)} questions with {workers} workers "
+          f"({len(questions) - len(todo)} from checkpoint)...")
+    lock = threading.Lock()
+    
+    def answer(question):
+        result = agent.precompute_answer(question["question"], embedding=question["embedding"])
+        docs = result["documents"]
+        entry = {
+            "question": question["question"],
+            "answer": result["answer"],
+            "approved": result["approved"],
+            "chunk_ids": [doc.get("id") for doc in docs],
+            "fingerprints": [chunk_fingerprint(doc["content"]) for doc in docs],
+            "sources": len(docs),
+            "index_version": result["index_version"]
+        }
+        with lock, open(checkpoint_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        return entry
+    
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="faq") as pool:
+        futures = {pool.submit(answer, question): question for question in todo}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                entry = future.result()
+                answered[faq_key(entry["question"])] = entry
+            except Exception as e:
+                failed += 1
+                print(f"⚠️  Failed to answer '{futures[future]['question']}': {e}")
+            if done % 50 == 0:
+                print(f"   - {done}/{len(todo)} answered")
+    if failed:
+        print(f"⚠️  {failed} questions failed; rerun to retry them")
+    
+    entries = []
+    for question in questions:
+        entry = answered.get(question["key"])
+        if entry is not None:
+            # Stored under its own normalized question only: the critic approved it for that wording
+            entries.append({**entry, "keys": [question["key"]], "count": question["count"]})
+    return entries
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the FAQ store of precomputed answers from request logs")
+    parser.add_argument("--log", action="append", required=True, help="request log (JSONL) or agent log; repeatable")
+    parser.add_argument("--output", default=os.getenv("FAQ_STORE_PATH", FAQ_STORE_PATH), help="FAQ store directory")
+    parser.add_argument("--min-count", type=int, default=MIN_COUNT, help="times a question must have been asked")
+    parser.add_argument("--max-entries", type=int, default=MAX_ENTRIES, help="most questions to precompute")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD,
+                        help="cosine similarity for two questions to count as one topic")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="questions answered at once")
+    return parser.parse_args()
+
+def main():
+    """Main execution"""
+    load_dotenv()  # Before parsing, so FAQ_STORE_PATH from .env is the default output
+    args = parse_args()
+    
+    print("=" * 60)
+    print("🏗️  Building FAQ store")
+    print("=" * 60)
+    
+    questions = read_questions(args.log)
+    print(f"📂 Read {len(questions)} questions from {len(args.log)} logs")
+    
+    agent = setup_agent()
+    
+    clusters = cluster_questions(questions, agent.retriever.embed_queries, args.threshold)
+    clusters = [cluster for cluster in clusters if cluster["count"] >= args.min_count]
+    if not clusters:
+        print(f"⚠️  No question was asked {args.min_count} times, nothing to precompute")
+        return
+    selected = [member for cluster in clusters for member in cluster["members"]][:args.max_entries]
+    covered = sum(member["count"] for member in selected)
+    print(f"🧩 {len(selected)} distinct questions in {len(clusters)} clusters cover {covered} of "
+          f"{len(questions)} questions ({covered / len(questions):.0%})")
+    
+    checkpoint_path = f"{args.output}.checkpoint.jsonl"
+    entries = answer_questions(agent, selected, checkpoint_path, args.workers)
+    stored = [entry for entry in entries if entry["approved"] and entry["chunk_ids"]
+              and None not in entry["chunk_ids"]]
+    rejected = len(entries) - len(stored)
+    
+    write_faq_store(args.output, stored)
+    if len(entries) == len(selected):
+        os.remove(checkpoint_path)
+    print(f"✅ Stored {len(stored)} answers covering "
+          f"{sum(entry['count'] for entry in stored)} logged questions in {args.output}")
+    if rejected:
+        print(f"   - {rejected} answers not approved by the critic (or without chunk ids) were left out")
+
+if __name__ == "__main__":
+    main()
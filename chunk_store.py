@@ -0,0 +1,250 @@
+"""
+Memory-mapped chunk store for the knowledge base
+
+Chunk texts live back to back in one UTF-8 blob with an offset array, and
+metadata is stored column by column, so a chunk is read lazily by its FAISS
+vector id. Everything is opened with mmap: startup does no deserialization
+and worker processes share the pages through the OS cache.
+Usage: python chunk_store.py faiss_index  (one-off conversion of an index.pkl docstore)
+"""
+
+import json
+import mmap
+import os
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables.config import run_in_executor
+from langchain_core.vectorstores import VectorStore
+
+from index_factory import INDEX_FILE
+
+CHUNKS_FILE = "chunks.bin"  # UTF-8 chunk texts, back to back
+OFFSETS_FILE = "chunk_offsets.npy"  # int64 byte offsets into chunks.bin, one more than there are chunks
+SOURCES_FILE = "chunk_sources.json"  # Distinct source paths
+SOURCE_IDS_FILE = "chunk_source_ids.npy"  # int32 position in chunk_sources.json per chunk
+PAGES_FILE = "chunk_pages.npy"  # int32 page per chunk, -1 if unknown
+LEGACY_DOCSTORE_FILE = "index.pkl"  # Pickled LangChain docstore written by FAISS.save_local
+
+def write_chunk_store(path: str, texts: Iterable[str], metadatas: Iterable[Dict]):
+    """Write chunks in vector id order; only ``source`` and ``page`` metadata are kept"""
+    os.makedirs(path, exist_ok=True)
+    offsets = [0]
+    sources, source_ids, pages = {}, [], []
+    
+    with open(os.path.join(path, CHUNKS_FILE), "wb") as f:
+        for text, metadata in zip(texts, metadatas):
+            data = text.encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+            source_ids.append(sources.setdefault(metadata.get("source", ""), len(sources)))
+            pages.append(metadata.get("page", -1))
+    
+    np.save(os.path.join(path, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(path, SOURCE_IDS_FILE), np.asarray(source_ids, dtype=np.int32))
+    np.save(os.path.join(path, PAGES_FILE), np.asarray(pages, dtype=np.int32))
+    with open(os.path.join(path, SOURCES_FILE), "w") as f:
+        json.dump(list(sources), f)
+
+def has_chunk_store(path: str) -> bool:
+    """Whether ``path`` holds a chunk store"""
+    return os.path.exists(os.path.join(path, OFFSETS_FILE))
+
+class ChunkStore:
+    """Read-only, memory-mapped view of a chunk store"""
+    def __init__(self, path: str):
+        self.path = path
+        self._offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        self._source_ids = np.load(os.path.join(path, SOURCE_IDS_FILE), mmap_mode="r")
+        self._pages = np.load(os.path.join(path, PAGES_FILE), mmap_mode="r")
+        with open(os.path.join(path, SOURCES_FILE)) as f:
+            self._sources = json.load(f)
+        
+        with open(os.path.join(path, CHUNKS_FILE), "rb") as f:
+            # mmap refuses empty files
+            size = os.fstat(f.fileno()).st_size
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+    
+    def __len__(self):
+        return len(self._offsets) - 1
+    
+    def text(self, i: int) -> str:
+        return self._blob[int(self._offsets[i]):int(self._offsets[i + 1])].decode("utf-8")
+    
+    def metadata(self, i: int) -> Dict:
+        metadata = {"source": self._sources[self._source_ids[i]]}
+        page = int(self._pages[i])
+        if page >= 0:
+            metadata["page"] = page
+        return metadata
+    
+    def document(self, i: int) -> Document:
+        return Document(page_content=self.text(i), metadata=self.metadata(i))
+    
+    def source_ids(self, ids: np.ndarray) -> np.ndarray:
+        """Source document number of each of ``ids``, for comparing sources without reading them"""
+        return self._source_ids[ids]
+
+_VIEW_FIELDS = frozenset(("id", "content", "metadata", "similarity"))
+
+class ChunkView:
+    """Retrieval result referencing a chunk by vector id instead of copying its text
+    
+    Reads like a result dict (``view["content"]``, ``view["metadata"]``,
+    ``view.get("similarity")``); text and metadata are read from the store on access.
+    """
+    __slots__ = ("chunks", "id", "similarity")
+    
+    def __init__(self, chunks: ChunkStore, i: int, similarity: Optional[float]):
+        self.chunks = chunks
+        self.id = i
+        self.similarity = similarity
+    
+    @property
+    def content(self) -> str:
+        return self.chunks.text(self.id)
+    
+    @property
+    def metadata(self) -> Dict:
+        metadata = self.chunks.metadata(self.id)
+        if self.similarity is not None:
+            metadata["similarity"] = round(self.similarity, 4)
+        return metadata
+    
+    def __getitem__(self, key: str) -> Any:
+        if key not in _VIEW_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in _VIEW_FIELDS else default
+    
+    def __repr__(self):
+        return f"ChunkView(id={self.id}, similarity={self.similarity})"
+
+class MmapVectorStore(VectorStore):
+    """Read-only vector store over a memory-mapped index.faiss and chunk store
+    
+    Drop-in for the searches the agent makes on LangChain's FAISS store;
+    scores are L2 distances, as with FAISS's default distance strategy.
+    """
+    def __init__(self, index: faiss.Index, chunks: ChunkStore, embedding: Embeddings, version: Any = None):
+        self.index = index
+        self.chunks = chunks
+        self.embedding = embedding
+        self.version = version  # Identifies the index build, so caches of vector ids know when to drop them
+    
+    @classmethod
+    def load(cls, path: str, embedding: Embeddings) -> "MmapVectorStore":
+        """Open the index and chunk store in ``path`` without reading them into memory"""
+        if not has_chunk_store(path):
+            raise FileNotFoundError(
+                f"No chunk store in {path}; rebuild with build_faiss_db.py or run: python chunk_store.py {path}"
+            )
+        index_file = os.path.join(path, INDEX_FILE)
+        index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP)
+        chunks = ChunkStore(path)
+        if index.ntotal != len(chunks):
+            raise ValueError(f"Index has {index.ntotal} vectors but the chunk store has {len(chunks)} chunks")
+        return cls(index, chunks, embedding, version=(os.path.realpath(path), os.stat(index_file).st_mtime_ns))
+    
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+    
+    def page_in(self, block_size: int = 1 << 20) -> int:
+        """Read every file of the index directory once so its pages sit in the OS cache; returns bytes read
+        
+        The pages are shared by all processes mapping the files, so one worker paying for
+        this (or the gunicorn master, with --preload) spares the others' first queries.
+        """
+        buffer = bytearray(block_size)
+        total = 0
+        for name in sorted(os.listdir(self.chunks.path)):
+            file_path = os.path.join(self.chunks.path, name)
+            if not os.path.isfile(file_path):
+                continue
+            with open(file_path, "rb", buffering=0) as f:
+                while True:
+                    read = f.readinto(buffer)
+                    if not read:
+                        break
+                    total += read
+        return total
+    
+    def warm_up(self):
+        """One search, so the first query does not pay for lazy setup of the search path"""
+        if self.index.ntotal:
+            self.search_ids([0.0] * self.index.d, 1)
+    
+    def search_ids(self, embedding: List[float], k: int = 4) -> List[Tuple[int, float]]:
+        """Top ``k`` (vector id, L2 distance) pairs, nearest first"""
+        query = np.asarray([embedding], dtype=np.float32)
+        distances, ids = self.index.search(query, k)
+        return [(int(i), float(distance)) for i, distance in zip(ids[0], distances[0]) if i != -1]
+    
+    def search_ids_batch(self, embeddings: List[List[float]], k: int = 4) -> List[List[Tuple[int, float]]]:
+        """search_ids for many queries with one search over the query matrix"""
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), self.index.d)
+        distances, ids = self.index.search(queries, k)
+        return [[(int(i), float(distance)) for i, distance in zip(row_ids, row_distances) if i != -1]
+                for row_ids, row_distances in zip(ids, distances)]
+    
+    def search_vectors_batch(self, embeddings: List[List[float]],
+                             k: int = 4) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(ids, L2 distances, vectors) of each query's top ``k``, from one search
+        
+        Arrays are (queries, k) and (queries, k, dimension), nearest first;
+        missing results have id -1. Vectors are as stored, i.e. approximate for PQ.
+        """
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), self.index.d)
+        distances, ids, vectors = self.index.search_and_reconstruct(queries, k)
+        return ids, distances, vectors
+    
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        return [(self.chunks.document(i), distance) for i, distance in self.search_ids(embedding, k)]
+    
+    async def asimilarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                                      **kwargs: Any) -> List[Tuple[Document, float]]:
+        return await run_in_executor(None, self.similarity_search_with_score_by_vector, embedding, k, **kwargs)
+    
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+    
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+    
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k, **kwargs)
+    
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[Dict]] = None,
+                  **kwargs: Any) -> List[str]:
+        raise NotImplementedError("The chunk store is read-only; rebuild it with build_faiss_db.py")
+    
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[Dict]] = None,
+                   **kwargs: Any) -> "MmapVectorStore":
+        raise NotImplementedError("Build the index and chunk store with build_faiss_db.py")
+
+def migrate_docstore(path: str):
+    """Convert a pickled LangChain docstore into a chunk store, then remove the pickle
+    
+    Only run this on an index.pkl you built yourself: loading it unpickles arbitrary objects.
+    """
+    import pickle
+    
+    with open(os.path.join(path, LEGACY_DOCSTORE_FILE), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    docs = [docstore.search(index_to_docstore_id[i]) for i in range(len(index_to_docstore_id))]
+    
+    write_chunk_store(path, [doc.page_content for doc in docs], [doc.metadata for doc in docs])
+    os.remove(os.path.join(path, LEGACY_DOCSTORE_FILE))
+    print(f"✅ Wrote chunk store with {len(docs)} chunks to {path}")
+
+if __name__ == "__main__":
+    migrate_docstore(sys.argv[1] if len(sys.argv) > 1 else "faiss_index")
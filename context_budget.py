@@ -0,0 +1,120 @@
+"""
+Context assembly for answer prompts: deduplicates and merges retrieved
+chunks and fits them, and the conversation history, into token budgets
+"""
+
+import re
+from typing import Dict, Sequence, Tuple
+
+from token_counter import count_tokens, truncate_to_tokens
+
+CONTEXT_TOKEN_BUDGET = 1200  # Max tokens of retrieved context per prompt
+HISTORY_TOKEN_BUDGET = 300  # Max tokens of conversation history per prompt
+HISTORY_EXCHANGES = 3  # Most recent exchanges considered for the history
+DUPLICATE_THRESHOLD = 0.9  # Share of a chunk's word trigrams already in context to drop it
+MIN_OVERLAP_CHARS = 8  # Shortest shared edge treated as a chunk overlap
+MAX_OVERLAP_CHARS = 200  # Longest shared edge searched for (CHUNK_OVERLAP is 20)
+MIN_TRUNCATED_TOKENS = 40  # Smaller remainders of the budget are not worth a truncated chunk
+HISTORY_HEADER = "Previous Conversation:\n"  # prompts._messages separates it from the other parts
+
+WORD_PATTERN = re.compile(r"\w+")
+
+def _shingles(text: str) -> set:
+    """Word trigrams of ``text`` (the words themselves for very short texts)"""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < 3:
+        return set(words)
+    return {tuple(words[i:i + 3]) for i in range(len(words) - 2)}
+
+def _overlap(head: str, tail: str) -> int:
+    """Length of the longest suffix of ``head`` that is a prefix of ``tail``"""
+    for size in range(min(MAX_OVERLAP_CHARS, len(head), len(tail)), MIN_OVERLAP_CHARS - 1, -1):
+        if head.endswith(tail[:size]):
+            return size
+    return 0
+
+class ContextBudgeter:
+    """Turns ranked chunks and session history into budgeted prompt text"""
+    def __init__(self, max_context_tokens=CONTEXT_TOKEN_BUDGET, max_history_tokens=HISTORY_TOKEN_BUDGET,
+                 duplicate_threshold=DUPLICATE_THRESHOLD, history_exchanges=HISTORY_EXCHANGES):
+        self.max_context_tokens = max_context_tokens
+        self.max_history_tokens = max_history_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.history_exchanges = history_exchanges
+    
+    def assemble(self, docs: Sequence[Dict]) -> Dict:
+        """Context from retrieved ``docs``, which are expected best first
+        
+        Near-duplicates of earlier chunks are dropped, overlapping chunks of
+        the same source page are stitched together, and blocks are then
+        added in rank order until the token budget is spent. Returns the
+        context, its token count and the tokens saved against joining every
+        chunk verbatim.
+        """
+        blocks = []  # [source key, text], in rank order of their best chunk
+        seen = set()
+        for doc in docs:
+            text = doc["content"].strip()
+            shingles = _shingles(text)
+            if not shingles or len(shingles & seen) >= self.duplicate_threshold * len(shingles):
+                continue
+            seen |= shingles
+            
+            key = (doc["metadata"].get("source"), doc["metadata"].get("page"))
+            for block in blocks:
+                if block[0] != key:
+                    continue
+                after, before = _overlap(block[1], text), _overlap(text, block[1])
+                if after:
+                    block[1] += text[after:]
+                elif before:
+                    block[1] = text + block[1][before:]
+                else:
+                    continue
+                break
+            else:
+                blocks.append([key, text])
+        
+        parts, used = [], 0
+        for _, text in blocks:
+            tokens = count_tokens(text)
+            remaining = self.max_context_tokens - used
+            if tokens > remaining:
+                if remaining < MIN_TRUNCATED_TOKENS:
+                    break
+                text = truncate_to_tokens(text, remaining)
+                tokens = count_tokens(text)
+            parts.append(text)
+            used += tokens
+        
+        context = "\n\n".join(parts)
+        raw_tokens = count_tokens("\n\n".join(doc["content"] for doc in docs))
+        tokens = count_tokens(context)
+        return {"context": context, "tokens": tokens, "tokens_saved": max(0, raw_tokens - tokens)}
+    
+    def fit_history(self, exchanges: Sequence[Tuple[str, str]]) -> Tuple[str, int]:
+        """History text of the most recent exchanges that fit the budget, and tokens saved
+        
+        Older exchanges are dropped first; if even the latest one does not
+        fit, its answer is truncated.
+        """
+        exchanges = list(exchanges)[-self.history_exchanges:]
+        if not exchanges:
+            return "", 0
+        
+        kept, used = [], count_tokens(HISTORY_HEADER)
+        for question, answer in reversed(exchanges):
+            entry = f"Q: {question}\nA: {answer}\n\n"
+            tokens = count_tokens(entry)
+            if used + tokens > self.max_history_tokens:
+                if not kept:
+                    prefix = f"Q: {question}\nA: "
+                    answer = truncate_to_tokens(answer, self.max_history_tokens - used - count_tokens(prefix) - 1)
+                    kept.append(f"{prefix}{answer}\n\n")
+                break
+            kept.append(entry)
+            used += tokens
+        
+        history = (HISTORY_HEADER + "".join(reversed(kept))).rstrip("\n")
+        full = (HISTORY_HEADER + "".join(f"Q: {q}\nA: {a}\n\n" for q, a in exchanges)).rstrip("\n")
+        return history, max(0, count_tokens(full) - count_tokens(history))
@@ -0,0 +1,213 @@
+"""
+Content-addressed embedding cache shared by the index builder and the agent
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from logger_config import get_logger
+
+SQLITE_BATCH = 500  # Keys per SELECT ... IN query
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with an in-memory LRU tier and a persistent SQLite tier
+    
+    Vectors are keyed by a hash of the model name and the normalized text, so
+    identical texts are only ever embedded (and billed) once per model, across
+    processes and across index rebuilds.
+    """
+    def __init__(self, embedding: Embeddings, model: str, path: Optional[str] = "embedding_cache.db",
+                 memory_size: int = 5000):
+        self.embedding = embedding
+        self.model = model
+        self.path = path
+        self.memory_size = memory_size
+        self.logger = get_logger('cache')
+        
+        self._memory = OrderedDict()  # key -> float32 vector, least recently used first
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        
+        if self.path:
+            with self._connection() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL) WITHOUT ROWID"
+                )
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, vectors, missing = self._lookup(texts)
+        if missing:
+            fresh = self.embedding.embed_documents([texts[i] for i in missing])
+            self._fill(keys, vectors, missing, fresh)
+        return [vector.tolist() for vector in vectors]
+    
+    def embed_query(self, text: str) -> List[float]:
+        keys, vectors, missing = self._lookup([text])
+        if missing:
+            self._fill(keys, vectors, missing, [self.embedding.embed_query(text)])
+        return vectors[0].tolist()
+    
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, vectors, missing = await self._alookup(texts)
+        if missing:
+            fresh = await self.embedding.aembed_documents([texts[i] for i in missing])
+            await self._afill(keys, vectors, missing, fresh)
+        return [vector.tolist() for vector in vectors]
+    
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, vectors, missing = await self._alookup([text])
+        if missing:
+            await self._afill(keys, vectors, missing, [await self.embedding.aembed_query(text)])
+        return vectors[0].tolist()
+    
+    def stats(self) -> Dict:
+        """Hit-rate statistics per tier"""
+        total = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_size": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / total, 4) if total else 0.0
+        }
+    
+    def _key(self, text: str) -> bytes:
+        normalized = " ".join(unicodedata.normalize("NFC", text).split())
+        return hashlib.sha256(f"{self.model}\0{normalized}".encode("utf-8")).digest()
+    
+    def _lookup(self, texts: List[str]):
+        """Resolve texts from the memory tier, then the disk tier
+        
+        Returns the keys, the vectors found (None where missing) and the
+        indices of the first occurrence of each text that still needs embedding.
+        """
+        keys, vectors = self._lookup_memory(texts)
+        if self.path and any(vector is None for vector in vectors):
+            self._lookup_disk(keys, vectors)
+        return keys, vectors, self._missing(keys, vectors)
+    
+    async def _alookup(self, texts: List[str]):
+        """Async version of _lookup: the memory tier inline, the disk tier in a thread
+        
+        SQLite may wait up to its busy timeout while another process writes,
+        which must not stall the event loop.
+        """
+        keys, vectors = self._lookup_memory(texts)
+        if self.path and any(vector is None for vector in vectors):
+            await asyncio.to_thread(self._lookup_disk, keys, vectors)
+        return keys, vectors, self._missing(keys, vectors)
+    
+    def _lookup_memory(self, texts: List[str]):
+        keys = [self._key(text) for text in texts]
+        vectors = [None] * len(texts)
+        
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    vectors[i] = vector
+                    self.memory_hits += 1
+        return keys, vectors
+    
+    def _lookup_disk(self, keys, vectors):
+        """Fill in the vectors the memory tier missed from the disk tier"""
+        pending = [i for i, vector in enumerate(vectors) if vector is None]
+        found = self._read_disk({keys[i] for i in pending})
+        for i in pending:
+            if keys[i] in found:
+                vectors[i] = found[keys[i]]
+                self.disk_hits += 1
+        self._remember(found)
+    
+    def _missing(self, keys, vectors) -> List[int]:
+        """Index of the first occurrence of each text still without a vector"""
+        missing, seen = [], set()
+        for i, vector in enumerate(vectors):
+            if vector is None and keys[i] not in seen:
+                seen.add(keys[i])
+                missing.append(i)
+        self.misses += len(missing)
+        return missing
+    
+    def _fill(self, keys, vectors, missing, fresh):
+        """Store freshly embedded vectors in both tiers and fill in the result"""
+        new = self._fill_memory(keys, vectors, missing, fresh)
+        if self.path:
+            self._write_disk(new)
+    
+    async def _afill(self, keys, vectors, missing, fresh):
+        """Async version of _fill, writing the disk tier in a thread"""
+        new = self._fill_memory(keys, vectors, missing, fresh)
+        if self.path:
+            await asyncio.to_thread(self._write_disk, new)
+    
+    def _fill_memory(self, keys, vectors, missing, fresh) -> Dict:
+        new = {keys[i]: np.asarray(vector, dtype=np.float32) for i, vector in zip(missing, fresh)}
+        self._remember(new)
+        for i, key in enumerate(keys):
+            if vectors[i] is None:
+                vectors[i] = new[key]
+        return new
+    
+    def _remember(self, entries):
+        with self._lock:
+            for key, vector in entries.items():
+                self._memory[key] = vector
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+    
+    def _read_disk(self, keys):
+        keys = list(keys)
+        found = {}
+        conn = self._connection()
+        for start in range(0, len(keys), SQLITE_BATCH):
+            batch = keys[start:start + SQLITE_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            for key, blob in conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ):
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+    
+    def _write_disk(self, entries):
+        try:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, vector.tobytes()) for key, vector in entries.items()]
+                )
+        except sqlite3.Error as e:
+            # The cache is an optimization; never fail an embedding call over it
+            self.logger.warning("Embedding cache write failed: %s", e)
+    
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets the builder and API workers share the file
+        
+        A connection must not be used across fork(): a worker forked from a
+        preloaded master (gunicorn --preload) opens its own instead of reusing
+        the one its thread-local inherited.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
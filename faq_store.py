@@ -0,0 +1,197 @@
+"""
+Precomputed answers to frequent questions
+
+build_faq_store.py answers the most frequent questions in the request logs
+offline and writes the critic-approved answers here. At query time a question
+whose key (see faq_key) is one that was answered and approved is answered
+with one dict lookup, before any embedding, retrieval or LLM call.
+
+Each entry records the vector ids of its source chunks and a fingerprint of
+their text. Entries are checked against the index being served when the store
+is loaded and again whenever a new index version is swapped in; an entry whose
+chunks are gone or whose text changed stops being served. A rebuild that only
+renumbers chunks drops entries too, which errs on the side of answering live.
+
+    faq_store/
+        faq.json                  entries (question, index version, count) and question key -> entry
+        faq_answers.bin           UTF-8 answers, back to back
+        faq_answer_offsets.npy    int64 byte offsets into faq_answers.bin, one more than there are entries
+        faq_chunk_ids.npy         int64 source chunk ids per entry, padded with -1
+        faq_fingerprints.npy      uint64 fingerprints of those chunks' text
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from logger_config import get_logger
+
+FAQ_FILE = "faq.json"
+ANSWERS_FILE = "faq_answers.bin"
+ANSWER_OFFSETS_FILE = "faq_answer_offsets.npy"
+CHUNK_IDS_FILE = "faq_chunk_ids.npy"
+FINGERPRINTS_FILE = "faq_fingerprints.npy"
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING = re.compile(r"[\s?!.]+$")
+
+def faq_key(question: str) -> str:
+    """Lookup key of a question: Unicode-normalized, case-folded, whitespace collapsed, trailing ?!. dropped
+    
+    Stricter than the retrieval cache key, since a hit skips the LLM: every
+    other character must match, so "HbA1c < 7%" and "HbA1c > 7%", or
+    "1.5 mg" and "1 5 mg", are different questions.
+    """
+    question = unicodedata.normalize("NFKC", question).casefold()
+    return _TRAILING.sub("", _WHITESPACE.sub(" ", question).strip())
+
+def chunk_fingerprint(text: str) -> int:
+    """64-bit fingerprint of a chunk's text"""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+def write_faq_store(path: str, entries: List[Dict]):
+    """Write entries (question, answer, keys, chunk_ids, fingerprints, sources, count, index_version)
+    into a new directory, then move it over ``path``"""
+    temp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    
+    width = max((len(entry["chunk_ids"]) for entry in entries), default=0)
+    chunk_ids = np.full((len(entries), width), -1, dtype=np.int64)
+    fingerprints = np.zeros((len(entries), width), dtype=np.uint64)
+    offsets = [0]
+    keys = {}
+    with open(os.path.join(temp_path, ANSWERS_FILE), "wb") as f:
+        for row, entry in enumerate(entries):
+            data = entry["answer"].encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+            chunk_ids[row, :len(entry["chunk_ids"])] = entry["chunk_ids"]
+            fingerprints[row, :len(entry["fingerprints"])] = entry["fingerprints"]
+            for key in entry["keys"]:
+                keys.setdefault(key, row)
+    
+    np.save(os.path.join(temp_path, ANSWER_OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(temp_path, CHUNK_IDS_FILE), chunk_ids)
+    np.save(os.path.join(temp_path, FINGERPRINTS_FILE), fingerprints)
+    with open(os.path.join(temp_path, FAQ_FILE), "w") as f:
+        json.dump({
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "entries": [{"question": entry["question"], "sources": entry["sources"], "count": entry["count"],
+                         "index_version": entry["index_version"]} for entry in entries],
+            "keys": keys
+        }, f)
+    
+    old_path = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(temp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+class FaqStore:
+    """Read-only store of precomputed answers, looked up by normalized question
+    
+    Pass the ``retriever_tool`` serving queries to check entries against its
+    index now and on every ``invalidate`` (called by IndexReloader after a swap).
+    """
+    def __init__(self, path: str, retriever_tool=None):
+        self.path = path
+        self.retriever_tool = retriever_tool
+        self.logger = get_logger('cache')
+        
+        with open(os.path.join(path, FAQ_FILE)) as f:
+            meta = json.load(f)
+        self.built_at = meta["built_at"]
+        self._entries = meta["entries"]
+        self._keys = meta["keys"]
+        self._offsets = np.load(os.path.join(path, ANSWER_OFFSETS_FILE))
+        self._chunk_ids = np.load(os.path.join(path, CHUNK_IDS_FILE))
+        self._fingerprints = np.load(os.path.join(path, FINGERPRINTS_FILE))
+        with open(os.path.join(path, ANSWERS_FILE), "rb") as f:
+            self._answers = f.read()
+        self._valid = np.ones(len(self._entries), dtype=bool)
+        self.validated_version = None
+        
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if retriever_tool is not None:
+            self.validate(retriever_tool.index)
+    
+    @classmethod
+    def load(cls, path: str, retriever_tool=None) -> Optional["FaqStore"]:
+        """The store in ``path``, or None if none was built"""
+        if not os.path.exists(os.path.join(path, FAQ_FILE)):
+            return None
+        return cls(path, retriever_tool)
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def lookup(self, question: str) -> Optional[Dict]:
+        """The precomputed entry for ``question``, if one is stored and still valid"""
+        row = self._keys.get(faq_key(question))
+        found = row is not None and self._valid[row]
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not found:
+            return None
+        entry = self._entries[row]
+        answer = self._answers[int(self._offsets[row]):int(self._offsets[row + 1])].decode("utf-8")
+        return {"question": entry["question"], "answer": answer, "sources": entry["sources"]}
+    
+    def validate(self, index) -> int:
+        """Serve only entries whose source chunks are unchanged in ``index`` (a SearchIndex); returns how many"""
+        chunks = getattr(index.retriever.vectorstore, "chunks", None)
+        if chunks is None:
+            # Without a chunk store there are no vector ids to check against
+            valid = np.zeros(len(self._entries), dtype=bool)
+        else:
+            present = self._chunk_ids >= 0
+            ids, inverse = np.unique(self._chunk_ids[present], return_inverse=True)
+            current = np.asarray([chunk_fingerprint(chunks.text(int(i))) if i < len(chunks) else 0 for i in ids],
+                                 dtype=np.uint64)
+            matches = np.ones(self._chunk_ids.shape, dtype=bool)
+            matches[present] = current[inverse.ravel()] == self._fingerprints[present]
+            valid = matches.all(axis=1) & present.any(axis=1)  # Entries with no source chunks cannot be checked
+        
+        self._valid = valid
+        self.validated_version = index.version
+        count = int(valid.sum())
+        self.logger.info("FAQ store: %d of %d entries valid for index version %s", count, len(valid), index.version)
+        return count
+    
+    def invalidate(self, reason: str):
+        """Recheck entries against the index now served, after the knowledge base changed"""
+        self.logger.info("Revalidating FAQ store: %s", reason)
+        with self._lock:
+            self.invalidations += 1
+        if self.retriever_tool is not None:
+            self.validate(self.retriever_tool.index)
+    
+    def stats(self) -> Dict:
+        """Hit/miss counters and valid entries for monitoring"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "valid": int(self._valid.sum()),
+            "questions": len(self._keys),
+            "built_at": self.built_at,
+            "validated_version": self.validated_version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "invalidations": self.invalidations
+        }
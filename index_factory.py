@@ -0,0 +1,104 @@
+"""
+FAISS index types for the knowledge base: flat, IVF-Flat, IVF-PQ and HNSW
+"""
+
+import json
+import math
+import os
+from typing import Dict, Optional
+
+import faiss
+import numpy as np
+
+INDEX_FILE = "index.faiss"  # FAISS index, as written by faiss.write_index
+INDEX_CONFIG_FILE = "index_config.json"  # Index type and parameters, written next to index.faiss
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# Defaults, tuned for ~1M 1536-d ada-002 vectors
+DEFAULT_NLIST = 4096  # IVF coarse clusters (~sqrt(n) to 4*sqrt(n))
+DEFAULT_NPROBE = 32  # IVF clusters visited per query
+DEFAULT_PQ_M = 96  # PQ sub-quantizers; must divide the dimension (1536 / 96 = 16 dims each)
+DEFAULT_PQ_NBITS = 8  # Bits per PQ code
+DEFAULT_HNSW_M = 32  # HNSW graph neighbours per node
+DEFAULT_EF_CONSTRUCTION = 200  # HNSW build-time beam width
+DEFAULT_EF_SEARCH = 128  # HNSW query-time beam width
+DEFAULT_TRAIN_SAMPLE = 100_000  # Vectors sampled to train IVF/PQ
+MIN_POINTS_PER_CENTROID = 39  # FAISS warns below this many training points per cluster
+
+def make_index_config(index_type="flat", nlist=DEFAULT_NLIST, nprobe=DEFAULT_NPROBE, pq_m=DEFAULT_PQ_M,
+                      pq_nbits=DEFAULT_PQ_NBITS, hnsw_m=DEFAULT_HNSW_M, ef_construction=DEFAULT_EF_CONSTRUCTION,
+                      ef_search=DEFAULT_EF_SEARCH, train_sample=DEFAULT_TRAIN_SAMPLE) -> Dict:
+    """Index configuration as persisted in index_config.json"""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
+    
+    config = {"type": index_type}
+    if index_type in ("ivf_flat", "ivf_pq"):
+        config.update(nlist=nlist, nprobe=nprobe, train_sample=train_sample)
+    if index_type == "ivf_pq":
+        config.update(pq_m=pq_m, pq_nbits=pq_nbits)
+    if index_type == "hnsw":
+        config.update(hnsw_m=hnsw_m, ef_construction=ef_construction, ef_search=ef_search)
+    return config
+
+def build_index(vectors: np.ndarray, config: Dict) -> faiss.Index:
+    """Create an empty index of the configured type, trained on a sample of ``vectors``
+    
+    Cluster counts are scaled down when there are too few vectors to train
+    them; the values actually used are written back into ``config``.
+    """
+    n, dim = vectors.shape
+    index_type = config["type"]
+    
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+    
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, config["hnsw_m"])
+        index.hnsw.efConstruction = config["ef_construction"]
+        apply_search_params(index, config)
+        return index
+    
+    config["nlist"] = max(1, min(config["nlist"], n // MIN_POINTS_PER_CENTROID))
+    if index_type == "ivf_flat":
+        description = f"IVF{config['nlist']},Flat"
+    else:
+        if dim % config["pq_m"]:
+            raise ValueError(f"pq_m={config['pq_m']} must divide the vector dimension {dim}")
+        config["pq_nbits"] = max(1, min(config["pq_nbits"], int(math.log2(max(2, n // MIN_POINTS_PER_CENTROID)))))
+        description = f"IVF{config['nlist']},PQ{config['pq_m']}x{config['pq_nbits']}"
+    
+    index = faiss.index_factory(dim, description, faiss.METRIC_L2)
+    
+    sample_size = min(n, config["train_sample"])
+    sample = vectors[np.random.default_rng(0).choice(n, sample_size, replace=False)] if sample_size < n else vectors
+    print(f"🎓 Training {description} on {sample_size} vectors...")
+    index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    
+    apply_search_params(index, config)
+    return index
+
+def apply_search_params(index: faiss.Index, config: Dict, nprobe: Optional[int] = None,
+                        ef_search: Optional[int] = None):
+    """Set query-time knobs (nprobe / efSearch), overriding the built-in values if given"""
+    params = faiss.ParameterSpace()
+    if config["type"] in ("ivf_flat", "ivf_pq"):
+        params.set_index_parameter(index, "nprobe", nprobe or config["nprobe"])
+    elif config["type"] == "hnsw":
+        params.set_index_parameter(index, "efSearch", ef_search or config["ef_search"])
+
+def save_index_config(config: Dict, path: str):
+    with open(os.path.join(path, INDEX_CONFIG_FILE), "w") as f:
+        json.dump(config, f)
+
+def load_index_config(path: str) -> Dict:
+    """Configuration of the index at ``path``; indexes built before it existed are flat"""
+    config_path = os.path.join(path, INDEX_CONFIG_FILE)
+    if not os.path.exists(config_path):
+        return make_index_config("flat")
+    with open(config_path) as f:
+        return json.load(f)
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """Serialized size of the index, a close proxy for its resident memory"""
+    return int(faiss.serialize_index(index).size)
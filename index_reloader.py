@@ -0,0 +1,144 @@
+"""
+Zero-downtime index hot-swap
+
+Each worker polls the CURRENT pointer of a versioned index directory (see
+index_versions). When build_faiss_db.py publishes a new version, the worker
+loads it on the polling thread, pages it in and runs a few searches against
+it, then swaps it into the RetrieverTool. Requests already running finish on
+the old index; its memory maps are released once the last of them drops its
+reference. A version that fails to load is logged and skipped until a newer
+one is published, and the old index keeps serving.
+"""
+
+import os
+import threading
+import time
+import weakref
+from typing import Callable, Dict, List, Optional
+
+from agent_tools import RetrieverTool, SearchIndex
+from index_versions import current_version, version_path
+from logger_config import get_logger
+
+WARMUP_QUERIES = (
+    "What are the symptoms of diabetes?",
+    "How is high blood pressure treated?",
+    "What causes acne?",
+)
+
+class IndexReloader:
+    """Swaps newly published index versions into a RetrieverTool
+    
+    ``load`` builds a SearchIndex from a version directory. ``caches`` are
+    cleared on every swap, since their answers came from the old index.
+    """
+    def __init__(self, root: str, load: Callable[[str], SearchIndex], retriever_tool: RetrieverTool,
+                 caches: Optional[List] = None, poll_interval: float = 30.0,
+                 warmup_queries: List[str] = WARMUP_QUERIES):
+        self.root = root
+        self.load = load
+        self.retriever_tool = retriever_tool
+        self.caches = [cache for cache in caches or [] if cache is not None]
+        self.poll_interval = poll_interval
+        self.warmup_queries = list(warmup_queries)
+        self.logger = get_logger('retriever')
+        
+        self.swaps = 0
+        self.failures = 0
+        self.last_swap_seconds = None  # Load, warm-up and swap of the latest version
+        self._failed_version = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        os.register_at_fork(after_in_child=self._after_fork)
+    
+    @property
+    def version(self) -> Optional[str]:
+        """Version being served"""
+        return self.retriever_tool.index.version
+    
+    def start(self):
+        """Poll for new versions on a background thread, unless polling is off or already running"""
+        if self.poll_interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll, name="index-reloader", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+    
+    def check(self) -> bool:
+        """Swap in the published version if it is not the one being served; returns whether it did"""
+        with self._lock:
+            version = current_version(self.root)
+            if version is None or version in (self.version, self._failed_version):
+                return False
+            
+            self.logger.info("Loading index version %s", version)
+            start = time.perf_counter()
+            try:
+                index = self.load(version_path(self.root, version))
+                index.version = version
+                self._warm_up(index)
+            except Exception as e:
+                self.failures += 1
+                self._failed_version = version
+                self.logger.error("Failed to load index version %s, still serving %s: %s",
+                                  version, self.version, e, exc_info=True)
+                return False
+            
+            previous = self.retriever_tool.swap(index)
+            for cache in self.caches:
+                cache.invalidate(f"index version {version}")
+            self.swaps += 1
+            self.last_swap_seconds = time.perf_counter() - start
+            self.logger.info("Now serving index version %s (was %s), ready in %.2fs",
+                             version, previous.version, self.last_swap_seconds)
+            # Retrieved chunk views keep the old chunk store alive, so watch it rather than the index
+            vectorstore = previous.retriever.vectorstore
+            weakref.finalize(getattr(vectorstore, "chunks", vectorstore), self.logger.info,
+                             "Released index version %s", previous.version)
+            return True
+    
+    def stats(self) -> Dict:
+        """Served version and swap counters for monitoring"""
+        return {
+            "version": self.version,
+            "published": current_version(self.root),
+            "swaps": self.swaps,
+            "failures": self.failures,
+            "last_swap_seconds": round(self.last_swap_seconds, 3) if self.last_swap_seconds is not None else None,
+            "poll_interval": self.poll_interval
+        }
+    
+    def _warm_up(self, index: SearchIndex):
+        """Fault the new version into the page cache and search it before it takes traffic"""
+        vectorstore = index.retriever.vectorstore
+        if hasattr(vectorstore, "page_in"):
+            vectorstore.page_in()
+        if hasattr(vectorstore, "warm_up"):
+            vectorstore.warm_up()
+        try:
+            embeddings = vectorstore.embeddings.embed_documents(self.warmup_queries)
+        except Exception as e:
+            self.logger.warning("Could not embed warm-up queries, skipping warm-up searches: %s", e)
+            embeddings = []
+        k = index.retriever.search_kwargs.get("k", 4)
+        for embedding in embeddings:
+            vectorstore.similarity_search_with_score_by_vector(embedding, k=k)
+        if index.lexical is not None:
+            for query in self.warmup_queries:
+                index.lexical.search(query, k)
+    
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.error("Index version check failed: %s", e, exc_info=True)
+    
+    def _after_fork(self):
+        """The polling thread does not survive a fork; AgentRuntime starts it again per worker"""
+        self._lock = threading.Lock()
+        self._thread = None
@@ -0,0 +1,78 @@
+"""
+Versioned index directories with an atomic "current" pointer
+
+    faiss_index/
+        CURRENT                          name of the version being served
+        versions/20261016T093000Z-3fa2c1/
+            index.faiss, chunk store, BM25 index, index_config.json, manifest.json
+
+build_faiss_db.py writes every build into a new directory under versions/
+and never modifies it afterwards, then publishes it by replacing CURRENT
+with a rename, which is atomic: readers see either the old or the new
+version. A directory without CURRENT is a pre-versioning index and is
+served as it is.
+"""
+
+import os
+import secrets
+import shutil
+import time
+from typing import List, Optional, Tuple
+
+CURRENT_FILE = "CURRENT"  # Name of the published version
+VERSIONS_DIR = "versions"  # One immutable directory per build
+
+def current_version(root: str) -> Optional[str]:
+    """Name of the published version, or None for an unversioned (or missing) index"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def version_path(root: str, version: str) -> str:
+    return os.path.join(root, VERSIONS_DIR, version)
+
+def resolve_index_path(root: str) -> str:
+    """Directory holding the index files to serve: the published version, else ``root`` itself"""
+    version = current_version(root)
+    return version_path(root, version) if version else root
+
+def new_version_path(root: str) -> Tuple[str, str]:
+    """(name, directory) for a new build; names sort in build order"""
+    version = f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{secrets.token_hex(3)}"
+    path = version_path(root, version)
+    os.makedirs(path)
+    return version, path
+
+def publish_version(root: str, version: str):
+    """Point CURRENT at ``version``; servers pick it up on their next poll"""
+    if not os.path.isdir(version_path(root, version)):
+        raise FileNotFoundError(f"No index version {version} in {root}")
+    temp_path = os.path.join(root, f".{CURRENT_FILE}.{os.getpid()}")
+    with open(temp_path, "w") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, os.path.join(root, CURRENT_FILE))
+
+def list_versions(root: str) -> List[str]:
+    """Names of all version directories, oldest first"""
+    try:
+        return sorted(name for name in os.listdir(os.path.join(root, VERSIONS_DIR))
+                      if os.path.isdir(version_path(root, name)))
+    except FileNotFoundError:
+        return []
+
+def prune_versions(root: str, keep: int) -> List[str]:
+    """Delete all but the ``keep`` newest versions, never the published one; returns the deleted names
+    
+    Workers still serving a deleted version keep reading it: on POSIX the mapped
+    files stay valid until the last process unmaps them.
+    """
+    current = current_version(root)
+    old = [version for version in list_versions(root) if version != current]
+    removed = old[:max(0, len(old) - max(keep - 1, 0))]
+    for version in removed:
+        shutil.rmtree(version_path(root, version), ignore_errors=True)
+    return removed
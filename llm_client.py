@@ -0,0 +1,440 @@
+"""
+Resilient client layer for Azure OpenAI chat and embedding deployments
+
+Every client shares one pair of keep-alive HTTP connection pools, and the SDK's own
+retries are turned off. Each call goes through a ResilientCaller, which adds:
+- retries with exponential backoff and full jitter on transient errors (429, 5xx,
+  timeouts, connection failures), honoring retry-after-ms / retry-after headers
+- optional hedging: when there is no reply after ``hedge_after`` seconds, send a
+  second identical request and take whichever reply comes first
+- a circuit breaker per deployment, so a failing deployment is skipped for a while
+  instead of making every request wait out its retries
+- fallback to the next deployment in the list (e.g. another region) once one fails
+"""
+
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence
+
+import httpx
+import openai
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from logger_config import get_logger
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitOpenError(RuntimeError):
+    """No deployment is accepting calls"""
+
+def retry_after(error) -> Optional[float]:
+    """Seconds requested by a Retry-After header on an API error, if any"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header in ("retry-after-ms", "retry-after"):
+        value = headers.get(header)
+        if value:
+            try:
+                seconds = float(value)
+            except ValueError:
+                continue
+            return seconds / 1000 if header == "retry-after-ms" else seconds
+    return None
+
+class RateLimitGate:
+    """Shared pause so one rate-limited caller backs off everyone using the deployment"""
+    def __init__(self):
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+    
+    def remaining(self) -> float:
+        return max(0.0, self._resume_at - time.monotonic())
+    
+    def wait(self):
+        delay = self.remaining()
+        if delay > 0:
+            time.sleep(delay)
+    
+    def pause(self, seconds):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, unless the server says how long to wait"""
+    def __init__(self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 20.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+    
+    def delay(self, attempt: int, error: Exception) -> float:
+        requested = retry_after(error)
+        if requested is not None:
+            return min(requested, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures; after ``reset_timeout``
+    seconds one trial call is let through (half-open), and its outcome closes or reopens it.
+    A trial that never reports back is replaced by another after ``reset_timeout``.
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._opened_at = 0.0
+        self._trial_started = None
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """Whether a call may go to the deployment now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._trial_started = None
+            if self.state == HALF_OPEN and (self._trial_started is None
+                                            or now - self._trial_started >= self.reset_timeout):
+                self._trial_started = now
+                return True
+            return False
+    
+    def record_success(self):
+        """The deployment answered, even if only to reject the request"""
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_started = None
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.trips += 1
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial_started = None
+
+class Deployment:
+    """One deployment's client with its breaker and rate-limit gate"""
+    def __init__(self, name: str, client: Any, breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.client = client
+        self.breaker = breaker or CircuitBreaker()
+        self.gate = RateLimitGate()
+
+class ConnectionPools:
+    """Keep-alive HTTP connection pools shared by every Azure OpenAI client"""
+    def __init__(self, max_connections: int = 100, max_keepalive: int = 20, keepalive_expiry: float = 30.0,
+                 timeout: float = 30.0):
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                              keepalive_expiry=keepalive_expiry)
+        self.timeout = timeout
+        self.sync = httpx.Client(limits=limits, timeout=timeout)
+        self.async_ = httpx.AsyncClient(limits=limits, timeout=timeout)
+    
+    def client_kwargs(self) -> Dict:
+        """Arguments for AzureChatOpenAI / AzureOpenAIEmbeddings: these pools, and no SDK-level retries"""
+        return {"http_client": self.sync, "http_async_client": self.async_, "max_retries": 0, "timeout": self.timeout}
+
+class ResilientCaller:
+    """Runs calls against a list of deployments with retries, hedging, breakers and fallback"""
+    def __init__(self, deployments: Sequence[Deployment], retry: Optional[RetryPolicy] = None,
+                 hedge_after: float = 0.0):
+        if not deployments:
+            raise ValueError("At least one deployment is required")
+        self.deployments = list(deployments)
+        self.retry = retry or RetryPolicy()
+        self.hedge_after = hedge_after
+        self.logger = get_logger('api')
+        self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge") if hedge_after > 0 else None
+        self.counters = {"calls": 0, "retries": 0, "fallbacks": 0, "hedges": 0, "hedge_wins": 0, "failures": 0}
+        self._counter_lock = threading.Lock()
+    
+    def stats(self) -> Dict:
+        with self._counter_lock:
+            counters = dict(self.counters)
+        counters["deployments"] = {
+            deployment.name: {"state": deployment.breaker.state, "trips": deployment.breaker.trips}
+            for deployment in self.deployments
+        }
+        return counters
+    
+    def call(self, fn: Callable[[Any], Any]) -> Any:
+        """``fn(client)`` on the first deployment that succeeds"""
+        self._count("calls")
+        error = None
+        for i, deployment in enumerate(self.deployments):
+            if i:
+                self._count("fallbacks")
+            try:
+                return self._call_with_retries(deployment, fn)
+            except RETRYABLE_ERRORS + (CircuitOpenError,) as e:
+                error = e
+                self.logger.warning("Deployment %s unavailable: %s", deployment.name, e)
+        self._count("failures")
+        raise error
+    
+    async def acall(self, afn: Callable[[Any], Any]) -> Any:
+        """Async version of call; ``afn(client)`` returns an awaitable"""
+        self._count("calls")
+        error = None
+        for i, deployment in enumerate(self.deployments):
+            if i:
+                self._count("fallbacks")
+            try:
+                return await self._acall_with_retries(deployment, afn)
+            except RETRYABLE_ERRORS + (CircuitOpenError,) as e:
+                error = e
+                self.logger.warning("Deployment %s unavailable: %s", deployment.name, e)
+        self._count("failures")
+        raise error
+    
+    def stream(self, fn: Callable[[Any], Iterator]) -> Iterator:
+        """Stream ``fn(client)``; retries and fallback apply only until the first chunk arrives"""
+        self._count("calls")
+        error = None
+        for i, deployment in enumerate(self.deployments):
+            if i:
+                self._count("fallbacks")
+            try:
+                chunks, first = self._first_chunk_with_retries(deployment, fn)
+            except RETRYABLE_ERRORS + (CircuitOpenError,) as e:
+                error = e
+                self.logger.warning("Deployment %s unavailable: %s", deployment.name, e)
+                continue
+            if first is not None:
+                yield first
+                yield from chunks
+            return
+        self._count("failures")
+        raise error
+    
+    async def astream(self, afn: Callable[[Any], AsyncIterator]) -> AsyncIterator:
+        """Async version of stream"""
+        self._count("calls")
+        error = None
+        for i, deployment in enumerate(self.deployments):
+            if i:
+                self._count("fallbacks")
+            try:
+                chunks, first = await self._afirst_chunk_with_retries(deployment, afn)
+            except RETRYABLE_ERRORS + (CircuitOpenError,) as e:
+                error = e
+                self.logger.warning("Deployment %s unavailable: %s", deployment.name, e)
+                continue
+            if first is not None:
+                yield first
+                async for chunk in chunks:
+                    yield chunk
+            return
+        self._count("failures")
+        raise error
+    
+    def _count(self, name: str, n: int = 1):
+        with self._counter_lock:
+            self.counters[name] += n
+    
+    def _before_attempt(self, deployment: Deployment):
+        if not deployment.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for deployment {deployment.name}")
+    
+    def _after_failure(self, deployment: Deployment, attempt: int, error: Exception) -> float:
+        """Record a transient failure; the delay before the next attempt, or re-raise if none is left"""
+        deployment.breaker.record_failure()
+        if attempt == self.retry.max_retries:
+            raise error
+        delay = self.retry.delay(attempt, error)
+        if isinstance(error, openai.RateLimitError):
+            deployment.gate.pause(delay)
+        self._count("retries")
+        self.logger.info("%s from %s, retrying in %.2fs (attempt %d/%d)", type(error).__name__,
+                         deployment.name, delay, attempt + 1, self.retry.max_retries)
+        return delay
+    
+    def _call_with_retries(self, deployment: Deployment, fn: Callable[[Any], Any]) -> Any:
+        for attempt in range(self.retry.max_retries + 1):
+            self._before_attempt(deployment)
+            deployment.gate.wait()
+            try:
+                result = self._hedged(deployment, fn) if self._hedge_pool is not None else fn(deployment.client)
+            except RETRYABLE_ERRORS as e:
+                time.sleep(self._after_failure(deployment, attempt, e))
+                continue
+            except openai.APIStatusError:
+                deployment.breaker.record_success()
+                raise
+            deployment.breaker.record_success()
+            return result
+    
+    async def _acall_with_retries(self, deployment: Deployment, afn: Callable[[Any], Any]) -> Any:
+        for attempt in range(self.retry.max_retries + 1):
+            self._before_attempt(deployment)
+            await asyncio.sleep(deployment.gate.remaining())
+            try:
+                if self.hedge_after > 0:
+                    result = await self._ahedged(deployment, afn)
+                else:
+                    result = await afn(deployment.client)
+            except RETRYABLE_ERRORS as e:
+                await asyncio.sleep(self._after_failure(deployment, attempt, e))
+                continue
+            except openai.APIStatusError:
+                deployment.breaker.record_success()
+                raise
+            deployment.breaker.record_success()
+            return result
+    
+    def _first_chunk_with_retries(self, deployment: Deployment, fn: Callable[[Any], Iterator]):
+        for attempt in range(self.retry.max_retries + 1):
+            self._before_attempt(deployment)
+            deployment.gate.wait()
+            chunks = iter(fn(deployment.client))
+            try:
+                first = next(chunks, None)
+            except RETRYABLE_ERRORS as e:
+                time.sleep(self._after_failure(deployment, attempt, e))
+                continue
+            except openai.APIStatusError:
+                deployment.breaker.record_success()
+                raise
+            deployment.breaker.record_success()
+            return chunks, first
+    
+    async def _afirst_chunk_with_retries(self, deployment: Deployment, afn: Callable[[Any], AsyncIterator]):
+        for attempt in range(self.retry.max_retries + 1):
+            self._before_attempt(deployment)
+            await asyncio.sleep(deployment.gate.remaining())
+            chunks = afn(deployment.client).__aiter__()
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except RETRYABLE_ERRORS as e:
+                await asyncio.sleep(self._after_failure(deployment, attempt, e))
+                continue
+            except openai.APIStatusError:
+                deployment.breaker.record_success()
+                raise
+            deployment.breaker.record_success()
+            return chunks, first
+    
+    def _hedged(self, deployment: Deployment, fn: Callable[[Any], Any]) -> Any:
+        """Send a second request if the first is slower than hedge_after; first success wins"""
+        first = self._hedge_pool.submit(contextvars.copy_context().run, fn, deployment.client)
+        done, _ = wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result()
+        
+        self._count("hedges")
+        second = self._hedge_pool.submit(contextvars.copy_context().run, fn, deployment.client)
+        error = None
+        for future in as_completed([first, second]):
+            try:
+                result = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            if future is second:
+                self._count("hedge_wins")
+            return result
+        raise error
+    
+    async def _ahedged(self, deployment: Deployment, afn: Callable[[Any], Any]) -> Any:
+        """Async version of _hedged; the slower request is cancelled"""
+        first = asyncio.ensure_future(afn(deployment.client))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if done:
+                return first.result()
+            
+            self._count("hedges")
+            second = asyncio.ensure_future(afn(deployment.client))
+            tasks.add(second)
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+class ResilientChatModel(BaseChatModel):
+    """Chat model calling its deployments' chat models through a ResilientCaller"""
+    caller: Any
+    
+    @property
+    def _llm_type(self) -> str:
+        return "resilient-chat"
+    
+    def stats(self) -> Dict:
+        return self.caller.stats()
+    
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        message = self.caller.call(lambda model: model.invoke(messages, stop=stop, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+    
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        message = await self.caller.acall(lambda model: model.ainvoke(messages, stop=stop, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+    
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for chunk in self.caller.stream(lambda model: model.stream(messages, stop=stop, **kwargs)):
+            yield ChatGenerationChunk(message=chunk)
+    
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async for chunk in self.caller.astream(lambda model: model.astream(messages, stop=stop, **kwargs)):
+            yield ChatGenerationChunk(message=chunk)
+
+class ResilientEmbeddings(Embeddings):
+    """Embeddings calling their deployments through a ResilientCaller
+    
+    Fallback deployments must serve the same embedding model, or their vectors
+    will not match the index.
+    """
+    def __init__(self, caller: ResilientCaller):
+        self.caller = caller
+    
+    def stats(self) -> Dict:
+        return self.caller.stats()
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.caller.call(lambda embeddings: embeddings.embed_documents(texts))
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self.caller.call(lambda embeddings: embeddings.embed_query(text))
+    
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.caller.acall(lambda embeddings: embeddings.aembed_documents(texts))
+    
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.caller.acall(lambda embeddings: embeddings.aembed_query(text))
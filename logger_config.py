@@ -1,11 +1,48 @@
 """
 Centralized logging configuration for Medical RAG Agent
+
+By default records are handed to a queue on the calling thread and a
+background listener thread does all formatting and file I/O. Configure with:
+LOG_MODE (queue or sync), LOG_FORMAT (text or json), LOG_DIR, LOG_LEVEL
+(default for every component) and LOG_LEVEL_<COMPONENT>, e.g. LOG_LEVEL_AGENT=INFO.
 """
 
+import atexit
+import json
 import logging
 import os
+import queue
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from tracing import RequestIdFilter
+
+COMPONENTS = ('retriever', 'critic', 'agent', 'api', 'cache', 'session')
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers"""
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class ComponentFilter(logging.Filter):
+    """Passes only records of one component logger"""
+    def __init__(self, component):
+        super().__init__()
+        self.logger_name = f'medical_agent.{component}'
+    
+    def filter(self, record):
+        return record.name == self.logger_name
 
 class AgentLogger:
     """Singleton logger for the agent system"""
@@ -22,24 +59,27 @@ class AgentLogger:
         """Setup logging configuration"""
         
         # Create logs directory
-        log_dir = "logs"
+        log_dir = os.getenv("LOG_DIR", "logs")
         os.makedirs(log_dir, exist_ok=True)
+        json_format = os.getenv("LOG_FORMAT", "text") == "json"
         
         # Create formatters
-        detailed_formatter = logging.Formatter(
-            fmt='%(asctime)s | %(name)s | %(levelname)s | %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
+        if json_format:
+            detailed_formatter = component_formatter = JsonFormatter()
+        else:
+            detailed_formatter = logging.Formatter(
+                fmt='%(asctime)s | %(name)s | %(levelname)s | %(request_id)s | %(message)s',
+                datefmt='%Y-%m-%d %H:%M:%S'
+            )
+            component_formatter = logging.Formatter(
+                fmt='%(asctime)s | %(levelname)s | %(request_id)s | %(message)s',
+                datefmt='%Y-%m-%d %H:%M:%S'
+            )
         
         simple_formatter = logging.Formatter(
             fmt='%(levelname)s: %(message)s'
         )
         
-        # Main application logger
-        self.app_logger = logging.getLogger('medical_agent')
-        self.app_logger.setLevel(logging.DEBUG)
-        self.app_logger.handlers.clear()
-        
         # File handler - All logs (rotating)
         all_logs_handler = RotatingFileHandler(
             filename=os.path.join(log_dir, 'agent.log'),
@@ -63,35 +103,69 @@ class AgentLogger:
         console_handler.setLevel(logging.INFO)
         console_handler.setFormatter(simple_formatter)
         
-        # Add handlers
-        self.app_logger.addHandler(all_logs_handler)
-        self.app_logger.addHandler(error_handler)
-        self.app_logger.addHandler(console_handler)
+        handlers = [all_logs_handler, error_handler, console_handler]
+        handlers += [self._create_component_handler(log_dir, component, component_formatter)
+                     for component in COMPONENTS]
+        
+        # Main application logger; component loggers propagate to it, so
+        # every record passes through one set of handlers exactly once
+        self.app_logger = logging.getLogger('medical_agent')
+        self.app_logger.setLevel(self._level('LOG_LEVEL'))
+        self.app_logger.handlers.clear()
+        
+        request_id_filter = RequestIdFilter()
+        self.listener = None
+        if os.getenv("LOG_MODE", "queue") == "queue":
+            # The request id is read on the calling thread, before the record is queued
+            queue_handler = QueueHandler(queue.SimpleQueue())
+            queue_handler.addFilter(request_id_filter)
+            self.app_logger.addHandler(queue_handler)
+            self.listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+            self.listener.start()
+            atexit.register(lambda: self.listener.stop())  # Whichever listener this process runs
+            # Forked workers (gunicorn --preload) inherit the handler but not the listener thread
+            os.register_at_fork(after_in_child=lambda: self._restart_listener(queue_handler))
+        else:
+            for handler in handlers:
+                handler.addFilter(request_id_filter)
+                self.app_logger.addHandler(handler)
         
         # Component-specific loggers
         self.retriever_logger = self._create_component_logger('retriever')
         self.critic_logger = self._create_component_logger('critic')
         self.agent_logger = self._create_component_logger('agent')
         self.api_logger = self._create_component_logger('api')
+        self.cache_logger = self._create_component_logger('cache')
+        self.session_logger = self._create_component_logger('session')
     
-    def _create_component_logger(self, component_name):
-        """Create logger for specific component"""
-        logger = logging.getLogger(f'medical_agent.{component_name}')
-        logger.setLevel(logging.DEBUG)
-        
-        # Component-specific log file
+    def _restart_listener(self, queue_handler):
+        """Give a forked child its own queue and listener thread"""
+        queue_handler.queue = queue.SimpleQueue()
+        self.listener = QueueListener(queue_handler.queue, *self.listener.handlers, respect_handler_level=True)
+        self.listener.start()
+    
+    def _level(self, variable):
+        """Log level named by an environment variable, falling back to LOG_LEVEL"""
+        name = os.getenv(variable) or os.getenv("LOG_LEVEL", "DEBUG")
+        return logging.getLevelName(name.upper())
+    
+    def _create_component_handler(self, log_dir, component_name, formatter):
+        """Component-specific log file, taking only that component's records"""
         handler = RotatingFileHandler(
-            filename=os.path.join('logs', f'{component_name}.log'),
+            filename=os.path.join(log_dir, f'{component_name}.log'),
             maxBytes=5*1024*1024,
             backupCount=3
         )
         handler.setLevel(logging.DEBUG)
-        handler.setFormatter(logging.Formatter(
-            fmt='%(asctime)s | %(levelname)s | %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        ))
-        
-        logger.addHandler(handler)
+        handler.addFilter(ComponentFilter(component_name))
+        handler.setFormatter(formatter)
+        return handler
+    
+    def _create_component_logger(self, component_name):
+        """Create logger for specific component"""
+        logger = logging.getLogger(f'medical_agent.{component_name}')
+        logger.setLevel(self._level(f'LOG_LEVEL_{component_name.upper()}'))
+        logger.handlers.clear()
         return logger
     
     def get_logger(self, component=None):
@@ -104,6 +178,10 @@ class AgentLogger:
             return self.agent_logger
         elif component == 'api':
             return self.api_logger
+        elif component == 'cache':
+            return self.cache_logger
+        elif component == 'session':
+            return self.session_logger
         else:
             return self.app_logger
 
@@ -112,4 +190,4 @@ class AgentLogger:
 def get_logger(component=None):
     """Get logger instance"""
     agent_logger = AgentLogger()
-    return agent_logger.get_logger(component)
\ No newline at end of file
+    return agent_logger.get_logger(component)
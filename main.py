@@ -1,48 +1,198 @@
-from langchain_community.vectorstores import FAISS
 from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
 import os
 from dotenv import load_dotenv
 
 # Import our custom classes
-from agent_tools import RetrieverTool
+from agent_tools import RetrieverTool, SearchIndex
+from bm25_index import BM25Index, has_bm25_index
 from agent_critic import SelfReflectionCritic
+from chunk_store import MmapVectorStore
+from context_budget import ContextBudgeter
 from medical_agent import MedicalAgent
+from reflection_policy import ReflectionPolicy
+from embedding_cache import CachedEmbeddings
+from faq_store import FaqStore
+from index_factory import apply_search_params, load_index_config
+from index_reloader import IndexReloader
+from index_versions import current_version, version_path
+from retrieval_cache import RetrievalCache
+from retrieval_selection import ResultSelector
+from llm_client import (
+    CircuitBreaker, ConnectionPools, Deployment, ResilientCaller, ResilientChatModel, ResilientEmbeddings, RetryPolicy
+)
+from semantic_cache import SemanticCache
+from sharded_index import ShardedVectorStore, is_sharded
+from session_store import create_session_store
 
-def setup_agent():
-    """Initialize all components"""
+def _resilient_caller(make_client, primary, fallback):
+    """ResilientCaller over the primary deployment and, if configured, a fallback one"""
+    deployments = [primary] + ([fallback] if fallback else [])
+    return ResilientCaller(
+        [
+            Deployment(name, make_client(name, endpoint, api_key), CircuitBreaker(
+                failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+                reset_timeout=float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30")),
+            ))
+            for name, endpoint, api_key in deployments
+        ],
+        retry=RetryPolicy(
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+            base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "20")),
+        ),
+        hedge_after=float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "0")),
+    )
+
+def _fallback_deployment(variable):
+    """(deployment, endpoint, api key) of the fallback deployment named by ``variable``, if set"""
+    name = os.getenv(variable)
+    if not name:
+        return None
+    return (name, os.getenv("AZURE_OPENAI_FALLBACK_ENDPOINT") or os.getenv("AZURE_OPENAI_ENDPOINT"),
+            os.getenv("AZURE_OPENAI_FALLBACK_API_KEY") or os.getenv("AZURE_OPENAI_API_KEY"))
+
+def load_search_index(path, embedding):
+    """Vector store, retriever and (in hybrid mode) BM25 index over one built index directory"""
+    # Query-time knobs for IVF/HNSW indexes, overridable per deployment
+    nprobe = int(os.getenv("FAISS_NPROBE", "0")) or None
+    ef_search = int(os.getenv("FAISS_EF_SEARCH", "0")) or None
+    if is_sharded(path):
+        # Each shard searched by its own process pool, merged within SHARD_DEADLINE_MS
+        docsearch = ShardedVectorStore.load(
+            path, embedding,
+            deadline=float(os.getenv("SHARD_DEADLINE_MS", "1000")) / 1000,
+            workers_per_shard=int(os.getenv("SHARD_WORKERS", "1")),
+            nprobe=nprobe,
+            ef_search=ef_search,
+        )
+    else:
+        # Load FAISS index and chunk store, memory-mapped so workers share pages
+        docsearch = MmapVectorStore.load(path, embedding)
+        apply_search_params(docsearch.index, load_index_config(path), nprobe=nprobe, ef_search=ef_search)
+    retriever = docsearch.as_retriever(search_type="similarity", search_kwargs={"k": 3})
+    
+    # Hybrid dense + BM25 retrieval unless RETRIEVAL_MODE=vector
+    lexical = None
+    if os.getenv("RETRIEVAL_MODE", "hybrid") == "hybrid":
+        if has_bm25_index(path):
+            lexical = BM25Index.load(path)
+        else:
+            print(f"⚠️  No BM25 index in {path}, using vector-only retrieval")
+    return SearchIndex(retriever, lexical)
+
+def setup_agent(llm=None, embedding=None, index_path="faiss_index"):
+    """Initialize all components
+    
+    ``llm`` and ``embedding`` replace the Azure OpenAI clients, e.g. with the
+    fakes in benchmarks.fake_backends; ``index_path`` is the built index to serve,
+    either a versioned index root (see index_versions) or a plain index directory.
+    """
     load_dotenv()
     
-    # Load embeddings
-    embedding = AzureOpenAIEmbeddings(
-        model="text-embedding-ada-002",
-        azure_deployment=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"),
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_version=os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    )
+    # Keep-alive connection pools shared by the Azure clients, which leave retries to llm_client
+    pools = None
+    if llm is None or embedding is None:
+        pools = ConnectionPools(
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+            max_keepalive=int(os.getenv("LLM_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30")),
+            timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", "30")),
+        )
+    
+    if embedding is None:
+        embedding = ResilientEmbeddings(_resilient_caller(
+            lambda deployment, endpoint, api_key: AzureOpenAIEmbeddings(
+                model="text-embedding-ada-002",
+                azure_deployment=deployment,
+                azure_endpoint=endpoint,
+                api_version=os.getenv("AZURE_OPENAI_EMBEDDING_API_VERSION"),
+                api_key=api_key,
+                **pools.client_kwargs(),
+            ),
+            (os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"), os.getenv("AZURE_OPENAI_ENDPOINT"),
+             os.getenv("AZURE_OPENAI_API_KEY")),
+            _fallback_deployment("AZURE_OPENAI_EMBEDDING_FALLBACK_DEPLOYMENT"),
+        ))
     
-    # Load FAISS index
-    docsearch = FAISS.load_local(
-        "faiss_index",
+    # Load embeddings, cached by content so repeated queries are not re-embedded
+    embedding = CachedEmbeddings(
         embedding,
-        allow_dangerous_deserialization=True
+        model="text-embedding-ada-002",
+        path=os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db"),
+        memory_size=int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "5000")),
     )
-    retriever = docsearch.as_retriever(search_type="similarity", search_kwargs={"k": 3})
+    
+    # The published index version, or the directory itself if it is not versioned
+    index_version = current_version(index_path)
+    serving_path = version_path(index_path, index_version) if index_version else index_path
+    search_index = load_search_index(serving_path, embedding)
     
     # Setup LLM
-    llm = AzureChatOpenAI(
-        model="gpt-4o",
-        azure_deployment="gpt-4o",
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_version="2025-01-01-preview",
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        temperature=0.7,
+    if llm is None:
+        llm = ResilientChatModel(caller=_resilient_caller(
+            lambda deployment, endpoint, api_key: AzureChatOpenAI(
+                model="gpt-4o",
+                azure_deployment=deployment,
+                azure_endpoint=endpoint,
+                api_version="2025-01-01-preview",
+                api_key=api_key,
+                temperature=0.7,
+                stream_usage=True,  # Token usage, including cached prompt tokens, on streamed answers too
+                **pools.client_kwargs(),
+            ),
+            ("gpt-4o", os.getenv("AZURE_OPENAI_ENDPOINT"), os.getenv("AZURE_OPENAI_API_KEY")),
+            _fallback_deployment("AZURE_OPENAI_CHAT_FALLBACK_DEPLOYMENT"),
+        ))
+    
+    # Semantic answer cache for near-duplicate questions
+    cache = SemanticCache(
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+        max_size=int(os.getenv("SEMANTIC_CACHE_SIZE", "1000")),
+        ttl_seconds=int(os.getenv("SEMANTIC_CACHE_TTL", "3600")),
+        index_path=serving_path,
+    )
+    
+    # Token budgets for retrieved context and conversation history in each prompt
+    budgeter = ContextBudgeter(
+        max_context_tokens=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200")),
+        max_history_tokens=int(os.getenv("HISTORY_TOKEN_BUDGET", "300")),
+    )
+    
+    # When the critic runs: skipped for confident answers, deferred past the latency budget
+    policy = ReflectionPolicy(
+        mode=os.getenv("REFLECTION_MODE", "adaptive"),
+        min_similarity=float(os.getenv("REFLECTION_MIN_SIMILARITY", "0.85")),
+        min_grounding=float(os.getenv("REFLECTION_MIN_GROUNDING", "0.6")),
+        latency_budget=float(os.getenv("REFLECTION_LATENCY_BUDGET", "8")),
+        max_deferred=int(os.getenv("REFLECTION_MAX_DEFERRED", "32")),
     )
     
+    # Ranked results of normalized queries, dropped when the index changes; RETRIEVAL_CACHE_SIZE=0 disables it
+    retrieval_cache_size = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2048"))
+    retrieval_cache = RetrievalCache(max_size=retrieval_cache_size) if retrieval_cache_size > 0 else None
+    
+    # Final chunks picked from over-fetched candidates by threshold, MMR and source cap; RETRIEVAL_FETCH_K=0 disables it
+    fetch_k = int(os.getenv("RETRIEVAL_FETCH_K", "50"))
+    selector = ResultSelector(
+        fetch_k=fetch_k,
+        min_similarity=float(os.getenv("RETRIEVAL_MIN_SIMILARITY", "0")),
+        mmr_lambda=float(os.getenv("RETRIEVAL_MMR_LAMBDA", "0.7")),
+        max_per_source=int(os.getenv("RETRIEVAL_MAX_PER_SOURCE", "2")),
+    ) if fetch_k > 0 else None
+    
     # Create components
-    retriever_tool = RetrieverTool(retriever)
+    # MICRO_BATCH_MS > 0 coalesces concurrent async queries into batched embedding and search calls
+    retriever_tool = RetrieverTool(search_index.retriever, lexical=search_index.lexical, cache=retrieval_cache,
+                                   micro_batch_wait=float(os.getenv("MICRO_BATCH_MS", "0")) / 1000,
+                                   index_version=index_version, selector=selector)
+    # Hot-swaps index versions published by build_faiss_db.py; INDEX_POLL_SECONDS=0 disables it
+    # Precomputed answers built by build_faq_store.py, if any; rechecked against each new index version
+    faq = FaqStore.load(os.getenv("FAQ_STORE_PATH", "faq_store"), retriever_tool)
+    reloader = IndexReloader(index_path, lambda path: load_search_index(path, embedding), retriever_tool,
+                             caches=[cache, faq], poll_interval=float(os.getenv("INDEX_POLL_SECONDS", "30")))
     critic = SelfReflectionCritic(llm)
-    agent = MedicalAgent(retriever_tool, llm, critic)
+    agent = MedicalAgent(retriever_tool, llm, critic, cache=cache, sessions=create_session_store(),
+                         budgeter=budgeter, policy=policy, reloader=reloader, faq=faq)
     
     return agent
 
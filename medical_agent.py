@@ -1,171 +1,658 @@
-from typing import Dict, List
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from context_budget import ContextBudgeter
 from logger_config import get_logger
+from prompts import answer_messages, improve_messages
+from reflection_policy import CRITIQUE, DEFER, ReflectionPolicy
+from session_store import DEFAULT_SESSION, MemorySessionStore
+from tracing import record_llm_usage, span, trace_request
+
+BATCH_WORKERS = 8  # Questions of a batch generating and critiquing at once
 
 class MedicalAgent:
     """Simple agent with tool calling and self-reflection with logging"""
-    def __init__(self, retriever_tool, llm, critic, max_iterations=2):
+    def __init__(self, retriever_tool, llm, critic, max_iterations=2, cache=None, sessions=None, budgeter=None,
+                 policy=None, batch_workers=BATCH_WORKERS, reloader=None, faq=None):
         self.retriever = retriever_tool
         self.llm = llm
         self.critic = critic
+        self.cache = cache
+        self.sessions = sessions if sessions is not None else MemorySessionStore()
+        self.budgeter = budgeter if budgeter is not None else ContextBudgeter()
+        self.policy = policy if policy is not None else ReflectionPolicy()
         self.max_iterations = max_iterations
-        self.conversation_history = []
+        self.batch_workers = batch_workers
+        self.reloader = reloader  # IndexReloader swapping in new index versions, if any
+        self.faq = faq  # FaqStore of precomputed answers, if one was built
         self.logger = get_logger('agent')
+        self._background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="critic")
+        self._background_tasks = set()  # Deferred async critiques, referenced until they finish
     
-    def run(self, question: str) -> Dict:
+    def run(self, question: str, session_id: str = DEFAULT_SESSION) -> Dict:
         """Execute agent workflow"""
-        self.logger.info(f"=" * 60)
-        self.logger.info(f"Processing new query: '{question}'")
-        self.logger.info(f"=" * 60)
-        
-        try:
-            # Step 1: Retrieve context
-            self.logger.info("Step 1: Retrieving relevant context")
-            docs = self.retriever.run(question)
-            context = "\n\n".join([doc["content"] for doc in docs])
-            self.logger.debug(f"Context length: {len(context)} characters")
-            
-            # Step 2: Generate initial answer
-            self.logger.info("Step 2: Generating initial answer")
-            answer = self._generate_answer(question, context)
-            self.logger.debug(f"Initial answer: {answer[:100]}...")
-            
-            # Step 3: Self-reflection loop
-            self.logger.info("Step 3: Starting self-reflection loop")
-            for i in range(self.max_iterations):
-                self.logger.info(f"Reflection iteration {i+1}/{self.max_iterations}")
-                critique = self.critic.critique(question, context, answer)
+        with trace_request(self.logger):
+            self.logger.info("=" * 60)
+            self.logger.info("Processing new query: '%s'", question)
+            self.logger.info("=" * 60)
+            
+            start = time.perf_counter()
+            try:
+                # Step 1: Retrieve context
+                self.logger.info("Step 1: Retrieving relevant context")
+                history, history_saved = self._get_history_context(session_id)
+                precomputed = self._lookup_faq(question, history)
+                if precomputed:
+                    self._remember(session_id, question, precomputed["answer"])
+                    return precomputed
+                embedding = self.retriever.embed_query(question)
+                cached = self._lookup_cache(question, embedding, history)
+                if cached:
+                    self._remember(session_id, question, cached["answer"])
+                    return cached
                 
-                if critique["status"] == "approved":
-                    self.logger.info("Answer approved by critic")
-                    break
+                docs = self.retriever.run(question, embedding=embedding)
+                result = self._answer(question, session_id, embedding, docs, history, history_saved, start)
+                self.logger.info("Query processing completed successfully")
+                return result
+            
+            except Exception as e:
+                self.logger.error("Error processing query: %s", e, exc_info=True)
+                raise
+    
+    async def arun(self, question: str, session_id: str = DEFAULT_SESSION) -> Dict:
+        """Async version of run built on ainvoke, for the ASGI app"""
+        with trace_request(self.logger):
+            self.logger.info("=" * 60)
+            self.logger.info("Processing new async query: '%s'", question)
+            self.logger.info("=" * 60)
+            
+            start = time.perf_counter()
+            try:
+                self.logger.info("Step 1: Retrieving relevant context")
+                history, history_saved = await self._aget_history_context(session_id)
+                precomputed = self._lookup_faq(question, history)
+                if precomputed:
+                    await self._aremember(session_id, question, precomputed["answer"])
+                    return precomputed
+                embedding = await self.retriever.aembed_query(question)
+                cached = self._lookup_cache(question, embedding, history)
+                if cached:
+                    await self._aremember(session_id, question, cached["answer"])
+                    return cached
                 
-                self.logger.info(f"Improving answer: {critique['feedback']}")
-                answer = self._improve_answer(question, context, answer, critique["feedback"])
+                docs = await self.retriever.arun(question, embedding=embedding)
+                result = await self._aanswer(question, session_id, embedding, docs, history, history_saved, start)
+                self.logger.info("Async query processing completed successfully")
+                return result
             
-            # Store in conversation history
-            self.conversation_history.append({
-                "question": question,
-                "answer": answer
-            })
-            self.logger.info(f"Conversation history size: {len(self.conversation_history)}")
+            except Exception as e:
+                self.logger.error("Error processing query: %s", e, exc_info=True)
+                raise
+    
+    def run_batch(self, questions: List[str], session_id: Optional[str] = None) -> List[Dict]:
+        """Answer many questions, with their embedding and index search done as one batch each
+        
+        Generation and critique run concurrently on at most ``batch_workers``
+        threads. Results come back in the order of ``questions``; a question
+        that fails gets ``{"question", "error"}`` instead of failing the batch.
+        Without a ``session_id`` the questions are answered without history.
+        """
+        with trace_request(self.logger, "batch"):
+            self.logger.info("Processing batch of %d questions", len(questions))
+            start = time.perf_counter()
+            
+            history, history_saved = self._get_history_context(session_id)
+            results = [self._lookup_faq(question, history) for question in questions]
+            unanswered = [i for i, result in enumerate(results) if result is None]
+            embeddings = [None] * len(questions)
+            if unanswered:
+                for i, embedding in zip(unanswered, self.retriever.embed_queries([questions[i] for i in unanswered])):
+                    embeddings[i] = embedding
+            pending = []
+            for i in unanswered:
+                results[i] = self._lookup_cache(questions[i], embeddings[i], history)
+                if results[i] is None:
+                    pending.append(i)
+            for question, result in zip(questions, results):
+                if result is not None:
+                    self._remember(session_id, question, result["answer"])
+            
+            retrieved = self.retriever.run_batch([questions[i] for i in pending], [embeddings[i] for i in pending])
+            
+            def answer(i, docs):
+                try:
+                    return self._answer(questions[i], session_id, embeddings[i], docs, history, history_saved, start)
+                except Exception as e:
+                    self.logger.error("Error processing batch question '%s': %s", questions[i], e, exc_info=True)
+                    return {"question": questions[i], "error": str(e)}
+            
+            with ThreadPoolExecutor(max_workers=self.batch_workers, thread_name_prefix="batch") as pool:
+                futures = [pool.submit(contextvars.copy_context().run, answer, i, docs)
+                           for i, docs in zip(pending, retrieved)]
+                for i, future in zip(pending, futures):
+                    results[i] = future.result()
+            
+            self.logger.info("Batch completed: %d answered, %d from FAQ store, %d from cache",
+                             len(pending), len(questions) - len(unanswered), len(unanswered) - len(pending))
+            return results
+    
+    async def arun_batch(self, questions: List[str], session_id: Optional[str] = None) -> List[Dict]:
+        """Async version of run_batch, with at most ``batch_workers`` questions generating at once"""
+        with trace_request(self.logger, "batch"):
+            self.logger.info("Processing async batch of %d questions", len(questions))
+            start = time.perf_counter()
+            
+            history, history_saved = await self._aget_history_context(session_id)
+            results = [self._lookup_faq(question, history) for question in questions]
+            unanswered = [i for i, result in enumerate(results) if result is None]
+            embeddings = [None] * len(questions)
+            if unanswered:
+                batch = await self.retriever.aembed_queries([questions[i] for i in unanswered])
+                for i, embedding in zip(unanswered, batch):
+                    embeddings[i] = embedding
+            pending = []
+            for i in unanswered:
+                results[i] = self._lookup_cache(questions[i], embeddings[i], history)
+                if results[i] is None:
+                    pending.append(i)
+            for question, result in zip(questions, results):
+                if result is not None:
+                    await self._aremember(session_id, question, result["answer"])
+            
+            retrieved = await self.retriever.arun_batch([questions[i] for i in pending],
+                                                        [embeddings[i] for i in pending])
+            limiter = asyncio.Semaphore(self.batch_workers)
+            
+            async def answer(i, docs):
+                async with limiter:
+                    try:
+                        return await self._aanswer(questions[i], session_id, embeddings[i], docs, history,
+                                                   history_saved, start)
+                    except Exception as e:
+                        self.logger.error("Error processing batch question '%s': %s", questions[i], e, exc_info=True)
+                        return {"question": questions[i], "error": str(e)}
+            
+            answered = await asyncio.gather(*(answer(i, docs) for i, docs in zip(pending, retrieved)))
+            for i, result in zip(pending, answered):
+                results[i] = result
+            
+            self.logger.info("Batch completed: %d answered, %d from FAQ store, %d from cache",
+                             len(pending), len(questions) - len(unanswered), len(unanswered) - len(pending))
+            return results
+    
+    def stream(self, question: str, session_id: str = DEFAULT_SESSION) -> Iterator[Dict]:
+        """Execute agent workflow, yielding events as each step produces output
+        
+        Events are dicts with an ``event`` name and a ``data`` payload:
+        ``retrieval`` (source metadata), ``token`` (draft answer text as the
+        LLM streams it), ``critique`` (critic verdict), ``revised`` (an
+        improved answer replacing the draft) and finally ``done``.
+        """
+        with trace_request(self.logger):
+            self.logger.info("=" * 60)
+            self.logger.info("Streaming new query: '%s'", question)
+            self.logger.info("=" * 60)
             
-            # Keep only last 5 exchanges
-            if len(self.conversation_history) > 5:
-                self.conversation_history.pop(0)
-                self.logger.debug("Trimmed conversation history to last 5 exchanges")
+            start = time.perf_counter()
+            try:
+                self.logger.info("Step 1: Retrieving relevant context")
+                history, history_saved = self._get_history_context(session_id)
+                precomputed = self._lookup_faq(question, history)
+                if precomputed:
+                    self._remember(session_id, question, precomputed["answer"])
+                    yield {"event": "done", "data": precomputed}
+                    return
+                embedding = self.retriever.embed_query(question)
+                cached = self._lookup_cache(question, embedding, history)
+                if cached:
+                    self._remember(session_id, question, cached["answer"])
+                    yield {"event": "done", "data": cached}
+                    return
+                
+                docs = self.retriever.run(question, embedding=embedding)
+                context, tokens_saved = self._assemble_context(docs, history_saved)
+                yield {
+                    "event": "retrieval",
+                    "data": {
+                        "sources": len(docs),
+                        "documents": [doc["metadata"] for doc in docs]
+                    }
+                }
+                
+                self.logger.info("Step 2: Streaming initial answer")
+                parts = []
+                usage = None  # Sent with the last chunk, when the model streams usage
+                prompt = self._build_answer_prompt(question, context, history)
+                with span("generate"):
+                    for chunk in self.llm.stream(prompt):
+                        usage = getattr(chunk, "usage_metadata", None) or usage
+                        if chunk.content:
+                            parts.append(chunk.content)
+                            yield {"event": "token", "data": chunk.content}
+                draft = answer = "".join(parts).strip()
+                record_llm_usage("generate", prompt, answer, usage)
+                self.logger.debug("Initial answer: %.100s...", answer)
+                
+                decision = self._decide_reflection(docs, context, answer, start)
+                approved = decision["confident"]
+                if decision["action"] == CRITIQUE:
+                    for critique, answer in self._reflect(question, context, answer, history):
+                        approved = critique["status"] == "approved"
+                        yield {"event": "critique", "data": critique}
+                elif decision["action"] == DEFER:
+                    self._defer_critique(embedding, question, context, answer, len(docs), history)
+                
+                if answer != draft:
+                    yield {"event": "revised", "data": answer}
+                
+                self._store_in_cache(embedding, question, answer, len(docs), approved, history)
+                self._remember(session_id, question, answer)
+                self.logger.info("Streaming query completed successfully")
+                
+                yield {
+                    "event": "done",
+                    "data": {"question": question, "answer": answer, "sources": len(docs), "tokens_saved": tokens_saved}
+                }
             
-            self.logger.info("Query processing completed successfully")
+            except Exception as e:
+                self.logger.error("Error streaming query: %s", e, exc_info=True)
+                raise
+    
+    async def astream(self, question: str, session_id: str = DEFAULT_SESSION) -> AsyncIterator[Dict]:
+        """Async version of stream built on astream, for the ASGI app"""
+        with trace_request(self.logger):
+            self.logger.info("=" * 60)
+            self.logger.info("Streaming new async query: '%s'", question)
+            self.logger.info("=" * 60)
             
+            start = time.perf_counter()
+            try:
+                self.logger.info("Step 1: Retrieving relevant context")
+                history, history_saved = await self._aget_history_context(session_id)
+                precomputed = self._lookup_faq(question, history)
+                if precomputed:
+                    await self._aremember(session_id, question, precomputed["answer"])
+                    yield {"event": "done", "data": precomputed}
+                    return
+                embedding = await self.retriever.aembed_query(question)
+                cached = self._lookup_cache(question, embedding, history)
+                if cached:
+                    await self._aremember(session_id, question, cached["answer"])
+                    yield {"event": "done", "data": cached}
+                    return
+                
+                docs = await self.retriever.arun(question, embedding=embedding)
+                context, tokens_saved = self._assemble_context(docs, history_saved)
+                yield {
+                    "event": "retrieval",
+                    "data": {
+                        "sources": len(docs),
+                        "documents": [doc["metadata"] for doc in docs]
+                    }
+                }
+                
+                self.logger.info("Step 2: Streaming initial answer")
+                parts = []
+                usage = None
+                prompt = self._build_answer_prompt(question, context, history)
+                with span("generate"):
+                    async for chunk in self.llm.astream(prompt):
+                        usage = getattr(chunk, "usage_metadata", None) or usage
+                        if chunk.content:
+                            parts.append(chunk.content)
+                            yield {"event": "token", "data": chunk.content}
+                draft = answer = "".join(parts).strip()
+                record_llm_usage("generate", prompt, answer, usage)
+                self.logger.debug("Initial answer: %.100s...", answer)
+                
+                decision = self._decide_reflection(docs, context, answer, start)
+                approved = decision["confident"]
+                if decision["action"] == CRITIQUE:
+                    async for critique, answer in self._areflect(question, context, answer, history):
+                        approved = critique["status"] == "approved"
+                        yield {"event": "critique", "data": critique}
+                elif decision["action"] == DEFER:
+                    self._adefer_critique(embedding, question, context, answer, len(docs), history)
+                
+                if answer != draft:
+                    yield {"event": "revised", "data": answer}
+                
+                self._store_in_cache(embedding, question, answer, len(docs), approved, history)
+                await self._aremember(session_id, question, answer)
+                self.logger.info("Async streaming query completed successfully")
+                
+                yield {
+                    "event": "done",
+                    "data": {"question": question, "answer": answer, "sources": len(docs), "tokens_saved": tokens_saved}
+                }
+            
+            except Exception as e:
+                self.logger.error("Error streaming query: %s", e, exc_info=True)
+                raise
+    
+    def precompute_answer(self, question: str, embedding: Optional[List[float]] = None) -> Dict:
+        """Answer a question for the FAQ store (build_faq_store.py): no session, and the critic always runs
+        
+        Besides the answer, returns whether the critic approved it as it stands,
+        the retrieved documents and the index version they came from.
+        """
+        with trace_request(self.logger, "precompute"):
+            index_version = self.retriever.index.version
+            docs = self.retriever.run(question, embedding=embedding)
+            context, _ = self._assemble_context(docs, 0)
+            answer = self._generate_answer(question, context, "")
+            approved = False
+            for critique, answer in self._reflect(question, context, answer, ""):
+                approved = critique["status"] == "approved"
             return {
                 "question": question,
                 "answer": answer,
-                "context": context,
-                "sources": len(docs)
+                "approved": approved,
+                "documents": docs,
+                "index_version": index_version
             }
+    
+    def _reflect(self, question: str, context: str, answer: str,
+                 history: str) -> Iterator[Tuple[Dict, str]]:
+        """Self-reflection loop, yielding each critique with the answer after it"""
+        for i in range(self.max_iterations):
+            self.logger.info("Reflection iteration %s/%s", i+1, self.max_iterations)
+            critique = self.critic.critique(question, context, answer)
+            
+            if critique["status"] == "approved":
+                self.logger.info("Answer approved by critic")
+                yield critique, answer
+                return
+            if critique["status"] == "unavailable":
+                self.logger.warning("Critic unavailable, keeping the answer unreviewed")
+                yield critique, answer
+                return
+            
+            self.logger.info("Improving answer: %s", critique['feedback'])
+            answer = self._improve_answer(question, context, answer, critique["feedback"], history)
+            yield critique, answer
+    
+    async def _areflect(self, question: str, context: str, answer: str,
+                        history: str) -> AsyncIterator[Tuple[Dict, str]]:
+        """Async version of _reflect"""
+        for i in range(self.max_iterations):
+            self.logger.info("Reflection iteration %s/%s", i+1, self.max_iterations)
+            critique = await self.critic.acritique(question, context, answer)
+            
+            if critique["status"] == "approved":
+                self.logger.info("Answer approved by critic")
+                yield critique, answer
+                return
+            if critique["status"] == "unavailable":
+                self.logger.warning("Critic unavailable, keeping the answer unreviewed")
+                yield critique, answer
+                return
+            
+            self.logger.info("Improving answer: %s", critique['feedback'])
+            answer = await self._aimprove_answer(question, context, answer, critique["feedback"], history)
+            yield critique, answer
+    
+    def _answer(self, question: str, session_id: Optional[str], embedding: List[float], docs: List[Dict],
+                history: str, history_saved: int, start: float) -> Dict:
+        """Steps 2 and 3 for a question whose documents were retrieved"""
+        context, tokens_saved = self._assemble_context(docs, history_saved)
+        
+        # Step 2: Generate initial answer
+        self.logger.info("Step 2: Generating initial answer")
+        answer = self._generate_answer(question, context, history)
+        self.logger.debug("Initial answer: %.100s...", answer)
         
+        # Step 3: Self-reflection loop, if the policy asks for it
+        decision = self._decide_reflection(docs, context, answer, start)
+        approved = decision["confident"]
+        if decision["action"] == CRITIQUE:
+            for critique, answer in self._reflect(question, context, answer, history):
+                approved = critique["status"] == "approved"
+        elif decision["action"] == DEFER:
+            self._defer_critique(embedding, question, context, answer, len(docs), history)
+        
+        self._store_in_cache(embedding, question, answer, len(docs), approved, history)
+        self._remember(session_id, question, answer)
+        
+        return {
+            "question": question,
+            "answer": answer,
+            "context": context,
+            "sources": len(docs),
+            "tokens_saved": tokens_saved
+        }
+    
+    async def _aanswer(self, question: str, session_id: Optional[str], embedding: List[float], docs: List[Dict],
+                       history: str, history_saved: int, start: float) -> Dict:
+        """Async version of _answer"""
+        context, tokens_saved = self._assemble_context(docs, history_saved)
+        
+        self.logger.info("Step 2: Generating initial answer")
+        answer = await self._agenerate_answer(question, context, history)
+        self.logger.debug("Initial answer: %.100s...", answer)
+        
+        decision = self._decide_reflection(docs, context, answer, start)
+        approved = decision["confident"]
+        if decision["action"] == CRITIQUE:
+            async for critique, answer in self._areflect(question, context, answer, history):
+                approved = critique["status"] == "approved"
+        elif decision["action"] == DEFER:
+            self._adefer_critique(embedding, question, context, answer, len(docs), history)
+        
+        self._store_in_cache(embedding, question, answer, len(docs), approved, history)
+        await self._aremember(session_id, question, answer)
+        
+        return {
+            "question": question,
+            "answer": answer,
+            "context": context,
+            "sources": len(docs),
+            "tokens_saved": tokens_saved
+        }
+    
+    def _decide_reflection(self, docs: List[Dict], context: str, answer: str, start: float) -> Dict:
+        """Ask the reflection policy whether to critique this answer"""
+        decision = self.policy.decide(docs, context, answer, time.perf_counter() - start)
+        self.logger.info("Step 3: Reflection %s (%s)", decision['action'], decision['reason'])
+        return decision
+    
+    def _defer_critique(self, embedding: List[float], question: str, context: str, answer: str,
+                        sources: int, history: str):
+        """Queue a background critique, unless the policy's limit of pending ones is reached"""
+        if not self.policy.start_deferred():
+            self.logger.warning("Dropped deferred critique for '%s': too many pending", question)
+            return
+        self._background.submit(contextvars.copy_context().run, self._deferred_critique, embedding,
+                                question, context, answer, sources, history)
+    
+    def _adefer_critique(self, embedding: List[float], question: str, context: str, answer: str,
+                         sources: int, history: str):
+        """Async version of _defer_critique, running the critique as a task"""
+        if not self.policy.start_deferred():
+            self.logger.warning("Dropped deferred critique for '%s': too many pending", question)
+            return
+        task = asyncio.create_task(self._adeferred_critique(embedding, question, context, answer, sources, history))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    def _deferred_critique(self, embedding: List[float], question: str, context: str, answer: str,
+                           sources: int, history: str):
+        """Critique an answer already returned, logging the verdict for offline review"""
+        try:
+            critique = self.critic.critique(question, context, answer)
+            self._log_deferred_verdict(question, answer, critique)
+            self._store_in_cache(embedding, question, answer, sources, critique["status"] == "approved", history)
         except Exception as e:
-            self.logger.error(f"Error processing query: {str(e)}", exc_info=True)
-            raise
+            self.logger.error("Deferred critique failed: %s", e, exc_info=True)
+        finally:
+            self.policy.finish_deferred()
     
-    def _get_history_context(self) -> str:
-        """Format conversation history"""
-        if not self.conversation_history:
-            return ""
+    async def _adeferred_critique(self, embedding: List[float], question: str, context: str, answer: str,
+                                  sources: int, history: str):
+        """Async version of _deferred_critique"""
+        try:
+            critique = await self.critic.acritique(question, context, answer)
+            self._log_deferred_verdict(question, answer, critique)
+            self._store_in_cache(embedding, question, answer, sources, critique["status"] == "approved", history)
+        except Exception as e:
+            self.logger.error("Deferred critique failed: %s", e, exc_info=True)
+        finally:
+            self.policy.finish_deferred()
+    
+    def _log_deferred_verdict(self, question: str, answer: str, critique: Dict):
+        """Record a background verdict; needs_improvement ones are warnings to review"""
+        level = logging.INFO if critique["status"] == "approved" else logging.WARNING
+        self.logger.log(level, "Deferred critique %s for '%s': %s | answer: %s",
+                        critique['status'], question, critique['feedback'], answer)
+    
+    def _lookup_faq(self, question: str, history: str) -> Optional[Dict]:
+        """Answer from the FAQ store, unless earlier turns could change what the question means"""
+        if self.faq is None or history:
+            return None
+        
+        entry = self.faq.lookup(question)
+        if entry is None:
+            return None
+        
+        self.logger.info("Answered from FAQ store as: '%s'", entry['question'])
+        return {
+            "question": question,
+            "answer": entry["answer"],
+            "context": "",
+            "sources": entry["sources"],
+            "cached": True
+        }
+    
+    def _lookup_cache(self, question: str, embedding: List[float], history: str) -> Optional[Dict]:
+        """Answer from the semantic cache if a near-duplicate was already approved, unless there are earlier turns"""
+        if self.cache is None or history:
+            return None
+        
+        entry = self.cache.lookup(embedding)
+        if entry is None:
+            return None
         
-        history_text = "\n\nPrevious Conversation:\n"
-        for exchange in self.conversation_history[-3:]:
-            history_text += f"Q: {exchange['question']}\nA: {exchange['answer']}\n\n"
-        return history_text
+        self.logger.info("Answered from semantic cache (similarity %.3f)", entry['similarity'])
+        return {
+            "question": question,
+            "answer": entry["answer"],
+            "context": "",
+            "sources": entry["sources"],
+            "cached": True
+        }
+    
+    def _store_in_cache(self, embedding: List[float], question: str, answer: str, sources: int,
+                        approved: bool, history: str):
+        """Cache critic-approved answers that did not depend on earlier turns"""
+        if self.cache is None or not approved:
+            return
+        if history:
+            self.logger.debug("Skipping semantic cache: answer may depend on conversation history")
+            return
+        self.cache.add(embedding, question, answer, sources)
+    
+    def _remember(self, session_id: Optional[str], question: str, answer: str):
+        """Store an exchange in the session's conversation history"""
+        if session_id is None:
+            return
+        self.sessions.append(session_id, question, answer)
+        self.logger.debug("Stored exchange for session %s", session_id)
+    
+    async def _aremember(self, session_id: Optional[str], question: str, answer: str):
+        """Async version of _remember; the store may block (SQLite busy timeout), so it runs in a thread"""
+        if session_id is None:
+            return
+        await asyncio.to_thread(self._remember, session_id, question, answer)
+    
+    def _get_history_context(self, session_id: Optional[str]) -> Tuple[str, int]:
+        """Format conversation history within its token budget, with the tokens trimmed"""
+        if session_id is None:
+            return "", 0
+        return self.budgeter.fit_history(self.sessions.get_history(session_id))
     
-    def _generate_answer(self, question: str, context: str) -> str:
+    async def _aget_history_context(self, session_id: Optional[str]) -> Tuple[str, int]:
+        """Async version of _get_history_context, reading the store in a thread"""
+        if session_id is None:
+            return "", 0
+        return self.budgeter.fit_history(await asyncio.to_thread(self.sessions.get_history, session_id))
+    
+    def _assemble_context(self, docs: List[Dict], history_saved: int) -> Tuple[str, int]:
+        """Budgeted context for the retrieved docs, with the tokens saved on this request"""
+        with span("context"):
+            assembled = self.budgeter.assemble(docs)
+        tokens_saved = assembled["tokens_saved"] + history_saved
+        self.logger.info("Context: %d tokens from %d chunks, %d tokens saved",
+                         assembled['tokens'], len(docs), tokens_saved)
+        return assembled["context"], tokens_saved
+    
+    def _generate_answer(self, question: str, context: str, history: str) -> str:
         """Generate answer from context"""
-        history = self._get_history_context()
-        
-        prompt = f"""
-       You are a friendly, concise medical assistant. Your job is to give short, clear explanations based ONLY on the retrieved context.
-        **Rules:**  
-        - Keep answers **1–3 sentences maximum**.  
-        - Use **simple, friendly, human language** (no long paragraphs).  
-        - Do NOT provide medical advice. If asked, say:  
-        **"I can share general information, but I can't give medical advice."**
-        - If the answer is not in the context, reply:  
-        **"I don't know based on the provided context."**
-        - No chit-chat beyond what’s needed to keep the tone warm and approachable.  
-        - Never invent facts or add unsupported details.
-
-        **Chit-Chat Rule**
-        - If the user says "hello", "hi", "hey", or any greeting or small talk that is NOT a medical question:
-        Reply with: **"I cannot engage in chit-chat. Please ask a medically relevant question."**
-        Do NOT use retrieved context for greetings.
-
-        **Tone Guidance:**  
-        - Friendly but concise  
-        - Easy for a non-medical user to understand  
-        - Engaging: you may add one short clarifying question like  
-        *"Would you like a simple explanation or more detail?"*  
-        **only if the user’s intent is unclear** (and within 1 short sentence).
-
-        {history}
-        Context:
-        {context}
+        prompt = self._build_answer_prompt(question, context, history)
         
-        Question: {question}
-        """
+        try:
+            with span("generate"):
+                response = self.llm.invoke(prompt)
+            record_llm_usage("generate", prompt, response.content, getattr(response, "usage_metadata", None))
+            return response.content.strip()
+        except Exception as e:
+            self.logger.error("Answer generation failed: %s", e, exc_info=True)
+            raise
+    
+    async def _agenerate_answer(self, question: str, context: str, history: str) -> str:
+        """Async version of _generate_answer"""
+        prompt = self._build_answer_prompt(question, context, history)
         
         try:
-            response = self.llm.invoke(prompt)
+            with span("generate"):
+                response = await self.llm.ainvoke(prompt)
+            record_llm_usage("generate", prompt, response.content, getattr(response, "usage_metadata", None))
             return response.content.strip()
         except Exception as e:
-            self.logger.error(f"Answer generation failed: {str(e)}", exc_info=True)
+            self.logger.error("Answer generation failed: %s", e, exc_info=True)
             raise
     
-    def _improve_answer(self, question: str, context: str, previous_answer: str, feedback: str) -> str:
+    def _build_answer_prompt(self, question: str, context: str, history: str) -> List:
+        """Build the initial answer prompt: the shared system message, then this request's parts"""
+        return answer_messages(question, context, history)
+    
+    def _improve_answer(self, question: str, context: str, previous_answer: str, feedback: str,
+                        history: str) -> str:
         """Improve answer based on feedback"""
-        history = self._get_history_context()
-        
-        prompt = f"""
-        {history}
-        Context:
-        {context}
+        prompt = self._build_improve_prompt(question, context, previous_answer, feedback, history)
         
-        Question: {question}
-        
-        Previous Answer: {previous_answer}
-        
-        Feedback: {feedback}
-        
-        Provide an improved answer addressing the feedback. 
-        **Rules:**  
-        - Keep answers **1–3 sentences maximum**.  
-        - Use **simple, friendly, human language** (no long paragraphs).  
-        - Do NOT provide medical advice. If asked, say:  
-        **"I can share general information, but I can't give medical advice."**
-        - If the answer is not in the context, reply:  
-        **"I don't know based on the provided context."**
-        - No chit-chat beyond what’s needed to keep the tone warm and approachable.  
-        - Never invent facts or add unsupported details.
-
-        **Chit-Chat Rule**
-        - If the user says "hello", "hi", "hey", or any greeting or small talk that is NOT a medical question:
-        Reply with: **"I cannot engage in chit-chat. Please ask a medically relevant question."**
-        Do NOT use retrieved context for greetings.
-
-        **Tone Guidance:**  
-        - Friendly but concise  
-        - Easy for a non-medical user to understand  
-        - Engaging: you may add one short clarifying question like  
-        *"Would you like a simple explanation or more detail?"*  
-        **only if the user’s intent is unclear** (and within 1 short sentence).
-        """
+        try:
+            with span("improve"):
+                response = self.llm.invoke(prompt)
+            record_llm_usage("improve", prompt, response.content, getattr(response, "usage_metadata", None))
+            return response.content.strip()
+        except Exception as e:
+            self.logger.error("Answer improvement failed: %s", e, exc_info=True)
+            return previous_answer  # Fallback to previous answer
+    
+    async def _aimprove_answer(self, question: str, context: str, previous_answer: str, feedback: str,
+                               history: str) -> str:
+        """Async version of _improve_answer"""
+        prompt = self._build_improve_prompt(question, context, previous_answer, feedback, history)
         
         try:
-            response = self.llm.invoke(prompt)
+            with span("improve"):
+                response = await self.llm.ainvoke(prompt)
+            record_llm_usage("improve", prompt, response.content, getattr(response, "usage_metadata", None))
             return response.content.strip()
         except Exception as e:
-            self.logger.error(f"Answer improvement failed: {str(e)}", exc_info=True)
+            self.logger.error("Answer improvement failed: %s", e, exc_info=True)
             return previous_answer  # Fallback to previous answer
     
-    def clear_history(self):
-        """Clear conversation history"""
-        self.logger.info("Clearing conversation history")
-        self.conversation_history = []
+    def _build_improve_prompt(self, question: str, context: str, previous_answer: str, feedback: str,
+                              history: str) -> List:
+        """Build the answer improvement prompt: the shared system message, then this request's parts"""
+        return improve_messages(question, context, previous_answer, feedback, history)
+    
+    def clear_history(self, session_id: str = DEFAULT_SESSION):
+        """Clear one session's conversation history"""
+        self.logger.info("Clearing conversation history for session %s", session_id)
+        self.sessions.clear(session_id)
@@ -0,0 +1,75 @@
+"""
+Micro-batching: coalesces concurrent single calls on the event loop into one batched call
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, List
+
+MICRO_BATCH_WAIT = 0.005  # Seconds the first call of a batch waits for company
+MICRO_BATCH_SIZE = 32  # A batch is dispatched as soon as it holds this many calls
+
+class MicroBatcher:
+    """Collects items submitted within ``max_wait`` seconds and runs ``batch_fn`` once on all of them
+    
+    ``batch_fn`` takes a list of items and returns a list of results in the
+    same order. Each caller gets its own result back; if the batch fails,
+    every caller in it sees the exception. Must be used from a single event loop.
+    """
+    def __init__(self, batch_fn: Callable[[List[Any]], Awaitable[List[Any]]], max_wait=MICRO_BATCH_WAIT,
+                 max_size=MICRO_BATCH_SIZE):
+        self.batch_fn = batch_fn
+        self.max_wait = max_wait
+        self.max_size = max_size
+        self._pending = []  # (item, future) waiting for the next flush
+        self._timer = None
+        self._tasks = set()  # Running batches, referenced until they finish
+        
+        self.batches = 0
+        self.items = 0
+    
+    async def submit(self, item: Any) -> Any:
+        """Result of ``batch_fn`` for ``item``, computed together with concurrent submissions"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+    
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        
+        self.batches += 1
+        self.items += len(batch)
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _run(self, batch):
+        try:
+            results = await self.batch_fn([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+    
+    def stats(self):
+        """Batches dispatched and their average size"""
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0
+        }
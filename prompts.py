@@ -0,0 +1,92 @@
+"""
+Chat prompts laid out for provider-side prefix caching
+
+Azure OpenAI (like OpenAI) reuses the computed prefix of a prompt when a new
+request starts with the same tokens as a recent one, which cuts its latency
+and bills those tokens at a discount. Every call the agent makes (answer,
+improve, critique) therefore starts with the same system message, byte for
+byte, holding all the static instructions. Everything that varies per request
+(history, context, question, draft answer, feedback) goes in the user message
+after it, ending with the task. The system message must not be formatted with
+request data, or no two requests would share a prefix.
+
+Providers only cache prefixes past a minimum length (1024 tokens on Azure
+OpenAI), in blocks of 128 tokens, so the hit rate reported by /health also
+depends on how much history and context follows the system message.
+"""
+
+from typing import List
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+SYSTEM_PROMPT = """You are a friendly, concise medical assistant. Your job is to give short, clear explanations based ONLY on the retrieved context.
+Each request gives the retrieved context and the user's question, and may give earlier conversation turns. It ends with a task: answer the question, improve a previous answer addressing feedback, or evaluate an answer.
+
+**Rules:**
+- Keep answers **1–3 sentences maximum**.
+- Use **simple, friendly, human language** (no long paragraphs).
+- Do NOT provide medical advice. If asked, say:
+**"I can share general information, but I can't give medical advice."**
+- If the answer is not in the context, reply:
+**"I don't know based on the provided context."**
+- No chit-chat beyond what’s needed to keep the tone warm and approachable.
+- Never invent facts or add unsupported details.
+
+**Chit-Chat Rule**
+- If the user says "hello", "hi", "hey", or any greeting or small talk that is NOT a medical question:
+Reply with: **"I cannot engage in chit-chat. Please ask a medically relevant question."**
+Do NOT use retrieved context for greetings.
+
+**Tone Guidance:**
+- Friendly but concise
+- Easy for a non-medical user to understand
+- Engaging: you may add one short clarifying question like
+*"Would you like a simple explanation or more detail?"*
+**only if the user’s intent is unclear** (and within 1 short sentence).
+
+**Evaluating an answer:**
+1. Is it accurate based on the context?
+2. Is it complete?
+3. Does it need improvement?
+
+Respond with:
+- "GOOD" if answer is satisfactory
+- "IMPROVE: <reason>" if it needs work
+"""
+
+CRITIQUE_CONTEXT_CHARS = 500  # The critic sees the start of the context only
+
+def _messages(*parts: str) -> List[BaseMessage]:
+    """The shared system message, then the non-empty request parts"""
+    return [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content="\n\n".join(part for part in parts if part))]
+
+def answer_messages(question: str, context: str, history: str) -> List[BaseMessage]:
+    """Messages for the initial answer"""
+    return _messages(
+        history,
+        f"Context:\n{context}",
+        f"Question: {question}",
+        "Task: Answer the question following the rules."
+    )
+
+def improve_messages(question: str, context: str, previous_answer: str, feedback: str,
+                     history: str) -> List[BaseMessage]:
+    """Messages for improving an answer the critic flagged"""
+    return _messages(
+        history,
+        f"Context:\n{context}",
+        f"Question: {question}",
+        f"Previous Answer: {previous_answer}",
+        f"Feedback: {feedback}",
+        "Task: Provide an improved answer addressing the feedback, following the rules."
+    )
+
+def critique_messages(question: str, context: str, answer: str) -> List[BaseMessage]:
+    """Messages for the critic's verdict on an answer"""
+    return _messages(
+        f"Context Retrieved: {context[:CRITIQUE_CONTEXT_CHARS]}...",
+        f"Question: {question}",
+        f"Generated Answer: {answer}",
+        "Task: Evaluate this answer and respond with GOOD or IMPROVE: <reason>."
+    )
+
@@ -0,0 +1,133 @@
+"""
+Per-request policy for the self-reflection critic: decides whether an answer
+is critiqued inline, critiqued in the background after responding, or not at all
+"""
+
+import re
+import threading
+from typing import Dict, List, Optional, Sequence
+
+CANNED_REPLIES = (  # Fixed replies the answer prompt asks for; there is nothing to critique
+    "I don't know based on the provided context",
+    "I cannot engage in chit-chat. Please ask a medically relevant question",
+    "I can share general information, but I can't give medical advice",
+)
+CANNED_TAIL_CHARS = 20  # Text allowed after a canned reply (punctuation, "Sorry!"); more is a real answer
+MIN_SIMILARITY = 0.85  # Top retrieval similarity needed to trust an answer without the critic
+MIN_GROUNDING = 0.6  # Share of the answer's word bigrams found in the context to trust it
+LATENCY_BUDGET_SECONDS = 8.0  # Past this, an inline critique would cost more than it is worth
+MAX_DEFERRED = 32  # Background critiques queued or running at once; more are dropped
+
+CRITIQUE = "critique"  # Run the critic loop before responding
+DEFER = "defer"  # Respond now, critique in the background and log the verdict
+SKIP = "skip"  # Accept the answer as is
+
+WORD_PATTERN = re.compile(r"\w+")
+
+def _bigrams(text: str) -> set:
+    """Word bigrams of ``text`` (the words themselves for one-word texts)"""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < 2:
+        return set(words)
+    return set(zip(words, words[1:]))
+
+def grounding(answer: str, context: str) -> float:
+    """Share of the answer's word bigrams that also occur in the context"""
+    answer_bigrams = _bigrams(answer)
+    if not answer_bigrams:
+        return 0.0
+    return len(answer_bigrams & _bigrams(context)) / len(answer_bigrams)
+
+def _normalize_reply(text: str) -> str:
+    return " ".join(text.replace("*", "").replace('"', "").replace("’", "'").lower().split())
+
+_CANNED = tuple(_normalize_reply(reply) for reply in CANNED_REPLIES)
+
+def is_canned_reply(answer: str) -> bool:
+    """Whether ``answer`` is just one of the fixed refusals from the answer prompt
+    
+    The medical-advice disclaimer often opens a substantive answer, which
+    must still be critiqued, so only a reply followed by a short tail counts.
+    """
+    normalized = _normalize_reply(answer)
+    return any(normalized.startswith(reply) and len(normalized) - len(reply) <= CANNED_TAIL_CHARS
+               for reply in _CANNED)
+
+class ReflectionPolicy:
+    """Decides per request whether the critic runs
+    
+    ``mode`` is ``adaptive`` (skip confident answers, defer when over the
+    latency budget), ``deferred`` (as adaptive, but every critique that would
+    run inline runs in the background instead) or ``always`` (the original
+    behaviour: critique every answer inline). At most ``max_deferred``
+    background critiques are pending at once, so a burst of deferred answers
+    cannot queue LLM calls without bound; the rest are dropped and counted.
+    """
+    def __init__(self, mode="adaptive", min_similarity=MIN_SIMILARITY, min_grounding=MIN_GROUNDING,
+                 latency_budget=LATENCY_BUDGET_SECONDS, max_deferred=MAX_DEFERRED):
+        if mode not in ("adaptive", "deferred", "always"):
+            raise ValueError(f"Unknown reflection mode: {mode}")
+        self.mode = mode
+        self.min_similarity = min_similarity
+        self.min_grounding = min_grounding
+        self.latency_budget = latency_budget
+        self.max_deferred = max_deferred
+        
+        self._lock = threading.Lock()
+        self.decisions = {CRITIQUE: 0, DEFER: 0, SKIP: 0}
+        self.deferred_pending = 0
+        self.deferred_dropped = 0
+    
+    def decide(self, docs: Sequence[Dict], context: str, answer: str, elapsed: float) -> Dict:
+        """Decision for an answer produced ``elapsed`` seconds into the request
+        
+        Returns the ``action`` (critique, defer or skip), the ``reason`` and
+        whether the answer is ``confident`` enough to treat as approved.
+        """
+        action, reason = self._decide(docs, context, answer, elapsed)
+        with self._lock:
+            self.decisions[action] += 1
+        return {"action": action, "reason": reason, "confident": reason.startswith("confident")}
+    
+    def _decide(self, docs: Sequence[Dict], context: str, answer: str, elapsed: float):
+        if self.mode == "always":
+            return CRITIQUE, "reflection mode is always"
+        if is_canned_reply(answer):
+            return SKIP, "canned reply"
+        
+        similarity = self._top_similarity(docs)
+        overlap = grounding(answer, context)
+        if similarity is not None and similarity >= self.min_similarity and overlap >= self.min_grounding:
+            return SKIP, f"confident (similarity {similarity:.2f}, grounding {overlap:.2f})"
+        
+        if self.mode == "deferred":
+            return DEFER, "reflection mode is deferred"
+        if elapsed >= self.latency_budget:
+            return DEFER, f"over latency budget ({elapsed:.1f}s)"
+        shown = "n/a" if similarity is None else f"{similarity:.2f}"
+        return CRITIQUE, f"low confidence (similarity {shown}, grounding {overlap:.2f})"
+    
+    def _top_similarity(self, docs: Sequence[Dict]) -> Optional[float]:
+        """Best dense similarity among the retrieved docs, None if none has one"""
+        similarities: List[float] = [doc["similarity"] for doc in docs if doc.get("similarity") is not None]
+        return max(similarities) if similarities else None
+    
+    def start_deferred(self) -> bool:
+        """Reserve a slot for a background critique; False (and counted as dropped) if none is free"""
+        with self._lock:
+            if self.deferred_pending >= self.max_deferred:
+                self.deferred_dropped += 1
+                return False
+            self.deferred_pending += 1
+            return True
+    
+    def finish_deferred(self):
+        """Free the slot of a background critique that finished"""
+        with self._lock:
+            self.deferred_pending -= 1
+    
+    def stats(self) -> Dict:
+        """Decision counts since startup, and background critiques pending and dropped"""
+        with self._lock:
+            return {"mode": self.mode, **self.decisions, "deferred_pending": self.deferred_pending,
+                    "deferred_dropped": self.deferred_dropped}
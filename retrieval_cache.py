@@ -0,0 +1,89 @@
+"""
+Exact-match cache of retrieval results keyed on a normalized query
+
+Rephrasings that differ only in case, whitespace or punctuation ("What is acne?",
+"what is  acne") share an entry; comparison operators and decimal points are
+kept, so "HbA1c > 7%" and "HbA1c < 7%", or "1.5 mg" and "1 5 mg", do not. Entries hold the ranked (vector id, similarity)
+pairs, not chunk text, so they are small and results are resolved against the
+chunk store on the way out. Eviction is LRU, and everything is dropped when the
+index version the results were computed on changes.
+"""
+
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from logger_config import get_logger
+
+_PUNCTUATION = re.compile(r"(?!(?<=\d)[.,]\d)[^\w\s<>=≤≥]")  # Keeps operators and 1.5 / 1,200
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_query(query: str) -> str:
+    """Cache key of a query: Unicode-normalized, case-folded, whitespace and most punctuation folded"""
+    query = unicodedata.normalize("NFKC", query).casefold()
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", query)).strip()
+
+class RetrievalCache:
+    """Bounded LRU map from normalized query to its ranked (vector id, similarity) pairs"""
+    def __init__(self, max_size: int = 2048):
+        self.max_size = max_size
+        self.logger = get_logger('cache')
+        self._entries = OrderedDict()  # normalized query -> ranking, least recently used first
+        self._version = None
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def get(self, query: str, version: Hashable) -> Optional[List[Tuple[int, Optional[float]]]]:
+        key = normalize_query(query)
+        with self._lock:
+            self._check_version(version)
+            ranking = self._entries.get(key)
+            if ranking is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return ranking
+    
+    def put(self, query: str, version: Hashable, ranking: List[Tuple[int, Optional[float]]]):
+        key = normalize_query(query)
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = list(ranking)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict:
+        """Hit/miss counters for monitoring"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+    
+    def _check_version(self, version: Hashable):
+        """Drop every entry if results now come from a different index"""
+        if version == self._version:
+            return
+        if self._entries:
+            self.logger.info("Index version changed, invalidating retrieval cache")
+            self._entries.clear()
+            self.invalidations += 1
+        self._version = version
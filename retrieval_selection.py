@@ -0,0 +1,79 @@
+"""
+Choosing the final retrieved chunks from an over-fetched candidate set
+
+The index is asked for many more candidates than the prompt takes, together
+with their vectors, and the final k are picked from that candidate matrix:
+1. Relevance threshold: candidates less similar to the query than
+   ``min_similarity`` are dropped, so an off-topic question gets no context
+   rather than the three least irrelevant chunks.
+2. Maximal marginal relevance: each pick maximizes
+   ``mmr_lambda * relevance - (1 - mmr_lambda) * similarity to the chunks already picked``,
+   so near-duplicate chunks do not fill the prompt with the same text.
+3. Per-source cap: at most ``max_per_source`` chunks of one source document.
+Every step is a vector operation over the candidates; the only Python loop
+runs once per chunk picked.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+SELECTION_FETCH_K = 50  # Candidates over-fetched per query
+SELECTION_MMR_LAMBDA = 0.7  # 1.0 ranks by relevance alone
+SELECTION_MAX_PER_SOURCE = 2  # 0 = no cap
+
+class ResultSelector:
+    """Picks the final k diverse, relevant chunks out of ``fetch_k`` scored candidates"""
+    def __init__(self, fetch_k: int = SELECTION_FETCH_K, min_similarity: float = 0.0,
+                 mmr_lambda: float = SELECTION_MMR_LAMBDA, max_per_source: int = SELECTION_MAX_PER_SOURCE):
+        if not 0.0 <= mmr_lambda <= 1.0:
+            raise ValueError(f"mmr_lambda must be between 0 and 1, got {mmr_lambda}")
+        self.fetch_k = fetch_k
+        self.min_similarity = min_similarity
+        self.mmr_lambda = mmr_lambda
+        self.max_per_source = max_per_source
+    
+    def select(self, k: int, relevance: np.ndarray, similarities: np.ndarray, vectors: np.ndarray,
+               source_ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """Positions of the (up to) ``k`` chosen candidates, in pick order
+        
+        ``relevance`` ranks candidates (higher is better; the dense similarity
+        or a fused score), ``similarities`` are dense similarities to the query
+        (NaN for candidates only BM25 found, which the threshold keeps),
+        ``vectors`` holds the vectors of the first ``len(vectors)`` candidates (any
+        after them have none and count as dissimilar to everything) and
+        ``source_ids`` identifies each candidate's source document.
+        """
+        n = len(relevance)
+        if n == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64)
+        available = ~(similarities < self.min_similarity)  # NaN compares False, so BM25-only candidates stay
+        cap = self.max_per_source > 0 and source_ids is not None
+        
+        mmr = self.mmr_lambda < 1.0
+        if mmr:
+            # One matrix-vector product per pick, scaled by inverse norms, instead of normalizing
+            # the whole candidate matrix (reconstructed PQ vectors are not exactly unit length)
+            squared_norms = np.einsum("ij,ij->i", vectors, vectors)
+            inverse_norms = np.divide(1.0, np.sqrt(squared_norms), out=np.zeros_like(squared_norms),
+                                      where=squared_norms > 0)
+            relevance = relevance * self.mmr_lambda
+        redundancy = np.zeros(n)  # (1 - mmr_lambda) * max cosine similarity to the chunks picked so far
+        with_vectors = redundancy[:len(vectors)]
+        
+        picked = []
+        rounds = min(k, n)
+        for pick in range(rounds):
+            if not available.any():
+                break
+            scores = relevance - redundancy if mmr else relevance
+            best = int(np.argmax(np.where(available, scores, -np.inf)))
+            picked.append(best)
+            available[best] = False
+            if mmr and pick < rounds - 1 and best < len(vectors):
+                similarity = (vectors @ vectors[best]) * (inverse_norms * inverse_norms[best])
+                np.maximum(with_vectors, (1.0 - self.mmr_lambda) * similarity, out=with_vectors)
+            if cap and np.count_nonzero(source_ids[picked] == source_ids[best]) >= self.max_per_source:
+                available &= source_ids != source_ids[best]
+        return np.asarray(picked, dtype=np.int64)
+
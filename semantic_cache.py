@@ -0,0 +1,161 @@
+"""
+Semantic answer cache: reuses approved answers for near-duplicate questions
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from logger_config import get_logger
+
+class SemanticCache:
+    """Cache of approved answers matched on query embedding cosine similarity
+    
+    Entries live in a fixed-size NumPy matrix of normalized embeddings, so a
+    lookup is one matrix-vector product. Eviction is LRU with an idle TTL, and
+    the whole cache is dropped when the FAISS index on disk changes or a new
+    index version is swapped in (``invalidate``).
+    """
+    def __init__(self, threshold=0.95, max_size=1000, ttl_seconds=3600, index_path="faiss_index"):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.index_path = index_path
+        self.logger = get_logger('cache')
+        
+        self._lock = threading.Lock()
+        self._vectors = None  # allocated on first insert, once the dimension is known
+        self._valid = np.zeros(max_size, dtype=bool)
+        self._last_used = np.zeros(max_size)  # time.time() of each slot's last insert or hit
+        self._entries = OrderedDict()  # slot -> entry, least recently used first
+        self._index_version = self._read_index_version()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def lookup(self, embedding: List[float]) -> Optional[Dict]:
+        """Return the cached entry closest to ``embedding`` above the threshold"""
+        query = self._normalize(embedding)
+        now = time.time()
+        
+        with self._lock:
+            self._check_index_version()
+            
+            if not self._entries:
+                self.misses += 1
+                return None
+            
+            # Expired entries are dropped before ranking, so they cannot hide a valid match
+            for slot in np.flatnonzero(self._valid & (now - self._last_used > self.ttl_seconds)):
+                self._evict(int(slot))
+            
+            scores = self._vectors @ query
+            scores[~self._valid] = -np.inf
+            slot = int(np.argmax(scores))
+            score = float(scores[slot])
+            
+            if score < self.threshold:
+                self.misses += 1
+                return None
+            
+            entry = self._entries[slot]
+            self._last_used[slot] = now
+            self._entries.move_to_end(slot)
+            self.hits += 1
+        
+        self.logger.info("Cache hit (similarity %.3f) for: '%s'", score, entry['question'])
+        return {**entry, "similarity": score}
+    
+    def add(self, embedding: List[float], question: str, answer: str, sources: int):
+        """Store an approved answer"""
+        vector = self._normalize(embedding)
+        
+        with self._lock:
+            self._check_index_version()
+            
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            
+            slot = self._free_slot()
+            self._vectors[slot] = vector
+            self._valid[slot] = True
+            self._last_used[slot] = time.time()
+            self._entries[slot] = {
+                "question": question,
+                "answer": answer,
+                "sources": sources
+            }
+        
+        self.logger.debug("Cached answer for: '%s' (%d/%s)", question, len(self._entries), self.max_size)
+    
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._clear()
+    
+    def invalidate(self, reason: str):
+        """Drop all entries because the knowledge base behind them changed"""
+        with self._lock:
+            self.logger.info("Invalidating semantic cache: %s", reason)
+            self._clear()
+            self.invalidations += 1
+    
+    def stats(self) -> Dict:
+        """Hit/miss counters for monitoring"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+    
+    def _free_slot(self) -> int:
+        """Find an empty slot, evicting expired or least recently used entries"""
+        expired = np.flatnonzero(self._valid & (time.time() - self._last_used > self.ttl_seconds))
+        for slot in expired:
+            self._evict(int(slot))
+        
+        if len(self._entries) >= self.max_size:
+            self._evict(next(iter(self._entries)))
+        
+        return int(np.argmin(self._valid))
+    
+    def _evict(self, slot: int):
+        self._valid[slot] = False
+        del self._entries[slot]
+        self.evictions += 1
+    
+    def _clear(self):
+        self._valid[:] = False
+        self._entries.clear()
+    
+    def _check_index_version(self):
+        """Invalidate everything if build_faiss_db.py rewrote the index"""
+        version = self._read_index_version()
+        if version != self._index_version:
+            self.logger.info("FAISS index changed on disk, invalidating semantic cache")
+            self._clear()
+            self._index_version = version
+            self.invalidations += 1
+    
+    def _read_index_version(self):
+        try:
+            return os.stat(os.path.join(self.index_path, "index.faiss")).st_mtime_ns
+        except OSError:
+            return None
+    
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,239 @@
+"""
+Per-session conversation history with pluggable storage backends
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Dict, List, Tuple
+
+from logger_config import get_logger
+
+DEFAULT_SESSION = "default"  # Session used by the CLI and callers without an id
+HISTORY_SIZE = 5  # Exchanges kept per session
+SESSION_COOKIE = "session_id"
+SESSION_HEADER = "X-Session-ID"
+_SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class SessionStore(ABC):
+    """Interface for conversation history storage keyed by session id
+    
+    History is a list of (question, answer) tuples, oldest first, holding at
+    most ``history_size`` exchanges. A backend missing any of the abstract
+    methods cannot be instantiated.
+    """
+    def __init__(self, history_size=HISTORY_SIZE, idle_ttl=3600):
+        self.history_size = history_size
+        self.idle_ttl = idle_ttl
+        self.logger = get_logger('session')
+    
+    @abstractmethod
+    def get_history(self, session_id: str) -> List[Tuple[str, str]]:
+        """Exchanges of the session, oldest first"""
+    
+    @abstractmethod
+    def append(self, session_id: str, question: str, answer: str):
+        """Add an exchange, dropping the oldest beyond ``history_size``"""
+    
+    @abstractmethod
+    def clear(self, session_id: str):
+        """Forget the session's history"""
+    
+    @abstractmethod
+    def stats(self) -> Dict:
+        """Counters for /health"""
+
+class MemorySessionStore(SessionStore):
+    """In-process store: a ring buffer per session, LRU-bounded with idle TTL"""
+    def __init__(self, max_sessions=50000, history_size=HISTORY_SIZE, idle_ttl=3600):
+        super().__init__(history_size, idle_ttl)
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # session_id -> [last_seen, deque of (question, answer)]
+        self.evictions = 0
+    
+    def get_history(self, session_id: str) -> List[Tuple[str, str]]:
+        with self._lock:
+            session = self._touch(session_id, create=False)
+            return list(session[1]) if session else []
+    
+    def append(self, session_id: str, question: str, answer: str):
+        with self._lock:
+            self._touch(session_id, create=True)[1].append((question, answer))
+    
+    def clear(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+    
+    def stats(self) -> Dict:
+        return {
+            "backend": "memory",
+            "active_sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "evictions": self.evictions
+        }
+    
+    def _touch(self, session_id: str, create: bool):
+        """Fetch a session, marking it most recently used and expiring idle ones"""
+        now = time.time()
+        self._expire(now)
+        
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            if len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+            session = self._sessions[session_id] = [now, deque(maxlen=self.history_size)]
+        
+        session[0] = now
+        self._sessions.move_to_end(session_id)
+        return session
+    
+    def _expire(self, now: float):
+        """Drop idle sessions; the LRU order makes the oldest ones come first"""
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session[0] <= self.idle_ttl:
+                break
+            del self._sessions[session_id]
+            self.evictions += 1
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite-backed store shared by every worker process on a host"""
+    PURGE_EVERY = 1000  # Appends between sweeps of idle sessions
+    
+    def __init__(self, path="sessions.db", history_size=HISTORY_SIZE, idle_ttl=3600):
+        super().__init__(history_size, idle_ttl)
+        self.path = path
+        self._local = threading.local()
+        self._appends = 0
+        
+        with self._connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    last_seen REAL NOT NULL,
+                    next_seq INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS exchanges (
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    question TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    PRIMARY KEY (session_id, seq)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen);
+            """)
+    
+    def get_history(self, session_id: str) -> List[Tuple[str, str]]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT last_seen FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return []
+        if time.time() - row[0] > self.idle_ttl:
+            self.clear(session_id)
+            return []
+        
+        rows = conn.execute(
+            "SELECT question, answer FROM exchanges WHERE session_id = ? ORDER BY seq",
+            (session_id,)
+        ).fetchall()
+        return [(question, answer) for question, answer in rows]
+    
+    def append(self, session_id: str, question: str, answer: str):
+        conn = self._connection()
+        with conn:
+            seq = conn.execute(
+                """
+                INSERT INTO sessions (session_id, last_seen, next_seq) VALUES (?, ?, 1)
+                ON CONFLICT (session_id) DO UPDATE
+                    SET last_seen = excluded.last_seen, next_seq = next_seq + 1
+                RETURNING next_seq - 1
+                """,
+                (session_id, time.time())
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO exchanges (session_id, seq, question, answer) VALUES (?, ?, ?, ?)",
+                (session_id, seq, question, answer)
+            )
+            # Ring buffer: drop exchanges that fell out of the window
+            conn.execute(
+                "DELETE FROM exchanges WHERE session_id = ? AND seq <= ?",
+                (session_id, seq - self.history_size)
+            )
+        
+        self._appends += 1
+        if self._appends % self.PURGE_EVERY == 0:
+            self.purge_expired()
+    
+    def clear(self, session_id: str):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM exchanges WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+    
+    def purge_expired(self):
+        """Delete sessions idle for longer than the TTL"""
+        cutoff = time.time() - self.idle_ttl
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "DELETE FROM exchanges WHERE session_id IN "
+                "(SELECT session_id FROM sessions WHERE last_seen < ?)",
+                (cutoff,)
+            )
+            purged = conn.execute("DELETE FROM sessions WHERE last_seen < ?", (cutoff,)).rowcount
+        self.logger.info("Purged %s idle sessions", purged)
+    
+    def stats(self) -> Dict:
+        count = self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {"backend": "sqlite", "active_sessions": count, "path": self.path}
+    
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets worker processes read while one writes
+        
+        A connection must not be used across fork(): a worker forked from a
+        preloaded master (gunicorn --preload) opens its own instead of reusing
+        the one its thread-local inherited.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+def create_session_store() -> SessionStore:
+    """Build the session store selected by SESSION_BACKEND (memory or sqlite)"""
+    backend = os.getenv("SESSION_BACKEND", "memory")
+    idle_ttl = int(os.getenv("SESSION_IDLE_TTL", "3600"))
+    
+    if backend == "sqlite":
+        return SQLiteSessionStore(
+            path=os.getenv("SESSION_DB_PATH", "sessions.db"),
+            idle_ttl=idle_ttl
+        )
+    if backend == "memory":
+        return MemorySessionStore(
+            max_sessions=int(os.getenv("SESSION_MAX", "50000")),
+            idle_ttl=idle_ttl
+        )
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+
+def resolve_session_id(headers, cookies) -> Tuple[str, bool]:
+    """Session id from the request header or cookie; returns (session_id, is_new)"""
+    session_id = headers.get(SESSION_HEADER) or cookies.get(SESSION_COOKIE)
+    if session_id and _SESSION_ID_PATTERN.match(session_id):
+        return session_id, False
+    return uuid.uuid4().hex, True
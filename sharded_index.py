@@ -0,0 +1,447 @@
+"""
+Sharded FAISS index with scatter-gather search
+
+build_faiss_db.py --shards N partitions chunks by source document into N
+shards, each a complete index directory (index.faiss, chunk store,
+index_config.json) under one index version:
+
+    shards.json                     shard directories and sizes, in global id order
+    shard_00/, shard_01/, ...
+    bm25_*, manifest.json           over all chunks, by global id
+
+Global vector ids are a shard's offset plus its local id, so BM25, the
+retrieval cache and ChunkViews work unchanged. At query time each shard
+is searched by its own process pool, so one query uses a core per shard
+and concurrent queries scale with SHARD_WORKERS. Results are merged by
+distance with a heap. Shards that do not answer within the deadline are
+left out of that result and logged rather than failing the request.
+"""
+
+import bisect
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import Future, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from chunk_store import ChunkStore, MmapVectorStore, write_chunk_store
+from index_factory import INDEX_FILE, apply_search_params, build_index, load_index_config, save_index_config
+from logger_config import get_logger
+
+SHARDS_FILE = "shards.json"  # Shard directories and sizes, in global id order
+SHARD_DEADLINE = 1.0  # Seconds to wait for shards before merging whatever answered
+SHARD_STARTUP_TIMEOUT = 120.0  # Seconds to wait for new shard processes to open their index
+
+def shard_of(source: str, num_shards: int) -> int:
+    """Shard of a source document; stable across builds, so its chunks always land together"""
+    return int.from_bytes(hashlib.sha1(source.encode("utf-8")).digest()[:8], "little") % num_shards
+
+def is_sharded(path: str) -> bool:
+    """Whether ``path`` holds a sharded index"""
+    return os.path.exists(os.path.join(path, SHARDS_FILE))
+
+def open_chunk_store(path: str):
+    """Chunk store of a plain or sharded index directory, indexed by global vector id"""
+    return ShardedChunkStore.open(path) if is_sharded(path) else ChunkStore(path)
+
+class ShardedIndex:
+    """Build side: one trained and filled FAISS index per shard, with the config each used"""
+    def __init__(self, indexes: List[faiss.Index], configs: List[Dict]):
+        self.indexes = indexes
+        self.configs = configs
+    
+    @property
+    def ntotal(self) -> int:
+        return sum(index.ntotal for index in self.indexes)
+
+def build_sharded_index(chunks: List[Document], vectors: np.ndarray, manifest: Dict, index_config: Dict,
+                        num_shards: int) -> Tuple[ShardedIndex, List[Document], Dict]:
+    """Partition chunks by source document and build an index per shard
+    
+    Returns the sharded index, the chunks reordered into global id order
+    (shard by shard) and the manifest with its files in that same order.
+    """
+    shard_ids = np.asarray([shard_of(chunk.metadata["source"], num_shards) for chunk in chunks], dtype=np.int64)
+    order = np.argsort(shard_ids, kind="stable")
+    chunks = [chunks[i] for i in order]
+    vectors = vectors[order]
+    sizes = np.bincount(shard_ids, minlength=num_shards)
+    manifest["files"] = dict(sorted(manifest["files"].items(), key=lambda item: shard_of(item[0], num_shards)))
+    index_config["shards"] = num_shards
+    
+    indexes, configs = [], []
+    start = 0
+    for shard, size in enumerate(sizes):
+        part = np.ascontiguousarray(vectors[start:start + size])
+        start += size
+        # build_index scales clusters down to the shard's size; an empty shard has nothing to train on
+        config = dict(index_config) if size else {"type": "flat"}
+        index = build_index(part, config) if size else faiss.IndexFlatL2(vectors.shape[1])
+        index.add(part)
+        print(f"🧩 Shard {shard}: {size} vectors ({config['type']})")
+        indexes.append(index)
+        configs.append(config)
+    return ShardedIndex(indexes, configs), chunks, manifest
+
+def save_sharded_index(index: ShardedIndex, chunks: List[Document], path: str):
+    """Write each shard's index, chunk store and config, then shards.json"""
+    shards = []
+    start = 0
+    for i, (shard_index, config) in enumerate(zip(index.indexes, index.configs)):
+        name = f"shard_{i:02d}"
+        shard_path = os.path.join(path, name)
+        os.makedirs(shard_path, exist_ok=True)
+        faiss.write_index(shard_index, os.path.join(shard_path, INDEX_FILE))
+        part = chunks[start:start + shard_index.ntotal]
+        write_chunk_store(shard_path, (chunk.page_content for chunk in part), (chunk.metadata for chunk in part))
+        save_index_config(config, shard_path)
+        shards.append({"path": name, "size": shard_index.ntotal})
+        start += shard_index.ntotal
+    with open(os.path.join(path, SHARDS_FILE), "w") as f:
+        json.dump({"shards": shards}, f)
+
+def _read_shards(path: str) -> List[Dict]:
+    with open(os.path.join(path, SHARDS_FILE)) as f:
+        return json.load(f)["shards"]
+
+class ShardedChunkStore:
+    """Chunk stores of all shards behind one global vector id space"""
+    def __init__(self, path: str, stores: List[ChunkStore]):
+        self.path = path
+        self.stores = stores
+        self.offsets = [0] + list(itertools.accumulate(len(store) for store in stores))
+    
+    @classmethod
+    def open(cls, path: str) -> "ShardedChunkStore":
+        return cls(path, [ChunkStore(os.path.join(path, shard["path"])) for shard in _read_shards(path)])
+    
+    def __len__(self):
+        return self.offsets[-1]
+    
+    def locate(self, i: int) -> Tuple[ChunkStore, int]:
+        """Store and local id of global vector id ``i``"""
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        shard = bisect.bisect_right(self.offsets, i) - 1
+        return self.stores[shard], i - self.offsets[shard]
+    
+    def text(self, i: int) -> str:
+        store, local = self.locate(i)
+        return store.text(local)
+    
+    def metadata(self, i: int) -> Dict:
+        store, local = self.locate(i)
+        return store.metadata(local)
+    
+    def document(self, i: int) -> Document:
+        store, local = self.locate(i)
+        return store.document(local)
+    
+    def source_ids(self, ids: np.ndarray) -> np.ndarray:
+        """Source document number of each of ``ids``, unique across shards"""
+        ids = np.asarray(ids, dtype=np.int64)
+        shards = np.searchsorted(self.offsets, ids, side="right") - 1
+        result = np.empty(len(ids), dtype=np.int64)
+        for shard in np.unique(shards):
+            mask = shards == shard
+            local = self.stores[shard].source_ids(ids[mask] - self.offsets[shard]).astype(np.int64)
+            result[mask] = (int(shard) << 32) | local
+        return result
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sharded_index_worker.py")
+
+class _ShardPool:
+    """Processes searching one shard, with an executor-like ``submit``
+    
+    Each process runs sharded_index_worker.py as its own script, so it
+    imports only the search code and never the server's main script.
+    Requests are queued and taken by whichever process is free. If a process
+    dies, its request and every later one fail with BrokenProcessPool.
+    """
+    def __init__(self, path: str, workers: int, nprobe: Optional[int], ef_search: Optional[int]):
+        self._requests = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._broken = None
+        self.ready = []  # Per process, finishes once it has opened the shard
+        self._processes = []
+        args = [sys.executable, WORKER_SCRIPT, path, str(nprobe or ""), str(ef_search or "")]
+        for _ in range(workers):
+            process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            ready = Future()
+            self._processes.append(process)
+            self.ready.append(ready)
+            threading.Thread(target=self._serve, args=(process, ready), name="shard-pool", daemon=True).start()
+    
+    def submit(self, task: str, queries: np.ndarray, k: int) -> Future:
+        """Queue a "search" or "search_vectors" request for the next free process"""
+        future = Future()
+        with self._lock:
+            if self._broken:
+                raise BrokenProcessPool(self._broken)
+            self._requests.put((future, task, queries, k))
+        return future
+    
+    def shutdown(self):
+        """Stop the processes and fail requests still queued"""
+        self._break("Shard pool was shut down")
+    
+    def _serve(self, process: subprocess.Popen, ready: Future):
+        """Feed queued requests to one process and resolve their futures with its replies"""
+        future = None
+        try:
+            pickle.load(process.stdout)
+            ready.set_result(True)
+            while True:
+                request = self._requests.get()
+                if request is None:
+                    return
+                future, task, queries, k = request
+                if not future.set_running_or_notify_cancel():
+                    continue
+                pickle.dump((task, queries, k), process.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+                process.stdin.flush()
+                ok, result = pickle.load(process.stdout)
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+                future = None
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError) as e:
+            error = BrokenProcessPool(f"Shard process {process.pid} stopped: {e!r}")
+            for pending in (ready, future):
+                if pending is not None and not pending.done():
+                    pending.set_exception(error)
+            self._break(str(error))
+        finally:
+            process.wait()
+    
+    def _break(self, reason: str):
+        with self._lock:
+            if self._broken:
+                return
+            self._broken = reason
+        for process in self._processes:
+            process.kill()
+        while True:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None and request[0].set_running_or_notify_cancel():
+                request[0].set_exception(BrokenProcessPool(reason))
+        for _ in self._processes:
+            self._requests.put(None)
+
+def _shutdown_pools(pools: Dict):
+    """Stop the shard processes, unless they belong to the process we were forked from"""
+    if pools["pid"] != os.getpid():
+        return
+    for executor in pools["executors"]:
+        if executor is not None:
+            executor.shutdown()
+
+class ShardsUnavailableError(RuntimeError):
+    """No shard answered a search within the deadline"""
+
+class ShardedVectorStore(MmapVectorStore):
+    """Read-only vector store fanning searches out to one process pool per shard
+    
+    Shard processes start on first search (or ``warm_up``) in the process
+    that searches, so a preloaded store is safe to fork. Searches wait for
+    them to open their shard before the deadline starts. They stop when the
+    store is garbage-collected, e.g. after an index hot-swap.
+    """
+    def __init__(self, path: str, chunks: ShardedChunkStore, embedding: Embeddings, dimension: int,
+                 deadline: float = SHARD_DEADLINE, workers_per_shard: int = 1, nprobe: Optional[int] = None,
+                 ef_search: Optional[int] = None, version=None):
+        super().__init__(None, chunks, embedding, version=version)
+        self.path = path
+        self.dimension = dimension
+        self.deadline = deadline
+        self.workers_per_shard = workers_per_shard
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.logger = get_logger('retriever')
+        
+        self.searches = 0
+        self.partial = 0  # Searches merged without every shard
+        self.timeouts = [0] * len(chunks.stores)
+        self.failures = [0] * len(chunks.stores)
+        self._lock = threading.Lock()
+        # Per shard: its process pool and the futures that finish once its processes opened the shard
+        self._pools = {"pid": os.getpid(), "executors": [None] * len(chunks.stores),
+                       "ready": [[] for _ in chunks.stores]}
+        weakref.finalize(self, _shutdown_pools, self._pools)
+    
+    @classmethod
+    def load(cls, path: str, embedding: Embeddings, **kwargs) -> "ShardedVectorStore":
+        """Open the chunk stores of the shards in ``path``; their indexes are mapped by the shard processes"""
+        chunks = ShardedChunkStore.open(path)
+        dimension = 0
+        for store in chunks.stores:
+            index = faiss.read_index(os.path.join(store.path, INDEX_FILE), faiss.IO_FLAG_MMAP)
+            if index.ntotal != len(store):
+                raise ValueError(f"Shard {store.path} has {index.ntotal} vectors but {len(store)} chunks")
+            dimension = index.d
+        shards_file = os.path.join(path, SHARDS_FILE)
+        return cls(path, chunks, embedding, dimension,
+                   version=(os.path.realpath(path), os.stat(shards_file).st_mtime_ns), **kwargs)
+    
+    @property
+    def num_shards(self) -> int:
+        return len(self.chunks.stores)
+    
+    def page_in(self, block_size: int = 1 << 20) -> int:
+        """Read every file of every shard once so its pages sit in the OS cache; returns bytes read"""
+        buffer = bytearray(block_size)
+        total = 0
+        for directory, _, names in os.walk(self.path):
+            for name in sorted(names):
+                with open(os.path.join(directory, name), "rb", buffering=0) as f:
+                    while True:
+                        read = f.readinto(buffer)
+                        if not read:
+                            break
+                        total += read
+        return total
+    
+    def warm_up(self):
+        """Start every shard process and have it search once, with no deadline"""
+        queries = np.zeros((1, self.dimension), dtype=np.float32)
+        futures = []
+        for executor in self._executors():
+            for _ in range(self.workers_per_shard):
+                futures.append(executor.submit("search", queries, 1))
+        for future in futures:
+            future.result()
+    
+    def search_ids(self, embedding: List[float], k: int = 4) -> List[Tuple[int, float]]:
+        """Top ``k`` (global vector id, L2 distance) pairs, nearest first"""
+        return self.search_ids_batch([embedding], k)[0]
+    
+    def search_ids_batch(self, embeddings: List[List[float]], k: int = 4) -> List[List[Tuple[int, float]]]:
+        """Search all shards in parallel and merge each query's top ``k`` across them"""
+        per_shard = []
+        for shard, (distances, ids) in self._scatter(embeddings, "search", k):
+            offset = self.chunks.offsets[shard]
+            per_shard.append([[(float(distance), offset + int(i)) for i, distance in zip(row_ids, row_distances)
+                               if i != -1] for row_ids, row_distances in zip(ids, distances)])
+        
+        # Each shard's results are sorted by distance, so a heap merge yields the global order
+        return [[(i, distance) for distance, i in itertools.islice(heapq.merge(*rankings), k)]
+                for rankings in zip(*per_shard)]
+    
+    def search_vectors_batch(self, embeddings: List[List[float]],
+                             k: int = 4) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """MmapVectorStore.search_vectors_batch across all shards, merged into each query's top ``k``"""
+        all_ids, all_distances, all_vectors = [], [], []
+        for shard, (distances, ids, vectors) in self._scatter(embeddings, "search_vectors", k):
+            missing = ids == -1
+            all_ids.append(np.where(missing, -1, ids + self.chunks.offsets[shard]))
+            all_distances.append(np.where(missing, np.inf, distances))
+            all_vectors.append(vectors)
+        ids, distances = np.concatenate(all_ids, axis=1), np.concatenate(all_distances, axis=1)
+        vectors = np.concatenate(all_vectors, axis=1)
+        top = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return (np.take_along_axis(ids, top, axis=1), np.take_along_axis(distances, top, axis=1),
+                np.take_along_axis(vectors, top[:, :, None], axis=1))
+    
+    def _scatter(self, embeddings: List[List[float]], task: str, k: int) -> List[Tuple[int, Tuple]]:
+        """(shard, result) of ``task`` for every shard that answered within the deadline"""
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), self.dimension)
+        futures = {}
+        for shard, executor in enumerate(self._executors()):
+            try:
+                futures[executor.submit(task, queries, k)] = shard
+            except BrokenProcessPool as e:
+                self._failed(shard, e)
+        done, late = wait(futures, timeout=self.deadline)
+        
+        results = []
+        for future in done:
+            shard = futures[future]
+            try:
+                results.append((shard, future.result()))
+            except Exception as e:
+                self._failed(shard, e)
+        for future in late:
+            future.cancel()
+            with self._lock:
+                self.timeouts[futures[future]] += 1
+        
+        with self._lock:
+            self.searches += 1
+            if len(results) < self.num_shards:
+                self.partial += 1
+        if not results:
+            raise ShardsUnavailableError(f"None of {self.num_shards} shards answered within {self.deadline}s")
+        if late:
+            self.logger.warning("Shards %s missed the %.0f ms deadline, merging %d of %d",
+                                sorted(futures[future] for future in late), self.deadline * 1000,
+                                len(results), self.num_shards)
+        return results
+    
+    def stats(self) -> Dict:
+        """Search, partial-result and per-shard timeout/failure counters for monitoring"""
+        with self._lock:
+            return {
+                "shards": self.num_shards,
+                "sizes": [len(store) for store in self.chunks.stores],
+                "workers_per_shard": self.workers_per_shard,
+                "deadline_ms": round(self.deadline * 1000),
+                "searches": self.searches,
+                "partial": self.partial,
+                "timeouts": list(self.timeouts),
+                "failures": list(self.failures)
+            }
+    
+    def _executors(self) -> List[_ShardPool]:
+        """Process pool of every shard, started on first use in this process
+        
+        Waits, outside any search deadline, until new processes have opened
+        their shard, so a cold search or one after a crashed pool was replaced
+        does not time out on process startup.
+        """
+        with self._lock:
+            if self._pools["pid"] != os.getpid():
+                # Forked: the parent's shard processes are not ours to use
+                self._pools["pid"] = os.getpid()
+                self._pools["executors"][:] = [None] * self.num_shards
+                self._pools["ready"][:] = [[] for _ in range(self.num_shards)]
+            for shard, executor in enumerate(self._pools["executors"]):
+                if executor is None:
+                    executor = _ShardPool(self.chunks.stores[shard].path, self.workers_per_shard,
+                                          self.nprobe, self.ef_search)
+                    self._pools["executors"][shard] = executor
+                    self._pools["ready"][shard] = executor.ready
+            executors = list(self._pools["executors"])
+            starting = [future for futures in self._pools["ready"] for future in futures if not future.done()]
+        
+        if starting:
+            start = time.perf_counter()
+            wait(starting, timeout=SHARD_STARTUP_TIMEOUT)  # A pool that failed to start breaks the search below
+            self.logger.info("Waited %.0f ms for shard processes to start", (time.perf_counter() - start) * 1000)
+        return executors
+    
+    def _failed(self, shard: int, error: Exception):
+        """Count a failed shard search; a crashed pool is replaced on the next search"""
+        self.logger.error("Shard %d search failed: %s", shard, error)
+        with self._lock:
+            self.failures[shard] += 1
+            if isinstance(error, BrokenProcessPool):
+                self._pools["executors"][shard] = None
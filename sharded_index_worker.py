@@ -0,0 +1,48 @@
+"""
+Search process for one shard of a sharded index, started by sharded_index.py
+
+Usage: python sharded_index_worker.py SHARD_DIR [NPROBE] [EF_SEARCH]
+
+Maps the shard's index, replies "ready", then answers pickled
+(task, queries, k) requests from stdin with pickled (ok, result) replies on
+stdout until stdin is closed. It imports only faiss and the index helpers,
+never the server script that started it.
+"""
+
+import os
+import pickle
+import sys
+
+import faiss
+
+from index_factory import INDEX_FILE, apply_search_params, load_index_config
+
+def _reply(stream, message):
+    pickle.dump(message, stream, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.flush()
+
+def main():
+    requests, replies = sys.stdin.buffer, sys.stdout.buffer
+    sys.stdout = sys.stderr  # Stray prints must not corrupt the reply stream
+    path = sys.argv[1]
+    nprobe, ef_search = (int(arg) if arg else None for arg in (sys.argv[2:] + ["", ""])[:2])
+    
+    # One thread per process: parallelism comes from the shard processes
+    faiss.omp_set_num_threads(1)
+    index = faiss.read_index(os.path.join(path, INDEX_FILE), faiss.IO_FLAG_MMAP)
+    apply_search_params(index, load_index_config(path), nprobe=nprobe, ef_search=ef_search)
+    tasks = {"search": index.search, "search_vectors": index.search_and_reconstruct}
+    _reply(replies, (True, "ready"))
+    
+    while True:
+        try:
+            task, queries, k = pickle.load(requests)
+        except EOFError:
+            return
+        try:
+            _reply(replies, (True, tasks[task](queries, k)))
+        except Exception as e:
+            _reply(replies, (False, e))
+
+if __name__ == "__main__":
+    main()
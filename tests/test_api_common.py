@@ -0,0 +1,11 @@
+from api_common import MAX_BATCH_SIZE, parse_batch
+
+def test_batch_body_must_be_an_object_with_a_list_of_questions():
+    for body in (None, ["What is acne?"], "What is acne?", {"questions": 5}, {"questions": []}):
+        questions, error = parse_batch(body)
+        assert error and questions == []
+
+def test_batch_size_and_question_types_are_checked():
+    assert parse_batch({"questions": ["q"] * (MAX_BATCH_SIZE + 1)})[1]
+    assert parse_batch({"questions": ["What is acne?", " "]})[1]
+    assert parse_batch({"questions": ["What is acne?"]}) == (["What is acne?"], None)
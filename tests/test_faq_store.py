@@ -0,0 +1,21 @@
+from faq_store import FaqStore, faq_key, write_faq_store
+
+def _store(tmp_path, questions):
+    entries = [{"question": question, "answer": f"Answer to {question}", "keys": [faq_key(question)],
+                "chunk_ids": [1], "fingerprints": [2], "sources": 1, "count": 3, "index_version": None}
+               for question in questions]
+    write_faq_store(str(tmp_path / "faq_store"), entries)
+    return FaqStore(str(tmp_path / "faq_store"))
+
+def test_case_spacing_and_trailing_punctuation_match(tmp_path):
+    store = _store(tmp_path, ["What is acne?"])
+    assert store.lookup("what is  ACNE")["answer"] == "Answer to What is acne?"
+    assert store.lookup("What is acne?!")["question"] == "What is acne?"
+
+def test_comparison_operators_and_decimals_miss(tmp_path):
+    store = _store(tmp_path, ["Is HbA1c > 7% bad?", "Is 1.5 mg of melatonin safe?"])
+    assert store.lookup("is hba1c > 7% bad") is not None
+    assert store.lookup("Is HbA1c < 7% bad?") is None
+    assert store.lookup("Is HbA1c 7% bad?") is None
+    assert store.lookup("Is 1 5 mg of melatonin safe?") is None
+    assert store.lookup("Is 15 mg of melatonin safe?") is None
@@ -0,0 +1,24 @@
+from reflection_policy import SKIP, ReflectionPolicy, is_canned_reply
+
+def test_canned_replies_match():
+    assert is_canned_reply("I don't know based on the provided context.")
+    assert is_canned_reply('**"I can share general information, but I can’t give medical advice."**')
+    assert is_canned_reply("I cannot engage in chit-chat. Please ask a medically relevant question.")
+
+def test_disclaimer_followed_by_dosage_is_not_canned():
+    answer = ("I can share general information, but I can't give medical advice. "
+              "Adults usually take 200–400 mg of ibuprofen every 4–6 hours, up to 1,200 mg a day.")
+    assert not is_canned_reply(answer)
+    decision = ReflectionPolicy().decide([], "", answer, 0.0)
+    assert decision["action"] != SKIP
+    assert not decision["confident"]
+
+def test_deferred_critiques_past_the_limit_are_dropped():
+    policy = ReflectionPolicy(max_deferred=2)
+    assert policy.start_deferred() and policy.start_deferred()
+    assert not policy.start_deferred()
+    policy.finish_deferred()
+    assert policy.start_deferred()
+    stats = policy.stats()
+    assert stats["deferred_pending"] == 2
+    assert stats["deferred_dropped"] == 1
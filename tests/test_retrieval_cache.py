@@ -0,0 +1,16 @@
+from retrieval_cache import RetrievalCache, normalize_query
+
+def test_rephrasings_share_an_entry():
+    cache = RetrievalCache()
+    cache.put("What is acne?", 1, [(3, 0.9)])
+    assert cache.get("what is  ACNE", 1) == [(3, 0.9)]
+
+def test_comparison_operators_and_decimals_are_kept():
+    assert normalize_query("Is HbA1c > 7% bad?") != normalize_query("Is HbA1c < 7% bad?")
+    assert normalize_query("Is HbA1c > 7% bad?") != normalize_query("Is HbA1c 7% bad?")
+    assert normalize_query("Is 1.5 mg safe?") != normalize_query("Is 1 5 mg safe?")
+    assert normalize_query("Is 1.5 mg safe?") == normalize_query("is 1.5 MG safe")
+    
+    cache = RetrievalCache()
+    cache.put("Is HbA1c > 7% bad?", 1, [(3, 0.9)])
+    assert cache.get("Is HbA1c < 7% bad?", 1) is None
@@ -0,0 +1,42 @@
+"""
+Token counting shared by the index builder, prompt assembly and usage metrics
+"""
+
+from typing import Iterable
+
+CHAT_ENCODING = "o200k_base"  # Tokenizer of gpt-4o, for prompts and completions
+EMBEDDING_ENCODING = "cl100k_base"  # Tokenizer of text-embedding-ada-002, for chunks sent to be embedded
+CHARS_PER_TOKEN = 4  # Rough estimate used when the tokenizer is unavailable
+
+_encodings = {}  # name -> tiktoken encoding, or None if it could not be loaded
+
+def _get_encoding(name: str):
+    """Load a tiktoken encoding once; it may need network access the first time"""
+    if name not in _encodings:
+        try:
+            import tiktoken
+            _encodings[name] = tiktoken.get_encoding(name)
+        except Exception:
+            _encodings[name] = None
+    return _encodings[name]
+
+def count_tokens(text: str, encoding_name: str = CHAT_ENCODING) -> int:
+    """Number of tokens in ``text``, estimated from its length if tiktoken is unavailable"""
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+def count_tokens_many(texts: Iterable[str], encoding_name: str = CHAT_ENCODING) -> int:
+    """Total tokens across ``texts``"""
+    return sum(count_tokens(text, encoding_name) for text in texts)
+
+def truncate_to_tokens(text: str, max_tokens: int, encoding_name: str = CHAT_ENCODING) -> str:
+    """Longest prefix of ``text`` within ``max_tokens`` tokens"""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
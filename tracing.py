@@ -0,0 +1,171 @@
+"""
+Request tracing and per-stage metrics
+
+Each request gets an id, carried in a context variable so it reaches logs
+from every component (threads and tasks started with a copied context
+inherit it). Timed spans feed Prometheus-style histograms served on /metrics,
+and a one-line summary of a request's spans is logged when it finishes.
+"""
+
+import bisect
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from token_counter import count_tokens
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # Seconds
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+REQUEST_ID_HEADER = "X-Request-ID"
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+_spans = contextvars.ContextVar("spans", default=None)  # (stage, seconds) of the current request
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+def current_request_id() -> Optional[str]:
+    """Id of the request being handled in this context, if any"""
+    return _request_id.get()
+
+def set_request_id(request_id: Optional[str] = None) -> str:
+    """Start a request in this context under ``request_id`` (a fresh id if None)"""
+    request_id = (request_id or new_request_id())[:64]
+    _request_id.set(request_id)
+    _spans.set([])
+    return request_id
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label set"""
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts, sum, count]
+    
+    def observe(self, value: float, *label_values: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+    
+    def render(self) -> List[str]:
+        """Lines of the Prometheus text exposition format"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count) in self._series.items())
+        for label_values, (counts, total, count) in series:
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+STAGE_SECONDS = Histogram(
+    "medical_agent_stage_seconds", "Time spent per request stage", ("stage",), LATENCY_BUCKETS
+)
+LLM_TOKENS = Histogram(
+    "medical_agent_llm_tokens", "Tokens per LLM call", ("stage", "direction"), TOKEN_BUCKETS
+)
+METRICS = (STAGE_SECONDS, LLM_TOKENS)
+
+_prompt_cache_lock = threading.Lock()
+_prompt_cache = {}  # stage -> [calls, prompt tokens, cached prompt tokens]
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a stage of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+@contextmanager
+def trace_request(logger, stage: str = "total", request_id: Optional[str] = None) -> Iterator[str]:
+    """Trace a request from start to end: a span for it as a whole and a summary line on ``logger``
+    
+    Reuses the id the API layer set for this context, if there is one.
+    """
+    id_token = _request_id.set(request_id or _request_id.get() or new_request_id())
+    spans_token = _spans.set([])
+    spans = _spans.get()
+    try:
+        with span(stage):
+            yield _request_id.get()
+    finally:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Trace: %s", " ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in spans))
+        _spans.reset(spans_token)
+        _request_id.reset(id_token)
+
+def _prompt_text(prompt) -> str:
+    """Text of a prompt given as a string or a list of chat messages"""
+    if isinstance(prompt, str):
+        return prompt
+    return "\n".join(str(message.content) for message in prompt)
+
+def record_llm_usage(stage: str, prompt, completion: str, usage: Optional[Dict] = None) -> Tuple[int, int]:
+    """Record prompt and completion tokens of an LLM call, from its usage metadata if present
+    
+    ``prompt`` is a string or a list of chat messages. When the provider reports
+    usage, the prompt tokens it served from its prefix cache are recorded too.
+    """
+    usage = usage or {}
+    prompt_tokens = usage.get("input_tokens") or count_tokens(_prompt_text(prompt))
+    completion_tokens = usage.get("output_tokens") or count_tokens(completion)
+    LLM_TOKENS.observe(prompt_tokens, stage, "prompt")
+    LLM_TOKENS.observe(completion_tokens, stage, "completion")
+    if usage.get("input_tokens"):
+        cached_tokens = (usage.get("input_token_details") or {}).get("cache_read") or 0
+        LLM_TOKENS.observe(cached_tokens, stage, "cached_prompt")
+        with _prompt_cache_lock:
+            totals = _prompt_cache.setdefault(stage, [0, 0, 0])
+            totals[0] += 1
+            totals[1] += prompt_tokens
+            totals[2] += cached_tokens
+    return prompt_tokens, completion_tokens
+
+def prompt_cache_stats() -> Dict:
+    """Prompt tokens served from the provider's prefix cache, per stage, over calls that reported usage"""
+    with _prompt_cache_lock:
+        totals = {stage: list(values) for stage, values in _prompt_cache.items()}
+    return {
+        stage: {
+            "calls": calls,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "hit_rate": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else 0.0
+        }
+        for stage, (calls, prompt_tokens, cached_tokens) in sorted(totals.items())
+    }
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+class RequestIdFilter:
+    """Logging filter adding the current request id to records as ``request_id``"""
+    def filter(self, record) -> bool:
+        record.request_id = _request_id.get() or "-"
+        return True